@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Offline microbenchmarks for the hot paths of the Modbus MQTT bridge.
+
+Covers register decoding for every data type and byte order, read plan
+building for large register maps, payload serialization (JSON and compact,
+single samples and batches), a full _read_registers cycle against an
+in-process simulator (also over a simulated 10 ms link, one block at a time
+and pipelined), the simulator's fleet update tick and startup: importing the
+bridge in a fresh interpreter and loading a config, parsed or from the
+config cache. No broker or hardware is needed.
+
+Results are printed as JSON so runs can be compared across commits:
+
+    python benchmarks/bench_bridge.py --output bench.json
+    python benchmarks/bench_bridge.py --quick --filter decode
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import modbus_mqtt_bridge as bridge
+from payload_codec import CompactEncoder, encode_json_batch
+from read_plan import build_read_plan, build_scan_groups
+from registers import BYTE_ORDERS, MAX_READ_REGISTERS, RegisterDefinition
+from sim_server import FaultProfile, SimulatorServer, VirtualDevice
+
+BYTE_ORDER_TYPES = ('int16', 'uint16', 'int32', 'uint32', 'float32', 'int64', 'uint64', 'float64',
+                    'string', 'bitfield')
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(SRC_DIR),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def measure(function, min_time: float, repeat: int) -> dict:
+    """Time ``function`` like timeit: calibrate a loop count, keep the best of ``repeat`` runs"""
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    best = min(runs)
+    return {
+        "best_us": round(best * 1e6, 3),
+        "mean_us": round(sum(runs) / len(runs) * 1e6, 3),
+        "ops_per_sec": round(1 / best, 1) if best else None,
+        "loops": number,
+        "repeat": repeat
+    }
+
+def make_config(registers, **overrides) -> bridge.AppConfig:
+    config = bridge.AppConfig(
+        modbus=bridge.ModbusConfig(host='127.0.0.1'),
+        mqtt=bridge.MQTTConfig(broker='127.0.0.1', backpressure='drop_oldest'),
+        registers=registers,
+        **overrides
+    )
+    return config
+
+def synthetic_registers(count: int, seed: int = 1) -> list:
+    """A register map of ``count`` points with mixed types and sparse addresses"""
+    rng = random.Random(seed)
+    registers = []
+    address = 30001
+    for index in range(count):
+        data_type = rng.choice(('uint16', 'int16', 'int32', 'uint32', 'float32'))
+        reg = RegisterDefinition(f"Point_{index}", address, data_type=data_type,
+                                 scale=rng.choice((1.0, 0.1, 0.01)),
+                                 byte_order=rng.choice(BYTE_ORDERS))
+        registers.append(reg)
+        address += reg.count + rng.choice((0, 0, 0, 1, 4, 20))
+    return registers
+
+def sample_for(registers) -> dict:
+    data = {}
+    for reg in registers:
+        if reg.data_type == 'string':
+            value = 'SN12345'
+        elif reg.data_type == 'bitfield':
+            value = 5
+        elif reg.decoder.values > 1:
+            value = [1.5] * reg.decoder.values
+        else:
+            value = 1234.5 if reg.scale != 1 or reg.data_type.startswith('float') else 1234
+        data[reg.name] = {"value": value, "unit": reg.unit, "address": reg.display_address}
+    return {"timestamp": time.time(), "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "loop_count": 1, "data": data}
+
+def bench_decode(results, min_time, repeat):
+    config = make_config([])
+    instance = bridge.ModbusMQTTBridge(config)
+    for data_type in BYTE_ORDER_TYPES:
+        for byte_order in BYTE_ORDERS:
+            count = 4 if data_type == 'string' else 1
+            reg = RegisterDefinition('Point', 30001, count=count, data_type=data_type,
+                                     byte_order=byte_order, scale=1.0)
+            words = [random.randrange(0x10000) for _ in range(reg.count)]
+            results[f"decode/{data_type}/{byte_order}"] = measure(
+                lambda: instance._process_register_value(reg, words), min_time, repeat)
+
+def bench_plan(results, min_time, repeat):
+    for count in (100, 1000, 5000):
+        registers = synthetic_registers(count)
+        results[f"plan/build_read_plan/{count}"] = measure(
+            lambda: build_read_plan(registers), min_time, repeat)
+        results[f"plan/build_scan_groups/{count}"] = measure(
+            lambda: build_scan_groups(registers, {}, 10, 10, MAX_READ_REGISTERS),
+            min_time, repeat)
+
+def bench_serialize(results, min_time, repeat):
+    for count in (20, 200):
+        registers = synthetic_registers(count)
+        sample = sample_for(registers)
+        encoder = CompactEncoder(registers)
+        batch = [sample] * 10
+        results[f"serialize/json/{count}"] = measure(lambda: json.dumps(sample), min_time, repeat)
+        results[f"serialize/compact/{count}"] = measure(lambda: encoder.encode(sample), min_time, repeat)
+        results[f"serialize/json_batch10/{count}"] = measure(
+            lambda: encode_json_batch(batch), min_time, repeat)
+        results[f"serialize/compact_batch10/{count}"] = measure(
+            lambda: encoder.encode_batch(batch), min_time, repeat)
+        results[f"serialize/json/{count}"]["bytes"] = len(json.dumps(sample))
+        results[f"serialize/compact/{count}"]["bytes"] = len(encoder.encode(sample))
+        results[f"serialize/json_batch10/{count}"]["bytes"] = len(encode_json_batch(batch))
+        results[f"serialize/compact_batch10/{count}"]["bytes"] = len(encoder.encode_batch(batch))
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(port: int, registers, latency_ms: float = 0) -> None:
+    """Serve the register map for unit 1 from the simulator on a background thread"""
+    device = VirtualDevice(1, max(reg.address + reg.count for reg in registers))
+    for reg in registers:
+        device.write(reg.register_type, reg.address, reg.decoder.encode(1))
+    server = SimulatorServer('127.0.0.1')
+    server.add_device(port, device)
+    if latency_ms:
+        server.set_faults({(port, None): FaultProfile(latency_ms=latency_ms)})
+    ready = threading.Event()
+
+    async def serve():
+        await server.start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    ready.wait(5)
+
+def bench_cycle(results, min_time, repeat):
+    for count in (20, 200):
+        port = _free_port()
+        config = make_config(synthetic_registers(count))
+        start_server(port, config.registers)
+        config.modbus.port = port
+        instance = bridge.ModbusMQTTBridge(config)
+        if not instance._connect_modbus():
+            results[f"cycle/read_registers/{count}"] = {"error": "server not reachable"}
+            continue
+        result = measure(instance._read_registers, min_time, repeat)
+        result["blocks"] = len(config.read_plan)
+        results[f"cycle/read_registers/{count}"] = result
+        instance._modbus_client.close()
+
+    # A slow link, read one block at a time and pipelined
+    registers = synthetic_registers(200)
+    for window in (1, 8):
+        port = _free_port()
+        config = make_config(registers)
+        start_server(port, config.registers, latency_ms=10)
+        config.modbus.port = port
+        config.modbus.pipeline_window = window
+        instance = bridge.ModbusMQTTBridge(config)
+        name = f"cycle/read_registers/200/latency_10ms/window_{window}"
+        if not instance._connect_modbus():
+            results[name] = {"error": "server not reachable"}
+            continue
+        result = measure(instance._read_registers, min_time, repeat)
+        result["blocks"] = len(config.read_plan)
+        results[name] = result
+        instance._modbus_client.close()
+
+def bench_simulator(results, min_time, repeat):
+    from sim_fleet import FleetModel
+    registers = bridge.load_config(os.path.join(SRC_DIR, '..', 'config', 'inverter.yaml')).registers
+    for devices in (1000, 10000):
+        model = FleetModel(registers, [1 + index % 247 for index in range(devices)], seed=0)
+        results[f"simulator/tick/{devices}"] = measure(model.update, min_time, repeat)
+
+def bench_startup(results, min_time, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import modbus_mqtt_bridge'], cwd=SRC_DIR, check=True)
+        runs.append(time.perf_counter() - start)
+    results["startup/import"] = {
+        "best_us": round(min(runs) * 1e6, 3),
+        "mean_us": round(sum(runs) / len(runs) * 1e6, 3),
+        "repeat": repeat
+    }
+    path = os.path.join(SRC_DIR, '..', 'config', 'inverter.yaml')
+    results["startup/config/parsed"] = measure(lambda: bridge.read_config(path), min_time, repeat)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        bridge.read_config(path, cache_dir=cache_dir)
+        results["startup/config/cached"] = measure(lambda: bridge.read_config(path, cache_dir=cache_dir),
+                                                   min_time, repeat)
+    finally:
+        shutil.rmtree(cache_dir)
+
+BENCHMARKS = {
+    'decode': bench_decode,
+    'plan': bench_plan,
+    'serialize': bench_serialize,
+    'cycle': bench_cycle,
+    'simulator': bench_simulator,
+    'startup': bench_startup,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--filter', action='append', choices=sorted(BENCHMARKS),
+                        help='only run these benchmark groups')
+    parser.add_argument('--quick', action='store_true', help='shorter runs for a smoke test')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(0)
+    min_time, repeat = (0.05, 3) if args.quick else (0.2, 5)
+
+    results = {}
+    for name in args.filter or BENCHMARKS:
+        BENCHMARKS[name](results, min_time, repeat)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 #!/bin/bash
-# A script to scan common subnets for a device (such as a Modbus inverter)
-# using both a ping sweep and an nmap port scan for port 502.
+# A script to scan common subnets for Modbus TCP devices (such as inverters)
+# and write a bridge config polling everything that answers.
 
 # Define a list of common IP subnets to scan.
 subnets=(
@@ -11,20 +11,12 @@ subnets=(
 #  "10.0.1.0/24"
 )
 
-for subnet in "${subnets[@]}"; do
-    echo "====================================="
-    echo "Scanning subnet: $subnet"
-    echo "-------------------------------------"
-    
-    # Ping sweep to list active hosts
-    echo "[*] Performing ping sweep on $subnet:"
-    nmap -sn "$subnet" | grep "Nmap scan report"
-    
-    # Scan for open Modbus TCP port (502)
-    echo ""
-    echo "[*] Scanning for open port 502 (Modbus TCP) on $subnet:"
-    nmap -p502 "$subnet" | grep "502/tcp" -A 2
-    echo ""
-done
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
-echo "Scan complete."
+python3 "$SCRIPT_DIR/../src/port_range_scan.py" "${subnets[@]}" \
+    --ports "${MODBUS_PORTS:-502}" \
+    --units "${MODBUS_UNITS:-1}" \
+    --identify \
+    --template "$SCRIPT_DIR/../config/config.yaml" \
+    --output "${OUTPUT:-discovered.yaml}" \
+    "$@"
@@ -0,0 +1,173 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from registers import RegisterDefinition
+
+class WindowStats:
+    """Running statistics of one register over one window, in constant memory.
+
+    For the time-weighted mean every sample holds until the next one, the
+    last sample of the previous window holds from the start of this one,
+    and a failed read ends the hold.
+    """
+
+    __slots__ = ('count', 'errors', 'minimum', 'maximum', 'total', 'held', 'held_since', 'area', 'span')
+
+    def __init__(self, held: Optional[float] = None, held_since: float = 0.0):
+        self.count = 0
+        self.errors = 0
+        self.minimum = self.maximum = None
+        self.total = 0.0
+        self.held = held  # the latest value and since when it holds
+        self.held_since = held_since
+        self.area = 0.0  # integral of the held values over time
+        self.span = 0.0  # time covered by a held value
+
+    def _hold(self, until: float) -> None:
+        if self.held is not None and until > self.held_since:
+            self.area += self.held * (until - self.held_since)
+            self.span += until - self.held_since
+            self.held_since = until
+
+    def add(self, value: float, timestamp: float) -> None:
+        self._hold(timestamp)
+        self.count += 1
+        self.total += value
+        if self.count == 1:
+            self.minimum = self.maximum = value
+        elif value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+        self.held, self.held_since = value, timestamp
+
+    def add_error(self, timestamp: float) -> None:
+        self._hold(timestamp)
+        self.errors += 1
+        self.held = None
+
+    def close(self, end: float, time_weighted: bool = False) -> Dict[str, Any]:
+        """Statistics of the window ending at ``end``"""
+        self._hold(end)
+        stats: Dict[str, Any] = {"count": self.count}
+        if self.count:
+            stats.update(min=self.minimum, max=self.maximum, mean=self.total / self.count, last=self.held)
+        if time_weighted and self.span:
+            stats["time_weighted_mean"] = self.area / self.span
+        if self.errors:
+            stats["errors"] = self.errors
+        return stats
+
+@dataclass
+class AggregationWindow:
+    """The current tumbling window of the registers sharing a window length"""
+    seconds: float
+    registers: Dict[str, RegisterDefinition]
+    start: Optional[float] = None  # wall clock time, None until the first sample
+    stats: Dict[str, WindowStats] = field(default_factory=dict)
+
+    @property
+    def end(self) -> float:
+        return self.start + self.seconds
+
+class WindowAggregator:
+    """Tumbling window statistics of the registers not published as raw samples.
+
+    Registers with ``publish: aggregate`` are taken out of each sample and
+    only published as count, min, max, mean and last of every window, and
+    optionally the time-weighted mean; ``both`` keeps them in the sample
+    too. Windows are aligned to multiples of their length in wall clock
+    time, so one minute windows close on the minute for every device, and
+    min and max still catch spikes between window ends. Every register keeps
+    a constant amount of state however many samples its window holds.
+    """
+
+    def __init__(self, registers: List[RegisterDefinition], default_window: float,
+                 time_weighted: bool = False, device: Optional[str] = None):
+        self.time_weighted = time_weighted
+        self.device = device
+        self._hidden = {reg.name for reg in registers if reg.publish == 'aggregate'}  # not published raw
+        self._windows: Dict[float, AggregationWindow] = {}
+        for reg in registers:
+            if reg.publish != 'raw':
+                seconds = reg.aggregate_window or default_window
+                window = self._windows.setdefault(seconds, AggregationWindow(seconds, {}))
+                window.registers[reg.name] = reg
+        self._closed: List[Dict[str, Any]] = []
+
+    def __bool__(self) -> bool:
+        return bool(self._windows)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """Wall clock time the next window closes, None before the first sample"""
+        ends = [window.end for window in self._windows.values() if window.start is not None]
+        return min(ends) if ends else None
+
+    def _message(self, window: AggregationWindow, end: float) -> Optional[Dict[str, Any]]:
+        data = {}
+        for name, stats in window.stats.items():
+            if stats.count or stats.errors:
+                reg = window.registers[name]
+                data[name] = {**stats.close(end, self.time_weighted), "unit": reg.unit,
+                              "address": reg.display_address}
+        if not data:
+            return None
+        message = {
+            "timestamp": end,
+            "datetime": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(end)),
+            "window": {"start": window.start, "end": end, "seconds": window.seconds},
+            "data": data,
+        }
+        if self.device:
+            message["device"] = self.device
+        return message
+
+    def _roll(self, window: AggregationWindow, now: float, final: bool = False) -> None:
+        """Close the window if it ended by ``now`` and start the one holding ``now``"""
+        if window.start is None:
+            return
+        if not final and now < window.end:
+            return
+        end = now if final else window.end
+        message = self._message(window, end)
+        if message:
+            self._closed.append(message)
+        if final:
+            window.start, window.stats = None, {}
+        elif now < window.end + window.seconds:
+            # The last value of a window holds into the next one
+            window.start = end
+            window.stats = {name: WindowStats(stats.held, end) for name, stats in window.stats.items()}
+        else:
+            # Nothing was read for a whole window
+            window.start = now - now % window.seconds
+            window.stats = {}
+
+    def add(self, data: Dict[str, Any], timestamp: float) -> Dict[str, Any]:
+        """Accumulate the aggregated registers of a sample's data and return the rest to publish raw"""
+        for window in self._windows.values():
+            self._roll(window, timestamp)
+            if window.start is None:
+                window.start = timestamp - timestamp % window.seconds
+            for name in window.registers:
+                point = data.get(name)
+                if point is None:
+                    continue
+                stats = window.stats.get(name)
+                if stats is None:
+                    stats = window.stats[name] = WindowStats()
+                value = point.get("value")
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats.add(value, timestamp)
+                else:
+                    stats.add_error(timestamp)
+        return {name: point for name, point in data.items() if name not in self._hidden}
+
+    def take(self, now: float, final: bool = False) -> List[Dict[str, Any]]:
+        """Messages of the windows that closed by ``now``, or of every open window when ``final``"""
+        for window in self._windows.values():
+            self._roll(window, now, final)
+        closed, self._closed = self._closed, []
+        return closed
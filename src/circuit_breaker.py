@@ -0,0 +1,78 @@
+import logging
+import random
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Health state machine of one device: closed, open or half-open.
+    
+    While closed the device is polled normally. After ``failure_threshold``
+    consecutive failed cycles (no connection, or no answer to a read) the
+    breaker opens and the device is skipped without any I/O until the
+    backoff expires. The next cycle is then let through as a half-open
+    probe: success closes the breaker, failure opens it again with twice
+    the backoff, up to ``backoff_max``. Every backoff is spread by
+    +/- ``jitter`` so a fleet that failed together does not retry together.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    
+    def __init__(self, name: str, failure_threshold: int = 3, backoff_initial: float = 1.0,
+                 backoff_max: float = 300.0, jitter: float = 0.2, rng: Optional[random.Random] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.backoff_initial = max(0.1, backoff_initial)
+        self.backoff_max = max(self.backoff_initial, backoff_max)
+        self.jitter = jitter
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0  # times the breaker opened
+        self._backoff = self.backoff_initial
+        self._retry_at = 0.0
+        self._rng = rng or random
+        self._clock = clock
+        
+    @property
+    def retry_at(self) -> Optional[float]:
+        """Monotonic time of the next probe while open"""
+        return self._retry_at if self.state == self.OPEN else None
+        
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Whether the device may be polled now, turning an expired open breaker half-open"""
+        if self.state == self.OPEN:
+            now = self._clock() if now is None else now
+            if now < self._retry_at:
+                return False
+            self.state = self.HALF_OPEN
+            logger.info("Device %s: probing after backoff", self.name)
+        return True
+        
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Device %s: responding again, resuming polling", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._backoff = self.backoff_initial
+        
+    def record_failure(self, now: Optional[float] = None) -> None:
+        self.failures += 1
+        if self.state == self.CLOSED and self.failures < self.failure_threshold:
+            return
+        now = self._clock() if now is None else now
+        if self.state == self.HALF_OPEN:
+            self._backoff = min(self._backoff * 2, self.backoff_max)
+        delay = self._backoff * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        self._retry_at = now + delay
+        if self.state == self.CLOSED:
+            self.opened += 1
+            logger.warning("Device %s: %d consecutive failures, skipping it for %.1fs",
+                           self.name, self.failures, delay)
+        else:
+            logger.warning("Device %s: probe failed, skipping it for %.1fs", self.name, delay)
+        self.state = self.OPEN
@@ -0,0 +1,97 @@
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from registers import DATA_TYPES, INTEGER_RANGES, RegisterDefinition
+
+class CommandError(ValueError):
+    """A write command rejected before it reached the device"""
+
+@dataclass
+class WriteCommand:
+    """A validated register write requested over MQTT"""
+    device: str
+    register: RegisterDefinition
+    value: Any
+    words: List[int]  # encoded register values
+    correlation_id: Any = None
+    received: float = 0.0  # monotonic time the command arrived
+
+    @property
+    def latency(self) -> float:
+        return time.monotonic() - self.received
+
+    def result(self, status: str, error: Optional[str] = None) -> Dict[str, Any]:
+        """Acknowledgement published on the response topic"""
+        result = {
+            "id": self.correlation_id,
+            "device": self.device,
+            "register": self.register.name,
+            "value": self.value,
+            "status": status,
+            "latency_ms": round(self.latency * 1000, 1),
+        }
+        if error:
+            result["error"] = error
+        return result
+
+def _check_write_value(reg: RegisterDefinition, value: Any) -> None:
+    """Raise CommandError unless ``value`` can be written to the register exactly"""
+    if reg.data_type == 'string':
+        if not isinstance(value, str):
+            raise CommandError(f"{reg.name} expects a string")
+        if len(value.encode('ascii', errors='replace')) > reg.decoder.size:
+            raise CommandError(f"{reg.name} holds at most {reg.decoder.size} characters")
+        return
+    if reg.data_type == 'bitfield' and isinstance(value, dict):
+        unknown = set(value) - set(reg.bits or {})
+        if unknown:
+            raise CommandError(f"{reg.name} has no flags {', '.join(sorted(map(str, unknown)))}")
+        return
+
+    values = value if isinstance(value, list) else [value]
+    if len(values) != reg.decoder.values:
+        raise CommandError(f"{reg.name} expects {reg.decoder.values} value(s)")
+    code = DATA_TYPES[reg.data_type][0]
+    for item in values:
+        if isinstance(item, bool) or not isinstance(item, (int, float)) or item != item:
+            raise CommandError(f"{reg.name} expects a number")
+        if reg.min_value is not None and item < reg.min_value:
+            raise CommandError(f"{item} is below the minimum {reg.min_value} of {reg.name}")
+        if reg.max_value is not None and item > reg.max_value:
+            raise CommandError(f"{item} is above the maximum {reg.max_value} of {reg.name}")
+        low, high = INTEGER_RANGES.get(code, (None, None))
+        if reg.data_type == 'bitfield':
+            low, high = 0, (1 << (16 * reg.count)) - 1
+        if low is not None and not low <= round(item / reg.scale) <= high:
+            raise CommandError(f"{item} is out of range for {reg.name} ({reg.data_type})")
+
+def parse_write_command(request: Any, writable: Dict[str, Dict[str, RegisterDefinition]],
+                        received: float = 0.0) -> WriteCommand:
+    """Validate a decoded command message against the writable registers of each device.
+
+    The message is a JSON object with the ``register`` name and ``value``
+    to write, the ``device`` name (optional when there is only one) and an
+    optional ``id`` echoed in the result.
+    """
+    if not isinstance(request, dict):
+        raise CommandError("command must be a JSON object")
+    device = request.get('device')
+    if device is None and len(writable) == 1:
+        device = next(iter(writable))
+    if not isinstance(device, str) or device not in writable:
+        raise CommandError(f"unknown device {device!r}")
+    name = request.get('register')
+    reg = writable[device].get(name) if isinstance(name, str) else None
+    if reg is None:
+        raise CommandError(f"register {name!r} of {device} is not writable")
+    if 'value' not in request:
+        raise CommandError("command has no value")
+    value = request['value']
+    _check_write_value(reg, value)
+    try:
+        words = reg.decoder.encode(value)
+    except (struct.error, OverflowError) as e:
+        raise CommandError(f"{value!r} cannot be encoded as {reg.data_type}: {e}")
+    return WriteCommand(device, reg, value, words, request.get('id'), received)
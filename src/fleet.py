@@ -0,0 +1,691 @@
+import asyncio
+import logging
+import re
+import signal
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from aggregation import WindowAggregator
+from circuit_breaker import CircuitBreaker
+from commands import WriteCommand
+from modbus_gateway import ModbusGateway
+from modbus_mqtt_bridge import (AppConfig, DeviceConfig, ExceptionReporter, ModbusMQTTBridge, SampleBatcher,
+                                _connection_settings, unit_id_kwarg)
+from modbus_pipeline import AsyncPipelinedModbusClient
+from mqtt_publisher import MqttPublisher
+from payload_codec import CompactEncoder
+from read_plan import PollScheduler, ReadBlock, ScanGroup
+from store_forward import SegmentedLog
+from supervisor import SUPERVISOR_METRICS, WORKER_METRICS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class FleetBridge(ModbusMQTTBridge):
+    """Polls many Modbus devices concurrently from a single asyncio event loop.
+    
+    Every device gets its own task, client and poll scheduler, a global
+    semaphore bounds how many devices are read at the same time, and all
+    devices share the MQTT connection of the bridge. Devices at the same
+    host and port are units behind one gateway and share its connection.
+    """
+    
+    def __init__(self, config: AppConfig, config_file: Optional[str] = None):
+        super().__init__(config, config_file)
+        self._stop: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._device_connected: Dict[str, bool] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}  # poll task of each polled device
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._devices = {device.name: device for device in config.devices}
+        self._clients: Dict[str, Any] = {}  # connection of each polled device, shared with its commands
+        self._command_locks: Dict[str, asyncio.Lock] = {}
+        self._command_tasks: Set[asyncio.Task] = set()
+        self._cycle_times: List[float] = []
+        self._late_cycles = 0
+        self._reporters = {
+            device.name: ExceptionReporter(device.registers or config.registers, config.heartbeat_interval)
+            for device in config.devices
+        }
+        
+        # Devices sharing the top-level registers share one schema and encoder
+        self._encoders: Dict[str, CompactEncoder] = {}
+        if self._encoder:
+            for device in config.devices:
+                self._encoders[device.name] = (
+                    self._encoder if device.registers is None else CompactEncoder(device.registers)
+                )
+        self._batchers: Dict[str, SampleBatcher] = {}
+        for device in config.devices:
+            batcher = self._create_batcher(self._encoders.get(device.name))
+            if batcher:
+                self._batchers[device.name] = batcher
+        self._breakers = {device.name: self._create_breaker(device, device.name) for device in config.devices}
+        self._aggregators = {
+            device.name: WindowAggregator(device.registers or config.registers, config.aggregate_window,
+                                          config.aggregate_time_weighted, device.name)
+            for device in config.devices
+        }
+        
+        endpoints: Dict[tuple, List[DeviceConfig]] = {}
+        for device in config.devices:
+            endpoints.setdefault((device.host, device.port), []).append(device)
+        self._gateways: Dict[str, ModbusGateway] = {}
+        self._gateway_busy: Dict[str, float] = {}  # busy seconds at the last health check
+        for units in endpoints.values():
+            if len(units) > 1:
+                gateway = self._create_gateway(units)
+                self._gateways.update((device.name, gateway) for device in units)
+
+    def _create_gateway(self, units: List[DeviceConfig]) -> ModbusGateway:
+        """Shared connection of the devices behind one gateway, exported as metrics"""
+        # The most conservative settings of the units apply to the shared connection
+        gateway = ModbusGateway(units[0].host, units[0].port,
+                                timeout=max(device.timeout for device in units),
+                                window=min(device.pipeline_window for device in units))
+        metrics = self._metrics
+        metrics.gateway_busy_seconds.labels(gateway.name).set_function(lambda: gateway.busy_seconds)
+        metrics.gateway_queue_depth.labels(gateway.name).set_function(lambda: gateway.queued)
+        for unit_id in {device.unit_id for device in units}:
+            stats = gateway.unit_stats(unit_id)
+            metrics.gateway_requests.labels(gateway.name, unit_id).set_function(lambda stats=stats: stats.requests)
+            metrics.gateway_errors.labels(gateway.name, unit_id).set_function(lambda stats=stats: stats.errors)
+            metrics.gateway_wait_seconds.labels(gateway.name, unit_id).set_function(
+                lambda stats=stats: stats.wait_seconds)
+        logger.info("Devices %s share gateway %s", ', '.join(device.name for device in units), gateway.name)
+        return gateway
+
+    def _assign(self, names: Iterable[str]) -> None:
+        """Poll exactly the named devices, starting and cancelling device tasks as needed"""
+        names = set(names)
+        for name in [name for name in self._tasks if name not in names]:
+            self._tasks.pop(name).cancel()
+        added = [device for device in self.config.devices
+                 if device.name in names and device.name not in self._tasks]
+        # Stagger the first poll of new devices across one period to avoid a thundering herd
+        now = time.monotonic()
+        for index, device in enumerate(added):
+            self._tasks[device.name] = asyncio.create_task(self._poll_device(
+                device, now + self.config.loop_interval * index / len(added)
+            ))
+
+    def _apply_config(self, config: AppConfig) -> None:
+        """Switch to a reloaded config device by device.
+        
+        Devices with new connection settings or topic are restarted with a
+        new connection and breaker, devices with only new registers switch
+        read plans between two cycles on their open connection, and the
+        other devices are not touched at all. Units behind a gateway keep its
+        connection unless the set of units or the gateway's timeout or window
+        changed.
+        """
+        old = self.config
+        stages_changed = ((config.heartbeat_interval, config.aggregate_window, config.aggregate_time_weighted)
+                          != (old.heartbeat_interval, old.aggregate_window, old.aggregate_time_weighted))
+        
+        endpoints: Dict[tuple, List[DeviceConfig]] = {}
+        for device in config.devices:
+            endpoints.setdefault((device.host, device.port), []).append(device)
+        # The settings of a shared connection, see _create_gateway
+        gateway_settings = lambda units: (max(device.timeout for device in units),
+                                          min(device.pipeline_window for device in units))
+        new_gateways: List[List[DeviceConfig]] = []
+        gateways: Dict[str, ModbusGateway] = {}  # units keeping their gateway
+        for units in endpoints.values():
+            if len(units) < 2:
+                continue
+            gateway = self._gateways.get(units[0].name)
+            if (gateway is None
+                    or {name for name, other in self._gateways.items() if other is gateway}
+                    != {device.name for device in units}
+                    or gateway_settings(units) != gateway_settings([self._devices[device.name] for device in units])):
+                new_gateways.append(units)
+            else:
+                gateways.update((device.name, gateway) for device in units)
+        
+        regrouped = {device.name for units in new_gateways for device in units}
+        devices: Dict[str, DeviceConfig] = {}
+        restart: Set[str] = set()
+        for device in config.devices:
+            running = self._devices.get(device.name)
+            if running is not None and (
+                    _connection_settings(device) != _connection_settings(running)
+                    or device.topic != running.topic
+                    or device.name in regrouped
+                    or gateways.get(device.name) is not self._gateways.get(device.name)):
+                restart.add(device.name)
+            elif running is not None and not stages_changed and device.scan_groups is running.scan_groups:
+                device = running
+            devices[device.name] = device
+        
+        # Build everything that can fail before changing anything
+        top_encoder = self._encoder
+        encoders: Dict[str, CompactEncoder] = {}
+        if self._encoder:
+            if config.registers is not old.registers:
+                top_encoder = CompactEncoder(config.registers)
+            for name, device in devices.items():
+                if device is self._devices.get(name):
+                    encoders[name] = self._encoders[name]
+                else:
+                    encoders[name] = top_encoder if device.registers is None else CompactEncoder(device.registers)
+        reporters, batchers, aggregators, breakers = {}, {}, {}, {}
+        for name, device in devices.items():
+            if device is self._devices.get(name):
+                reporters[name], aggregators[name] = self._reporters[name], self._aggregators[name]
+                if name in self._batchers:
+                    batchers[name] = self._batchers[name]
+            else:
+                registers = device.registers or config.registers
+                reporters[name] = ExceptionReporter(registers, config.heartbeat_interval)
+                aggregators[name] = WindowAggregator(registers, config.aggregate_window,
+                                                     config.aggregate_time_weighted, name)
+                batcher = self._create_batcher(encoders.get(name))
+                if batcher:
+                    batchers[name] = batcher
+            if name in self._breakers and name not in restart:
+                breakers[name] = self._breakers[name]
+        for units in new_gateways:
+            gateway = self._create_gateway(units)
+            gateways.update((device.name, gateway) for device in units)
+        for name, device in devices.items():
+            if name not in breakers:
+                breakers[name] = self._create_breaker(device, name)
+        
+        running_encoders = {id(encoder) for encoder in self._encoders.values()}
+        for encoder in {id(encoder): encoder for encoder in encoders.values()}.values():
+            if id(encoder) not in running_encoders:
+                self._publish_schema(encoder)
+        
+        added = [name for name in devices if name not in self._devices]
+        removed = [name for name in self._devices if name not in devices]
+        replanned = [name for name, device in devices.items()
+                     if name in self._tasks and name not in restart and device is not self._devices[name]]
+        config.devices = list(devices.values())
+        self.config = config
+        self._devices = devices
+        self._gateways = gateways
+        self._encoder = top_encoder
+        self._encoders, self._reporters, self._batchers = encoders, reporters, batchers
+        self._aggregators, self._breakers = aggregators, breakers
+        self._writable = self._writable_registers(config)
+        
+        # Running poll tasks pick up new registers themselves, restarted devices get a new task
+        polled = set(self._tasks)
+        restarted = polled & restart
+        for name in polled:
+            if name in restart or name not in devices:
+                self._tasks.pop(name).cancel()
+        self._assign(name for name in polled if name in devices)
+        logger.info("Config reloaded: %d devices, %d added, %d removed, %d restarted, %d with new registers",
+                    len(devices), len(added), len(removed), len(restarted), len(replanned))
+
+    async def _stop_polling(self, *tasks: asyncio.Task) -> None:
+        """Cancel the device tasks and the given helper tasks, letting them flush their batches"""
+        # Writes in progress are bounded by the device timeout and still get their result
+        await asyncio.gather(*self._command_tasks, return_exceptions=True)
+        tasks = list(self._tasks.values()) + list(tasks)
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _connect_device(self, client, device: DeviceConfig) -> bool:
+        """Open the connection to a device, bounded by its timeout"""
+        try:
+            connected = await asyncio.wait_for(client.connect(), timeout=device.timeout)
+        except Exception as e:
+            logger.error("Connection to device %s at %s:%d failed: %s",
+                         device.name, device.host, device.port, e)
+            connected = False
+            
+        if connected and not self._device_connected.get(device.name):
+            logger.info("Connected to device %s at %s:%d", device.name, device.host, device.port)
+        if not connected:
+            self._breakers[device.name].record_failure()
+        self._device_connected[device.name] = bool(connected)
+        return bool(connected)
+
+    def _dispatch_command(self, command: WriteCommand) -> None:
+        # Called on the MQTT network thread
+        try:
+            self._loop.call_soon_threadsafe(self._start_command, command)
+        except (AttributeError, RuntimeError):
+            self._finish_command(command, "bridge is not running")
+
+    def _start_command(self, command: WriteCommand) -> None:
+        task = asyncio.create_task(self._execute_command(command))
+        self._command_tasks.add(task)
+        task.add_done_callback(self._command_tasks.discard)
+
+    async def _write_device_registers(self, client, device: DeviceConfig, address: int, words: List[int]):
+        """Write holding registers of a device"""
+        if isinstance(client, (AsyncPipelinedModbusClient, ModbusGateway)):
+            return await client.write(address, words, device.unit_id)
+        unit = {unit_id_kwarg(): device.unit_id}
+        if len(words) == 1:
+            return await client.write_register(address, words[0], **unit)
+        return await client.write_registers(address, words, **unit)
+
+    async def _execute_command(self, command: WriteCommand) -> None:
+        """Write a command on the device's own connection.
+        
+        Commands do not wait for one of the shared read slots: a write only
+        waits for the request on the connection, then goes ahead of the
+        device's next block read. Commands to one device are written in the
+        order they arrived.
+        """
+        device = self._devices[command.device]
+        client = self._clients.get(device.name)
+        lock = self._command_locks.setdefault(device.name, asyncio.Lock())
+        error = None
+        async with lock:
+            if client is None:
+                error = "device is not polled"
+            elif not client.connected:
+                error = "device not connected"
+            else:
+                try:
+                    response = await self._write_device_registers(client, device, command.register.address,
+                                                                  command.words)
+                    if response.isError():
+                        error = f"device answered {response}"
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+        self._finish_command(command, error)
+
+    async def _read_device_block(self, client, device: DeviceConfig, block: ReadBlock,
+                                 data: Dict[str, Any], response=None,
+                                 groups: Iterable[ScanGroup] = ()) -> bool:
+        """Read one block from a device, like the synchronous _read_block"""
+        if response is None:
+            start = time.perf_counter()
+            try:
+                if isinstance(client, (AsyncPipelinedModbusClient, ModbusGateway)):
+                    response = (await client.read_blocks(
+                        [(block.function_code, block.address, block.count)], device.unit_id))[0]
+                elif block.register_type == 'input':
+                    response = await client.read_input_registers(
+                        block.address, count=block.count, **{unit_id_kwarg(): device.unit_id})
+                else:
+                    response = await client.read_holding_registers(
+                        block.address, count=block.count, **{unit_id_kwarg(): device.unit_id})
+            except Exception as e:
+                response = e
+            else:
+                self._metrics.block_read_seconds.labels(device.name, block.label).observe(
+                    time.perf_counter() - start)
+                
+        answered, parts = self._store_block_response(block, response, data, groups, device.name)
+        for index, part in enumerate(parts):
+            if not await self._read_device_block(client, device, part, data, groups=groups):
+                self._mark_unavailable([reg for rest in parts[index + 1:] for reg in rest.registers],
+                                       data, device.name)
+                return False
+        return answered
+
+    async def _read_device(self, client, device: DeviceConfig,
+                           groups: List[ScanGroup]) -> Dict[str, Any]:
+        """Read the due scan groups of one device"""
+        results = {
+            "timestamp": time.time(),
+            "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "device": device.name,
+            "data": {}
+        }
+        
+        start = time.perf_counter()
+        breaker = self._breakers[device.name]
+        blocks = [block for group in groups for block in group.read_plan]
+        responses = [None] * len(blocks)
+        if isinstance(client, (AsyncPipelinedModbusClient, ModbusGateway)):
+            responses = await client.read_blocks(
+                [(block.function_code, block.address, block.count) for block in blocks], device.unit_id)
+        for index, (block, response) in enumerate(zip(blocks, responses)):
+            if not await self._read_device_block(client, device, block, results["data"], response, groups):
+                self._mark_unavailable([reg for rest in blocks[index + 1:] for reg in rest.registers],
+                                       results["data"], device.name)
+                breaker.record_failure()
+                break
+        else:
+            breaker.record_success()
+        elapsed = time.perf_counter() - start
+        self._metrics.device_read_seconds.labels(device.name).observe(elapsed)
+        self._metrics.observe_phase('read', elapsed)
+                
+        return results
+
+    async def _poll_device(self, device: DeviceConfig, start: float) -> None:
+        """Per-device task: read due scan groups and hand samples to the publisher"""
+        # Reconnects and retries are left to the device's circuit breaker
+        if device.name in self._gateways:
+            client = self._gateways[device.name]
+        elif device.pipeline_window > 1:
+            client = AsyncPipelinedModbusClient(device.host, port=device.port, timeout=device.timeout,
+                                                window=device.pipeline_window)
+        else:
+            from pymodbus.client import AsyncModbusTcpClient
+            client = AsyncModbusTcpClient(
+                device.host,
+                port=device.port,
+                timeout=device.timeout,
+                retries=0,
+                reconnect_delay=0
+            )
+        topic = device.topic or f"{self.config.mqtt.topic}/{device.name}"
+        scheduler = PollScheduler(device.scan_groups, start=start,
+                                  observer=self._scan_observer(device.name))
+        reporter = self._reporters[device.name]
+        encoder = self._encoders.get(device.name)
+        batcher = self._batchers.get(device.name)
+        breaker = self._breakers[device.name]
+        aggregator = self._aggregators[device.name]
+        self._clients[device.name] = client
+        
+        try:
+            while self._running:
+                if self._devices.get(device.name, device) is not device:
+                    # A config reload changed the registers: finish the samples of the old ones
+                    if batcher:
+                        self._publish_batch(batcher.take(), batcher, topic, encoder)
+                    if aggregator:
+                        self._publish_aggregates(aggregator, topic, final=True)
+                    device = self._devices[device.name]
+                    scheduler = PollScheduler(device.scan_groups, observer=self._scan_observer(device.name))
+                    reporter = self._reporters[device.name]
+                    encoder = self._encoders.get(device.name)
+                    batcher = self._batchers.get(device.name)
+                    aggregator = self._aggregators[device.name]
+                    
+                due = scheduler.pop_due()
+                
+                if due:
+                    start_time = time.monotonic()
+                    data = None
+                    
+                    # An unresponsive device is skipped without I/O until its backoff expires,
+                    # and connecting does not hold one of the shared read slots
+                    if breaker.allow(start_time):
+                        if not client.connected:
+                            await self._connect_device(client, device)
+                        if client.connected:
+                            async with self._semaphore:
+                                data = await self._read_device(client, device, due)
+                            
+                    if data is not None and aggregator:
+                        data["data"] = aggregator.add(data["data"], data["timestamp"])
+                        
+                    if data is not None and self.config.report_by_exception:
+                        data["data"] = reporter.changes(data["data"])
+                        
+                    if data is not None and (data["data"] or not (self.config.report_by_exception or aggregator)):
+                        if self._publish_sample(data, batcher, topic, encoder):
+                            reporter.mark_published(data["data"])
+                        
+                    elapsed = time.monotonic() - start_time
+                    self._cycle_times.append(elapsed)
+                    if elapsed > min(group.interval for group in due):
+                        self._late_cycles += 1
+                
+                if batcher and batcher.due():
+                    self._publish_batch(batcher.take(), batcher, topic, encoder)
+                if aggregator:
+                    self._publish_aggregates(aggregator, topic)
+                
+                next_deadline = scheduler.next_deadline()
+                if next_deadline is None:
+                    next_deadline = time.monotonic() + self.config.loop_interval
+                if batcher and batcher.deadline is not None:
+                    next_deadline = min(next_deadline, batcher.deadline)
+                if aggregator and aggregator.deadline is not None:
+                    next_deadline = min(next_deadline, time.monotonic() + aggregator.deadline - time.time())
+                await asyncio.sleep(max(0.0, next_deadline - time.monotonic()))
+        finally:
+            if batcher:
+                self._publish_batch(batcher.take(), batcher, topic, encoder)
+            if aggregator:
+                self._publish_aggregates(aggregator, topic, final=True)
+            if self._clients.get(device.name) is client:
+                del self._clients[device.name]
+            # A gateway stays open while other units still read through it
+            if not any(other is client for other in self._clients.values()):
+                client.close()
+
+    def _perform_health_check(self) -> None:
+        """Log MQTT state and fleet cycle statistics since the last health check"""
+        now = time.monotonic()
+        
+        if now - self._last_health_check < self.config.health_check_interval:
+            return
+            
+        cycle_times, self._cycle_times = sorted(self._cycle_times), []
+        late_cycles, self._late_cycles = self._late_cycles, 0
+        window = now - self._last_health_check if self._last_health_check else self.config.health_check_interval
+        self._last_health_check = now
+        
+        connected = sum(1 for name in self._tasks
+                        if (self._gateways[name].connected if name in self._gateways
+                            else self._device_connected.get(name)))
+        unavailable = sum(1 for name in self._tasks if self._breakers[name].state != CircuitBreaker.CLOSED)
+        logger.info("Health check: %d/%d devices connected, %d unavailable, %s",
+                    connected, len(self._tasks), unavailable, self._upstream_state())
+        self._log_publisher_stats()
+        self._log_gateway_stats(window)
+        if cycle_times:
+            logger.info(
+                "Fleet stats: %d device cycles (%.1f/s), latency mean %.3fs p95 %.3fs max %.3fs, %d late",
+                len(cycle_times), len(cycle_times) / window,
+                sum(cycle_times) / len(cycle_times),
+                cycle_times[int(0.95 * (len(cycle_times) - 1))],
+                cycle_times[-1], late_cycles
+            )
+
+    def _upstream_state(self) -> str:
+        return f"MQTT connected: {self._mqtt_client.is_connected()}"
+
+    def _log_gateway_stats(self, window: float) -> None:
+        """Log bus utilization and per-unit traffic of each shared gateway connection"""
+        gateways = {id(gateway): gateway for name, gateway in self._gateways.items() if name in self._tasks}
+        for gateway in gateways.values():
+            busy = gateway.busy_seconds
+            utilization = (busy - self._gateway_busy.get(gateway.name, 0.0)) / window if window else 0.0
+            self._gateway_busy[gateway.name] = busy
+            units = ', '.join(
+                f"unit {unit_id}: {stats.requests} req, {stats.errors} err, "
+                f"wait {stats.wait_seconds / stats.requests if stats.requests else 0:.3f}s"
+                for unit_id, stats in sorted(gateway.units.items())
+            )
+            logger.info("Gateway %s: %.0f%% busy, %d queued (%s)",
+                        gateway.name, 100 * utilization, gateway.queued, units)
+
+    async def _housekeeping(self) -> None:
+        """Reconnect MQTT, run health checks and reload the config while the fleet is polled"""
+        loop = asyncio.get_running_loop()
+        
+        while self._running:
+            if self._reload_due():
+                # Parsing and compiling a large fleet's config must not stall the polls
+                config = await loop.run_in_executor(None, self._read_new_config)
+                if config is not None and self._switch_config(config):
+                    self._assign(device.name for device in self.config.devices)
+                    
+            now = time.monotonic()
+            if (not self._mqtt_client.is_connected()
+                    and now - self._last_reconnect_attempt >= self.config.reconnect_interval):
+                self._last_reconnect_attempt = now
+                logger.info("Attempting to reconnect to MQTT broker...")
+                try:
+                    await loop.run_in_executor(None, self._mqtt_client.reconnect)
+                except Exception as e:
+                    logger.error("MQTT reconnection failed: %s", e)
+                    
+            self._perform_health_check()
+            
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def _request_stop(self) -> None:
+        logger.info("Shutdown requested, stopping fleet poller...")
+        self._running = False
+        self._stop.set()
+
+    async def _run_fleet(self) -> None:
+        loop = self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        loop.add_signal_handler(signal.SIGINT, self._request_stop)
+        loop.add_signal_handler(signal.SIGTERM, self._request_stop)
+        loop.add_signal_handler(signal.SIGHUP, self._request_reload)
+        self._start_metrics_server()
+        
+        await loop.run_in_executor(None, self._connect_mqtt)
+        for encoder in {id(encoder): encoder for encoder in self._encoders.values()}.values():
+            self._publish_schema(encoder)
+        
+        self._assign(device.name for device in self.config.devices)
+        housekeeping = asyncio.create_task(self._housekeeping())
+        logger.info("Polling %d devices with up to %d concurrent reads",
+                    len(self._tasks), self.config.max_concurrency)
+        
+        await self._stop.wait()
+        await self._stop_polling(housekeeping)
+
+    def run(self):
+        """Main execution loop for fleet mode"""
+        self._running = True
+        try:
+            asyncio.run(self._run_fleet())
+        except Exception as e:
+            logger.exception("Unexpected error in fleet poller: %s", e)
+        finally:
+            self.shutdown()
+
+class ShardWorker(FleetBridge):
+    """Fleet poller running in a worker process of the supervisor.
+    
+    It polls the devices the supervisor assigns to it and sends the encoded
+    messages, and snapshots of its metrics, back over a pipe instead of
+    connecting to the broker itself. Every worker knows the whole fleet so
+    devices can be moved to it when another worker dies.
+    """
+    
+    def __init__(self, config: AppConfig, index: int, conn):
+        super().__init__(config)
+        self._index = index
+        self._conn = conn
+        
+    def _create_mqtt_client(self):
+        # The supervisor holds the only MQTT connection
+        return None
+        
+    def _create_store(self) -> Optional[SegmentedLog]:
+        # The supervisor buffers and publishes for all workers
+        return None
+        
+    def _create_publisher(self) -> MqttPublisher:
+        # Never started, messages go to the supervisor
+        return MqttPublisher(self._mqtt_client, backpressure='block')
+        
+    def _publish_schema(self, encoder: CompactEncoder) -> None:
+        # Published once by the supervisor
+        pass
+        
+    def _send(self, message: tuple) -> bool:
+        try:
+            self._conn.send(message)
+            return True
+        except (OSError, ValueError) as e:
+            logger.error("Lost the pipe to the supervisor: %s", e)
+            self._request_stop()
+            return False
+            
+    def _submit_payload(self, payload: Union[str, bytes], topic: Optional[str] = None,
+                        on_delivered: Optional[Callable[[], None]] = None) -> bool:
+        return self._send(('publish', topic or self.config.mqtt.topic, payload))
+        
+    def _publish_response(self, result: Dict[str, Any]) -> None:
+        self._send(('response', result))
+        
+    def _upstream_state(self) -> str:
+        return f"worker {self._index}"
+        
+    def _log_publisher_stats(self) -> None:
+        pass
+        
+    def _export_metrics(self) -> str:
+        """Metrics of the devices this worker polls, for the supervisor to merge"""
+        owned = set(self._tasks)
+        owned_gateways = {self._gateways[name].name for name in owned if name in self._gateways}
+        lines = []
+        family = None
+        for line in self._metrics.render().splitlines():
+            if line.startswith('# '):
+                family = line.split(' ', 3)[2]
+            if family in SUPERVISOR_METRICS:
+                continue
+            device = re.search(r'device="((?:[^"\\]|\\.)*)"', line)
+            gateway = re.search(r'gateway="([^"]*)"', line)
+            if device and device.group(1) not in owned or gateway and gateway.group(1) not in owned_gateways:
+                continue
+            lines.append(line)
+        return '\n'.join(lines) + '\n'
+        
+    def _on_command(self) -> None:
+        try:
+            while self._conn.poll():
+                command, *args = self._conn.recv()
+                if command == 'assign':
+                    self._assign(args[0])
+                    logger.info("Polling %d devices", len(self._tasks))
+                elif command == 'write':
+                    self._start_command(args[0])
+                elif command == 'config':
+                    # Validated by the supervisor; take over the plans of the unchanged devices
+                    config = args[0]
+                    config.compile(self.config)
+                    self._switch_config(config)
+                elif command == 'stop':
+                    self._request_stop()
+        except (EOFError, OSError):
+            # The supervisor is gone
+            self._request_stop()
+            
+    async def _housekeeping(self) -> None:
+        last_export = 0.0
+        while self._running:
+            self._perform_health_check()
+            now = time.monotonic()
+            if self.config.metrics_port and now - last_export >= WORKER_METRICS_INTERVAL:
+                last_export = now
+                self._send(('metrics', self._export_metrics()))
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+                
+    def _request_stop(self) -> None:
+        if self._running:
+            logger.info("Stopping worker %d...", self._index)
+        self._running = False
+        self._stop.set()
+        
+    async def _run_fleet(self) -> None:
+        loop = self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        # Ctrl-C and hangups reach the whole process group; the supervisor decides
+        # when workers stop and reload
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        loop.add_signal_handler(signal.SIGTERM, self._request_stop)
+        loop.add_reader(self._conn.fileno(), self._on_command)
+        housekeeping = asyncio.create_task(self._housekeeping())
+        
+        await self._stop.wait()
+        loop.remove_reader(self._conn.fileno())
+        await self._stop_polling(housekeeping)
+        
+    def shutdown(self):
+        logger.info("Worker %d stopped", self._index)
+        self._conn.close()
@@ -0,0 +1,212 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LOG_FORMATS = ('text', 'json')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the traceback and suppression count as their own fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry)
+
+class RateLimiter:
+    """Lets ``burst`` identical records through per ``interval`` and counts the rest.
+
+    Records are identical when logger, level and rendered message are equal,
+    so the same error from two devices is counted separately. When a window
+    with suppressed records ends, a summary record repeating the message with
+    "(N suppressed in last 60s)" takes their place.
+    """
+
+    def __init__(self, interval: float = 60.0, burst: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self.burst = max(1, burst)
+        self._clock = clock
+        # key -> [window start, records seen, origin of the first record]
+        self._windows: Dict[Tuple[str, int, str], list] = {}
+        self._lock = threading.Lock()
+
+    def check(self, record: logging.LogRecord) -> Tuple[bool, Optional[logging.LogRecord]]:
+        """Whether to log ``record``, and the summary of the window it ended, if any"""
+        key = (record.name, record.levelno, record.getMessage())
+        now = self._clock()
+        summary = None
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now - window[0] >= self.interval:
+                summary = self._summary(key, window)
+                window = None
+            if window is None:
+                self._windows[key] = [now, 1, (record.pathname, record.lineno, record.funcName)]
+                return True, summary
+            window[1] += 1
+            return window[1] <= self.burst, summary
+
+    def expired(self, all_windows: bool = False) -> List[logging.LogRecord]:
+        """Summaries of the windows that ended, or of all at shutdown, forgetting those windows"""
+        now = self._clock()
+        summaries = []
+        with self._lock:
+            for key, window in list(self._windows.items()):
+                if all_windows or now - window[0] >= self.interval:
+                    del self._windows[key]
+                    summary = self._summary(key, window)
+                    if summary:
+                        summaries.append(summary)
+        return summaries
+
+    def _summary(self, key: Tuple[str, int, str], window: list) -> Optional[logging.LogRecord]:
+        suppressed = window[1] - self.burst
+        if suppressed <= 0:
+            return None
+        name, level, message = key
+        pathname, lineno, function = window[2]
+        summary = logging.LogRecord(name, level, pathname, lineno, "%s (%d suppressed in last %ds)",
+                                    (message, suppressed, round(self.interval)), None, function)
+        summary.suppressed = suppressed
+        return summary
+
+class BackgroundLogHandler(logging.Handler):
+    """Hands records to a writer thread through a bounded queue.
+
+    Logging from the poll loops only renders the message and queues it;
+    formatting tracebacks and writing to the console and files happens on
+    the writer thread, so a slow disk cannot stall acquisition. Records of
+    ``rate_limit_level`` and above go through the ``limiter`` first, so a
+    failing device repeating the same error every cycle costs one line per
+    window. When the queue is full new records are dropped and counted, and
+    the writer reports how many once it caught up.
+    """
+
+    def __init__(self, handlers: Sequence[logging.Handler], queue_size: int = 10000,
+                 limiter: Optional[RateLimiter] = None, rate_limit_level: int = logging.WARNING):
+        super().__init__()
+        self.handlers = list(handlers)
+        self.limiter = limiter
+        self.rate_limit_level = rate_limit_level
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._reported_dropped = 0
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.limiter and record.levelno >= self.rate_limit_level:
+                allowed, summary = self.limiter.check(record)
+                if summary:
+                    self._enqueue(summary)
+                if not allowed:
+                    return
+            # Render the message now, its arguments may change once the caller moves on
+            record.msg = record.getMessage()
+            record.args = None
+            self._enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+    def _enqueue(self, record: Optional[logging.LogRecord]) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, record: logging.LogRecord) -> None:
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report(self) -> None:
+        if self.limiter:
+            for summary in self.limiter.expired():
+                self._write(summary)
+        dropped = self.dropped - self._reported_dropped
+        if dropped:
+            self._reported_dropped += dropped
+            self._write(logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                          "Log queue full, dropped %d records", (dropped,), None))
+
+    def _run(self) -> None:
+        last_report = time.monotonic()
+        while True:
+            try:
+                record = self._queue.get(timeout=1.0)
+                if record is None:
+                    break
+                self._write(record)
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if now - last_report >= 1.0:
+                last_report = now
+                self._report()
+
+    def close(self) -> None:
+        """Write what is queued, then close the handlers"""
+        if self._thread and self._thread.is_alive():
+            # Wait for room rather than drop the stop marker
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+        self._thread = None
+        if self.limiter:
+            for summary in self.limiter.expired(all_windows=True):
+                self._write(summary)
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+def setup_logging(log_file: str = "modbus_bridge.log", level: str = "INFO", log_format: str = "text",
+                  text_format: str = TEXT_FORMAT, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                  rate_limit: float = 60.0) -> BackgroundLogHandler:
+    """Log to stderr and ``log_file``, rotated at ``max_bytes``, through a background writer.
+
+    Replaces the handlers of the root logger, so it can be called again once
+    the configuration is loaded. An empty ``log_file`` logs to stderr only,
+    ``max_bytes`` 0 disables rotation and ``rate_limit`` 0 disables rate
+    limiting.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{log_format}'")
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(text_format)
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                             backupCount=backup_count))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    background = BackgroundLogHandler(handlers, limiter=RateLimiter(rate_limit) if rate_limit > 0 else None)
+    background.start()
+    root.addHandler(background)
+    root.setLevel(level.upper())
+    return background
@@ -0,0 +1,373 @@
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a fast local block read to a timed out device
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """A metric family with an optional set of label names"""
+
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values) -> object:
+        """Child metric for one combination of label values"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+class _GaugeValue:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from ``function`` whenever the metrics are scraped"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is None:
+            return self.value
+        try:
+            return float(self.function())
+        except Exception as e:
+            logger.debug("Metric callback failed: %s", e)
+            return float('nan')
+
+class _CounterValue(_GaugeValue):
+    __slots__ = ('_lock',)
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Export a count maintained elsewhere, e.g. by the publisher"""
+        self.labels().set_function(function)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(child.get())}"
+                for key, child in list(self._children.items())]
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self) -> _GaugeValue:
+        return _GaugeValue()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(child.get())}"
+                for key, child in list(self._children.items())]
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+class BridgeMetrics:
+    """The metrics exported by the Modbus MQTT bridge"""
+
+    def __init__(self):
+        self.registry = registry = MetricsRegistry()
+        self.block_read_seconds = registry.histogram(
+            'modbus_block_read_seconds', 'Duration of a single block read request',
+            ('device', 'block'))
+        self.device_read_seconds = registry.histogram(
+            'modbus_device_read_seconds', 'Duration of reading the due scan groups of a device',
+            ('device',))
+        self.register_errors = registry.counter(
+            'modbus_register_errors_total', 'Failed register reads by register and kind',
+            ('device', 'register', 'kind'))
+        self.breaker_state = registry.gauge(
+            'modbus_device_breaker_state', 'Circuit breaker of a device: 0 closed, 1 half-open, 2 open',
+            ('device',))
+        self.gateway_requests = registry.counter(
+            'modbus_gateway_requests_total', 'Requests sent through a shared gateway connection by unit id',
+            ('gateway', 'unit'))
+        self.gateway_errors = registry.counter(
+            'modbus_gateway_errors_total', 'Gateway requests that got no answer by unit id',
+            ('gateway', 'unit'))
+        self.gateway_wait_seconds = registry.counter(
+            'modbus_gateway_queue_wait_seconds_total', 'Time requests spent queued for a gateway by unit id',
+            ('gateway', 'unit'))
+        self.gateway_busy_seconds = registry.counter(
+            'modbus_gateway_busy_seconds_total', 'Time a gateway connection had requests outstanding',
+            ('gateway',))
+        self.gateway_queue_depth = registry.gauge(
+            'modbus_gateway_queue_depth', 'Requests waiting for a gateway connection', ('gateway',))
+        self.phase_seconds = registry.histogram(
+            'bridge_phase_seconds', 'Time spent per pipeline phase (read, serialize, persist, publish)',
+            ('phase',))
+        self.cycle_jitter_seconds = registry.histogram(
+            'bridge_cycle_jitter_seconds', 'Delay between a scan group deadline and its read',
+            ('device', 'group'))
+        self.overruns = registry.counter(
+            'bridge_scan_overruns_total', 'Poll cycles skipped because a scan group overran',
+            ('device', 'group'))
+        self.commands = registry.counter(
+            'bridge_commands_total', 'Write commands by outcome (ok, failed, rejected)',
+            ('device', 'status'))
+        self.command_seconds = registry.histogram(
+            'bridge_command_seconds', 'Time from receiving a write command to its result',
+            ('device',))
+        self.queue_depth = registry.gauge(
+            'bridge_publish_queue_depth', 'Messages waiting to be published')
+        self.inflight = registry.gauge(
+            'bridge_mqtt_inflight_messages', 'Published messages not yet acknowledged by the broker')
+        self.store_pending = registry.gauge(
+            'bridge_store_pending_records', 'Undelivered records in the store-and-forward log')
+        self.published = registry.counter(
+            'bridge_messages_published_total', 'Messages handed to the MQTT client')
+        self.dropped = registry.counter(
+            'bridge_messages_dropped_total', 'Messages dropped by backpressure')
+        self.workers_alive = registry.gauge(
+            'bridge_workers_alive', 'Worker processes polling devices in supervisor mode')
+        self.worker_restarts = registry.counter(
+            'bridge_worker_restarts_total', 'Worker processes restarted after they died')
+        self.config_reloads = registry.counter(
+            'bridge_config_reloads_total', 'Config reloads by outcome (applied, rejected)', ('status',))
+
+    def observe_phase(self, phase: str, seconds: float) -> None:
+        self.phase_seconds.labels(phase).observe(seconds)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+def _add_label(line: str, name: str, value: str) -> str:
+    label = f'{name}="{_escape(value)}"'
+    brace = line.find('{')
+    if brace != -1 and brace < line.find(' '):
+        end = line.rfind('}')  # label values may contain spaces, sample values no braces
+        return f"{line[:end]},{label}{line[end:]}"
+    metric, _, rest = line.partition(' ')
+    return f"{metric}{{{label}}} {rest}"
+
+def merge_metrics(sources: Dict[Optional[str], str], label: str = 'worker') -> str:
+    """Combine the text exposition of several processes into one.
+
+    Each family is declared once, and the samples of every source except
+    the ``None`` one get ``label`` set to the source name, so series of
+    different processes never collide.
+    """
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for source, text in sources.items():
+        family = None
+        declared = set()
+        for line in text.splitlines():
+            if line.startswith('# '):
+                family = line.split(' ', 3)[2]
+                if family not in headers:
+                    headers[family] = []
+                    samples[family] = []
+                    declared.add(family)
+                if family in declared:
+                    headers[family].append(line)
+            elif line and family is not None:
+                samples[family].append(line if source is None else _add_label(line, label, source))
+    lines = []
+    for family, header in headers.items():
+        lines.extend(header)
+        lines.extend(samples[family])
+    return '\n'.join(lines) + '\n'
+
+class AggregatedMetrics:
+    """Local metrics plus the latest exposition received from each worker process"""
+
+    def __init__(self, local: BridgeMetrics):
+        self.local = local
+        self._lock = threading.Lock()
+        self._workers: Dict[str, str] = {}
+
+    def update(self, worker: str, text: str) -> None:
+        with self._lock:
+            self._workers[worker] = text
+
+    def remove(self, worker: str) -> None:
+        with self._lock:
+            self._workers.pop(worker, None)
+
+    def render(self) -> str:
+        with self._lock:
+            workers = dict(self._workers)
+        return merge_metrics({None: self.local.render(), **workers})
+
+def _metrics_handler() -> type:
+    """The request handler class; http.server is only imported once metrics are served"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    return MetricsHandler
+
+class MetricsServer:
+    """Serves a registry over HTTP for Prometheus on a daemon thread"""
+
+    def __init__(self, registry, host: str = '127.0.0.1', port: int = 9108):
+        self.host = host
+        self.port = port
+        self._registry = registry
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        from http.server import ThreadingHTTPServer
+        self._server = ThreadingHTTPServer((self.host, self.port), _metrics_handler())
+        self._server.daemon_threads = True
+        self._server.registry = self._registry
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
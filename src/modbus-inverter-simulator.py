@@ -1,224 +1,127 @@
+import argparse
 import logging
-import random
-import struct
+import os
 import time
 import asyncio
 import signal
 import sys
-from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
-from pymodbus.server import StartAsyncTcpServer
+from typing import List, Optional
+
+import yaml
+
+from log_writer import setup_logging
+from modbus_mqtt_bridge import read_config
+from registers import RegisterDefinition
+from sim_fleet import FleetModel
+from sim_server import SimulatorServer, load_fault_profiles
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("modbus_server.log")
-    ]
-)
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'inverter.yaml')
+
+# Max unit ids behind one port, Modbus allows 1-247
+MAX_UNIT_ID = 247
+
 # Global exit event for clean shutdown
 shutdown_event = asyncio.Event()
 
-class InverterSimulator:
-    def __init__(self, update_interval=5):
-        """Initialize the inverter simulator with a specified update interval."""
+class FleetSimulator:
+    """Many simulated inverters spread over unit ids and listening ports.
+
+    The values of all inverters live in NumPy arrays (see ``sim_fleet``) and
+    every register is encoded with its own data_type, byte_order and scale
+    for the whole fleet at once, so the bridge decodes exactly the simulated
+    values. Registers whose name matches no simulated quantity read as zero.
+    """
+
+    def __init__(self, registers: List[RegisterDefinition], devices: int = 1, ports: int = 1,
+                 base_port: int = 5020, host: str = '0.0.0.0', update_interval: float = 5,
+                 seed: Optional[int] = None, faults: Optional[dict] = None):
+        if devices > ports * MAX_UNIT_ID:
+            raise ValueError(f"{devices} devices need at least {-(-devices // MAX_UNIT_ID)} ports")
         self.update_interval = update_interval
-        
-        # Initialize data store
-        self.datastore = self._setup_datastore()
-        
-        # Values for simulation
-        self.dc_voltage = 350.0  # 350.0V
-        self.dc_current = 8.5    # 8.5A
-        self.ac_voltage = 230.0  # 230.0V
-        self.ac_current = 7.2    # 7.2A
-        self.ac_frequency = 50.0 # 50.0Hz
-        self.power = 1500.0      # 1500W
-        self.energy = 10000.0    # 10000Wh (10kWh)
-        self.temperature = 35.0  # 35.0°C
-        self.status = 1          # 1=Running
-        
-    def _setup_datastore(self):
-        """Create and setup the Modbus datastore with appropriate register blocks."""
-        # Create data blocks for different register types
-        # Coils (0xxxxx) - Digital outputs
-        coil_block = ModbusSequentialDataBlock(0, [0] * 100)
-        
-        # Discrete Inputs (1xxxxx) - Digital inputs
-        discrete_block = ModbusSequentialDataBlock(0, [0] * 100)
-        
-        # Input Registers (3xxxxx) - Analog inputs (read-only)
-        input_block = ModbusSequentialDataBlock(0, [0] * 1000)
-        
-        # Holding Registers (4xxxxx) - Analog outputs (read/write)
-        holding_block = ModbusSequentialDataBlock(0, [0] * 1000)
-        
-        # Create slave context
-        slave_context = ModbusSlaveContext(
-            di=discrete_block,
-            co=coil_block,
-            ir=input_block,
-            hr=holding_block
-        )
-        
-        # Create server context with single slave
-        return ModbusServerContext(slaves={1: slave_context}, single=False)
-    
-    def _update_registers(self):
-        """Update register values with simulated inverter data."""
-        # Add small random variations to simulate real changes
-        self.dc_voltage += random.uniform(-5, 5)
-        self.dc_voltage = max(300, min(400, self.dc_voltage))  # Keep within range
-        
-        self.dc_current += random.uniform(-0.5, 0.5)
-        self.dc_current = max(0, min(15, self.dc_current))
-        
-        self.ac_voltage += random.uniform(-2, 2)
-        self.ac_voltage = max(220, min(240, self.ac_voltage))
-        
-        self.ac_current += random.uniform(-0.3, 0.3)
-        self.ac_current = max(0, min(10, self.ac_current))
-        
-        self.ac_frequency += random.uniform(-0.1, 0.1)
-        self.ac_frequency = max(49.5, min(50.5, self.ac_frequency))
-        
-        self.power = self.ac_voltage * self.ac_current
-        
-        self.energy += self.power * (self.update_interval / 3600)  # Convert to Wh
-        
-        self.temperature += random.uniform(-1, 1)
-        self.temperature = max(20, min(60, self.temperature))
-        
-        # Get the registers from context
-        slave_id = 1
-        context = self.datastore.slaves[slave_id]
-        
-        try:
-            # UPDATE INPUT REGISTERS (3xxxx)
-            
-            # DC Voltage (uint16, scale 0.1) - Register 30001
-            context.setValues(3, 0, [int(self.dc_voltage * 10)])
-            
-            # DC Current (uint16, scale 0.1) - Register 30003
-            context.setValues(3, 2, [int(self.dc_current * 10)])
-            
-            # AC Output Voltage (uint16, scale 0.1) - Register 30071
-            context.setValues(3, 70, [int(self.ac_voltage * 10)])
-            
-            # AC Output Current (uint16, scale 0.1) - Register 30073
-            context.setValues(3, 72, [int(self.ac_current * 10)])
-            
-            # AC Output Frequency (uint16, scale 0.01) - Register 30075
-            context.setValues(3, 74, [int(self.ac_frequency * 100)])
-            
-            # Inverter Status (uint16) - Register 30201
-            context.setValues(3, 200, [self.status])
-            
-            # Inverter Temperature (int16, scale 0.1) - Register 30231
-            temp_value = int(self.temperature * 10)
-            if temp_value < 0:
-                temp_value = 65536 + temp_value  # Convert to 2's complement
-            context.setValues(3, 230, [temp_value])
-            
-            # Total Power int32 (Big Endian) - Register 30775-30776
-            power_int = int(self.power)
-            high_word = (power_int >> 16) & 0xFFFF
-            low_word = power_int & 0xFFFF
-            context.setValues(3, 774, [high_word, low_word])
-            
-            # Total Power int32 (Little Endian) - This is the same value in different byte order
-            context.setValues(3, 776, [low_word, high_word])
-            
-            # Total Power as float32 (Big Endian) - Register 30779-30780
-            float_bytes = struct.pack('>f', self.power)
-            float_words = struct.unpack('>HH', float_bytes)
-            context.setValues(3, 778, [float_words[0], float_words[1]])
-            
-            # Total Power as float32 (Little Endian) - This is the same value in different byte order
-            float_bytes = struct.pack('<f', self.power)
-            float_words = struct.unpack('<HH', float_bytes)
-            context.setValues(3, 780, [float_words[0], float_words[1]])
-            
-            # Total Energy (uint32, scale 0.1) - Register 30513-30514
-            energy_int = int(self.energy * 10)
-            high_word = (energy_int >> 16) & 0xFFFF
-            low_word = energy_int & 0xFFFF
-            context.setValues(3, 512, [high_word, low_word])
-            
-            # UPDATE HOLDING REGISTERS (4xxxx)
-            # Copy some of the values to holding registers for testing
-            
-            # DC Voltage (uint16, scale 0.1) - Register 40001
-            context.setValues(4, 0, [int(self.dc_voltage * 10)])
-            
-            # DC Current (uint16, scale 0.1) - Register 40003
-            context.setValues(4, 2, [int(self.dc_current * 10)])
-            
-            # AC Output Voltage (uint16, scale 0.1) - Register 40071
-            context.setValues(4, 70, [int(self.ac_voltage * 10)])
-            
-            # Total Power int32 (Big Endian) - Register 40775-40776
-            context.setValues(4, 774, [high_word, low_word])
-            
-            # Total Energy - Register 40513-40514
-            context.setValues(4, 512, [high_word, low_word])
-            
-            logger.info(f"Updated registers: "
-                      f"DC: {self.dc_voltage:.1f}V/{self.dc_current:.1f}A, "
-                      f"AC: {self.ac_voltage:.1f}V/{self.ac_current:.1f}A/{self.ac_frequency:.2f}Hz, "
-                      f"Power: {self.power:.1f}W, Energy: {self.energy/1000:.2f}kWh, "
-                      f"Temp: {self.temperature:.1f}°C")
-                      
-        except Exception as e:
-            logger.error(f"Error updating registers: {e}")
-    
+        self.server = SimulatorServer(host, seed)
+        if faults:
+            self.server.set_faults(load_fault_profiles(faults))
+
+        # Device i listens on port base_port + i % ports with unit id 1 + i // ports
+        self.addresses = [(base_port + index % ports, 1 + index // ports) for index in range(devices)]
+        self.model = FleetModel(registers, [unit_id for _, unit_id in self.addresses],
+                                update_interval, seed)
+        for (port, _), device in zip(self.addresses, self.model.devices):
+            self.server.add_device(port, device)
+
+    def update(self):
+        start = time.perf_counter()
+        self.model.update()
+        state = self.model.state
+        logger.info("Updated %d inverter(s) in %.3fs, first: DC %.1fV/%.1fA, AC %.1fV/%.1fA/%.2fHz, "
+                    "Power %.1fW, Energy %.2fkWh, Temp %.1f°C",
+                    state.devices, time.perf_counter() - start,
+                    state['dc_voltage'][0], state['dc_current'][0], state['ac_voltage'][0],
+                    state['ac_current'][0], state['ac_frequency'][0], state['power'][0],
+                    state['energy'][0] / 1000, state['temperature'][0])
+
     async def update_loop(self):
         """Periodically update register values."""
         while not shutdown_event.is_set():
-            self._update_registers()
+            try:
+                self.update()
+            except Exception as e:
+                logger.error("Error updating registers: %s", e)
             try:
                 # Wait for the update interval or until shutdown is requested
-                await asyncio.wait_for(
-                    shutdown_event.wait(),
-                    timeout=self.update_interval
-                )
+                await asyncio.wait_for(shutdown_event.wait(), timeout=self.update_interval)
             except asyncio.TimeoutError:
                 # This is expected after the timeout (update_interval)
                 pass
-            except Exception as e:
-                logger.error(f"Error in update loop: {e}")
-                break
 
-async def run_server(host="0.0.0.0", port=5020):
-    """Run the Modbus server."""
-    simulator = InverterSimulator(update_interval=5)
-    
+    def bridge_devices(self, host: str) -> List[dict]:
+        """``devices`` entries for a bridge config polling this fleet"""
+        return [{'name': f"sim-{port}-{unit_id}", 'host': host, 'port': port, 'unit_id': unit_id}
+                for port, unit_id in self.addresses]
+
+async def run_server(host="0.0.0.0", port=5020, config_file=DEFAULT_CONFIG, devices=1, ports=1,
+                     update_interval=5, write_config=None, faults_file=None, seed=None):
+    """Run the simulated fleet until a shutdown signal arrives."""
+    try:
+        registers = read_config(config_file).registers
+    except Exception as e:
+        # Serving the default registers instead would hide the mistake
+        logger.error("Error loading config from %s: %s", config_file, e)
+        raise SystemExit(1)
+    faults = None
+    if faults_file:
+        with open(faults_file, 'r') as f:
+            faults = yaml.safe_load(f) or {}
+    fleet = FleetSimulator(registers, devices, ports, port, host, update_interval, seed, faults)
+    if fleet.server.faults:
+        logger.info("Loaded %d fault profile(s) from %s", len(fleet.server.faults), faults_file)
+
+    if write_config:
+        with open(write_config, 'w') as f:
+            target = '127.0.0.1' if host in ('0.0.0.0', '') else host
+            yaml.safe_dump({'devices': fleet.bridge_devices(target)}, f, sort_keys=False)
+        logger.info("Wrote %d bridge device entries to %s", devices, write_config)
+
     # Setup signal handlers
     def signal_handler():
         logger.info("Shutdown signal received, stopping server...")
         shutdown_event.set()  # Signal all tasks to stop
-    
+
     # Register signal handlers for graceful shutdown
     loop = asyncio.get_running_loop()
     loop.add_signal_handler(signal.SIGINT, signal_handler)
     loop.add_signal_handler(signal.SIGTERM, signal_handler)
-    
-    # Start the update loop as a background task
-    update_task = asyncio.create_task(simulator.update_loop())
-    
-    # Start the Modbus server
-    logger.info(f"Starting Modbus server on {host}:{port}")
-    
+
+    fleet.update()
+    update_task = asyncio.create_task(fleet.update_loop())
+    logger.info("Starting %d simulated inverter(s) with %d register(s) on %s:%d-%d",
+                devices, len(registers), host, port, port + ports - 1)
+
     try:
-        # Create and start the server
-        server = await StartAsyncTcpServer(
-            context=simulator.datastore,
-            address=(host, port)
-        )
-        
+        await fleet.server.start()
+
         # Wait until shutdown is requested
         await shutdown_event.wait()
     except OSError as e:
@@ -227,54 +130,64 @@ async def run_server(host="0.0.0.0", port=5020):
         else:
             logger.error(f"Server error: {e}")
         shutdown_event.set()  # Signal to stop
-    except Exception as e:
-        logger.error(f"Server error: {e}")
-        shutdown_event.set()  # Signal to stop
     finally:
         logger.info("Server shutdown initiated...")
-        
-        # Clean exit of update task
-        if not update_task.done():
-            # Wait briefly for task to respond to shutdown event
-            try:
-                await asyncio.wait_for(update_task, timeout=2.0)
-            except asyncio.TimeoutError:
-                logger.warning("Update task did not exit cleanly, forcing cancellation")
-                update_task.cancel()
-                try:
-                    await update_task
-                except asyncio.CancelledError:
-                    pass
-        
+        shutdown_event.set()
+        await fleet.server.stop()
+        try:
+            await asyncio.wait_for(update_task, timeout=2.0)
+        except asyncio.TimeoutError:
+            logger.warning("Update task did not exit cleanly, forcing cancellation")
+            update_task.cancel()
+        if fleet.server.stats:
+            logger.info("Injected faults: %s", ', '.join(
+                f"{kind}={count}" for kind, count in sorted(fleet.server.stats.items())))
         logger.info("Server shutdown complete.")
 
-def run_simulator(host="0.0.0.0", port=5020):
+def run_simulator(host="0.0.0.0", port=5020, **options):
     """Run the simulator with a synchronous interface."""
+    exit_code = 0
     try:
         # Using a separate function ensures clean shutdown
-        asyncio.run(run_server(host, port))
+        asyncio.run(run_server(host, port, **options))
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received")
+    except SystemExit as e:
+        exit_code = e.code
     except Exception as e:
         logger.exception(f"Error running server: {e}")
+        exit_code = 1
     finally:
         # This ensures we always print this message when exiting
         logger.info("Simulator stopped.")
-        
+
         # Force exit to avoid hanging
-        sys.exit(0)
+        sys.exit(exit_code)
 
 if __name__ == "__main__":
-    # Parse command line arguments
-    if len(sys.argv) > 1:
-        host = sys.argv[1]
-    else:
-        host = "0.0.0.0"
-        
-    if len(sys.argv) > 2:
-        port = int(sys.argv[2])
-    else:
-        port = 5020  # Default to a non-privileged port
-    
+    parser = argparse.ArgumentParser(description="Simulate one or many Modbus TCP inverters")
+    parser.add_argument('host', nargs='?', default="0.0.0.0")
+    parser.add_argument('port', nargs='?', type=int, default=5020,
+                        help="first listening port (default 5020, a non-privileged port)")
+    parser.add_argument('--config', default=DEFAULT_CONFIG,
+                        help="bridge config whose registers are served (default config/inverter.yaml)")
+    parser.add_argument('--devices', type=int, default=1, help="number of simulated inverters")
+    parser.add_argument('--ports', type=int, default=1,
+                        help="listening ports, inverters are spread over them and over unit ids")
+    parser.add_argument('--interval', type=float, default=5, help="seconds between value updates")
+    parser.add_argument('--write-config', metavar='PATH',
+                        help="write the bridge 'devices' section for the simulated fleet")
+    parser.add_argument('--faults', metavar='PATH',
+                        help="YAML fault profiles: response delays, drops, resets and exceptions")
+    parser.add_argument('--seed', type=int, help="random seed for reproducible values and faults")
+    parser.add_argument('--log-file', default="modbus_server.log",
+                        help="log file, rotated at 10 MB (default modbus_server.log, empty for console only)")
+    args = parser.parse_args()
+
+    # Configured here rather than on import, so importing the simulator writes no log file
+    setup_logging(args.log_file)
+
     # Run the simulator
-    run_simulator(host, port)
\ No newline at end of file
+    run_simulator(args.host, args.port, config_file=args.config, devices=args.devices,
+                  ports=args.ports, update_interval=args.interval, write_config=args.write_config,
+                  faults_file=args.faults, seed=args.seed)
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+from pymodbus.exceptions import ConnectionException
+
+from modbus_pipeline import READ_REQUEST, AsyncPipelinedModbusClient, ReadRequest, RegisterResponse, write_request
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class UnitStats:
+    """Traffic of one unit id through a gateway"""
+    requests: int = 0
+    errors: int = 0  # requests without an answer; exception responses are answers
+    wait_seconds: float = 0.0  # time queued before being sent
+    response_seconds: float = 0.0  # time from sending a request to its answer
+
+class ModbusGateway:
+    """One shared connection to a Modbus TCP gateway for every unit id behind it.
+
+    Serial gateways answer one request at a time and often refuse a second
+    connection, so all devices at the same host and port read through this
+    object instead of opening a client each. Requests are queued per unit
+    id and sent round-robin, one request per unit with pending work in
+    turn, so a unit with a long read plan cannot hold the bus while the
+    others wait. At most ``window`` requests are outstanding on the
+    connection; keep it at 1 unless the gateway is known to queue requests.
+    Writes go through a priority lane served before any queued read, so a
+    setpoint waits at most for the requests already on the bus.
+
+    A read that times out leaves the connection open: one silent unit on the
+    bus must not fail the reads of its neighbours. The unit's other queued
+    reads fail at once instead of each holding the bus for a full timeout.
+    """
+
+    def __init__(self, host: str, port: int = 502, timeout: float = 3.0, window: int = 1):
+        self.host = host
+        self.port = port
+        self.window = max(1, window)
+        self.client = AsyncPipelinedModbusClient(host, port, timeout, self.window, close_on_timeout=False)
+        self.units: Dict[int, UnitStats] = {}
+        self._queues: Dict[int, Deque[Tuple[bytes, asyncio.Future, float]]] = {}
+        self._ready: Deque[int] = deque()  # units with queued requests, in serving order
+        self._priority: Deque[Tuple[int, bytes, asyncio.Future, float]] = deque()  # writes, in order
+        self._wakeup: Optional[asyncio.Event] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._workers: List[asyncio.Task] = []
+        self._outstanding = 0
+        self._busy_since = 0.0
+        self._busy_seconds = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def connected(self) -> bool:
+        return self.client.connected
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values()) + len(self._priority)
+
+    @property
+    def busy_seconds(self) -> float:
+        """Total time with at least one request outstanding"""
+        if self._outstanding:
+            return self._busy_seconds + time.monotonic() - self._busy_since
+        return self._busy_seconds
+
+    def unit_stats(self, unit_id: int) -> UnitStats:
+        return self.units.setdefault(unit_id, UnitStats())
+
+    async def connect(self) -> bool:
+        """Open the shared connection unless another unit already did"""
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+        async with self._connect_lock:
+            if self.client.connected:
+                return True
+            if not await self.client.connect():
+                return False
+            logger.info("Connected to gateway %s", self.name)
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._serve()) for _ in range(self.window)]
+        return True
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self.client.close()
+        error = ConnectionException(f"Connection to gateway {self.name} closed")
+        for queue in self._queues.values():
+            for _, future, _ in queue:
+                if not future.done():
+                    future.set_exception(error)
+            queue.clear()
+        self._ready.clear()
+        for _, _, future, _ in self._priority:
+            if not future.done():
+                future.set_exception(error)
+        self._priority.clear()
+
+    def _fail_unit(self, unit_id: int, error: Exception) -> None:
+        queue = self._queues.get(unit_id)
+        while queue:
+            _, future, _ = queue.popleft()
+            if not future.done():
+                future.set_exception(error)
+        if unit_id in self._ready:
+            self._ready.remove(unit_id)
+
+    async def read(self, request: ReadRequest, unit_id: int) -> RegisterResponse:
+        """Queue one read for a unit and wait for its response"""
+        if not self._workers or not self.client.connected:
+            raise ConnectionException(f"Not connected to gateway {self.name}")
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(unit_id, deque())
+        if not queue:
+            self._ready.append(unit_id)
+        queue.append((READ_REQUEST.pack(*request), future, time.monotonic()))
+        self._wakeup.set()
+        return await future
+
+    async def write(self, address: int, words: Sequence[int], unit_id: int) -> RegisterResponse:
+        """Write holding registers of a unit ahead of every queued read"""
+        if not self._workers or not self.client.connected:
+            raise ConnectionException(f"Not connected to gateway {self.name}")
+        future = asyncio.get_running_loop().create_future()
+        self._priority.append((unit_id, write_request(address, words), future, time.monotonic()))
+        self._wakeup.set()
+        return await future
+
+    async def read_blocks(self, requests: Sequence[ReadRequest],
+                          unit_id: int) -> List[Union[RegisterResponse, Exception]]:
+        """Responses to the read requests in order, or the exception that failed each one"""
+        return await asyncio.gather(*(self.read(request, unit_id) for request in requests),
+                                    return_exceptions=True)
+
+    def _next(self) -> Optional[Tuple[int, bytes, asyncio.Future, float]]:
+        """Next write, or else next read in round-robin order over the units with queued work"""
+        while self._priority:
+            item = self._priority.popleft()
+            if not item[2].done():
+                return item
+        while self._ready:
+            unit_id = self._ready.popleft()
+            queue = self._queues[unit_id]
+            pdu, future, queued_at = queue.popleft()
+            if queue:
+                self._ready.append(unit_id)
+            if not future.done():  # the caller may have given up waiting
+                return unit_id, pdu, future, queued_at
+        return None
+
+    async def _serve(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            unit_id, pdu, future, queued_at = item
+            stats = self.unit_stats(unit_id)
+            sent_at = time.monotonic()
+            stats.requests += 1
+            stats.wait_seconds += sent_at - queued_at
+            if not self._outstanding:
+                self._busy_since = sent_at
+            self._outstanding += 1
+            try:
+                response = await self.client.execute(pdu, unit_id)
+            except Exception as e:
+                stats.errors += 1
+                if not future.done():
+                    future.set_exception(e)
+                self._fail_unit(unit_id, e)
+            else:
+                if not future.done():
+                    future.set_result(response)
+            finally:
+                if not future.done():  # cancelled by close()
+                    future.set_exception(ConnectionException(f"Connection to gateway {self.name} closed"))
+                now = time.monotonic()
+                stats.response_seconds += now - sent_at
+                self._outstanding -= 1
+                if not self._outstanding:
+                    self._busy_seconds += now - self._busy_since
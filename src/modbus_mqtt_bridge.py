@@ -1,28 +1,108 @@
-import json
 import time
+_started = time.perf_counter()  # the startup profile counts from before the imports
+import json
+import struct
+import asyncio
+import functools
+import hashlib
+import importlib
+import inspect
 import logging
 import signal
+import socket
+import stat
+import threading
 import os
 import sys
-from dataclasses import dataclass, field, asdict
-from typing import Dict, List, Optional, Any, Union, Callable
-from pymodbus.client import ModbusTcpClient
-from pymodbus.exceptions import ModbusException
-import paho.mqtt.client as mqtt
-import yaml
-import socket
+from collections import deque
+from dataclasses import dataclass, field, fields, InitVar
+from typing import Deque, Dict, Iterable, List, Optional, Any, Tuple, Union, Callable
+_stdlib_imported = time.perf_counter()
+from mqtt_publisher import MqttPublisher, OutgoingMessage
+from store_forward import SegmentedLog
+from payload_codec import CompactEncoder, encode_json_batch
+from metrics import BridgeMetrics, MetricsServer
+from log_writer import LOG_FORMATS, TEXT_FORMAT, setup_logging
+from registers import MAX_READ_REGISTERS, REGISTER_FUNCTION_CODES, RegisterDefinition, registers_to_bytes
+from read_plan import (PollScheduler, ReadBlock, ScanGroup, build_scan_groups, replace_read_block,
+                       split_read_block)
+from aggregation import WindowAggregator
+from circuit_breaker import CircuitBreaker
+from commands import CommandError, WriteCommand, parse_write_command
+# pymodbus (with the pipelined clients), paho-mqtt, yaml, multiprocessing and
+# http.server are imported where they are used, like the fleet and supervisor
+# modes: each adds tens of milliseconds to startup, most runs need only some of
+# them, and pymodbus loads while the MQTT handshake is under way
+
+# Run as a script this module is __main__ (__mp_main__ in spawned workers), while
+# fleet.py and supervisor.py import it by name: make that the same module
+if __name__ in ('__main__', '__mp_main__'):
+    sys.modules.setdefault('modbus_mqtt_bridge', sys.modules[__name__])
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("modbus_bridge.log")
-    ]
-)
 logger = logging.getLogger(__name__)
 
+class StartupProfile:
+    """Time from the start of the bridge module to each startup phase, for --startup-profile.
+    
+    Phases are recorded until the first sample was delivered to the broker,
+    when the profile is printed if ``enabled``.
+    """
+
+    def __init__(self, started: float, phases: Iterable[Tuple[str, float]] = ()):
+        self.started = started
+        self.enabled = False
+        self.finished = False
+        self.sample_queued = False
+        self.phases: List[Tuple[str, float]] = list(phases)
+        self._lock = threading.Lock()
+
+    def mark(self, phase: str) -> None:
+        with self._lock:
+            if not self.finished:
+                self.phases.append((phase, time.perf_counter()))
+
+    def track_first_sample(self, on_delivered: Optional[Callable[[], None]]) -> Callable[[], None]:
+        """Mark the first sample queued; the returned callback marks its delivery and ends the profile"""
+        self.sample_queued = True
+        self.mark('first sample queued')
+
+        def delivered():
+            self.mark('first sample delivered')
+            self.finish()
+            if on_delivered:
+                on_delivered()
+        return delivered
+
+    def report(self) -> str:
+        lines = ["Startup profile (ms since the bridge module started loading):"]
+        previous = self.started
+        for phase, at in self.phases:
+            lines.append(f"  {phase:<28} {(at - self.started) * 1000:8.1f} {(at - previous) * 1000:+8.1f}")
+            previous = at
+        return "\n".join(lines)
+
+    def finish(self) -> None:
+        """Stop recording and print the profile if enabled, once"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        if self.enabled:
+            print(self.report(), file=sys.stderr, flush=True)
+
+startup = StartupProfile(_started, [
+    ('import stdlib', _stdlib_imported),
+])
+startup.mark('import bridge modules')
+
+def _import_on_first_use(name: str, phase: str):
+    """Import a heavy dependency where it is first needed, timing it in the startup profile"""
+    module = sys.modules.get(name)
+    if module is None:
+        module = importlib.import_module(name)
+        startup.mark(phase)
+    return module
+
 @dataclass
 class ModbusConfig:
     host: str
@@ -31,6 +111,20 @@ class ModbusConfig:
     timeout: int = 5
     retries: int = 3
     retry_delay: int = 1
+    pipeline_window: int = 1  # reads outstanding per connection, 1 disables pipelining
+
+@functools.lru_cache(maxsize=None)
+def unit_id_kwarg() -> str:
+    """Name of the unit id keyword argument, which differs across pymodbus 3.x releases"""
+    from pymodbus.client import ModbusTcpClient
+    parameters = inspect.signature(ModbusTcpClient.read_holding_registers).parameters
+    for name in ('device_id', 'slave', 'unit'):
+        if name in parameters:
+            return name
+    return 'slave'
+
+def _default_client_id() -> str:
+    return f"modbus-bridge-{socket.gethostname()}-{os.getpid()}"
 
 @dataclass
 class MQTTConfig:
@@ -43,96 +137,504 @@ class MQTTConfig:
     username: str = ""
     password: str = ""
     tls: bool = False
+    queue_size: int = 1000      # samples buffered between acquisition and publishing
+    max_inflight: int = 20      # unacknowledged QoS 1/2 messages
+    backpressure: str = "spill"  # Options: spill (store-and-forward), drop_oldest, block
+    block_timeout: float = 1.0  # seconds to wait for queue room with backpressure: block
+    payload_format: str = "json"  # Options: json, compact
+    batch_max_samples: int = 1  # samples per message, 1 disables batching
+    batch_max_latency_ms: int = 1000  # max time a sample waits in a batch
+    batch_max_bytes: int = 256 * 1024  # approximate max payload size of a batch
+    command_topic: str = ""  # write commands are accepted here, empty disables them
+    response_topic: str = ""  # command results, defaults to <command_topic>/response
     
     def __post_init__(self):
         if not self.client_id:
-            self.client_id = f"modbus-bridge-{socket.gethostname()}-{os.getpid()}"
+            self.client_id = _default_client_id()
+        if any(wildcard in self.command_topic for wildcard in '#+'):
+            raise ValueError("command_topic must not contain wildcards")
+        if self.command_topic and not self.response_topic:
+            self.response_topic = f"{self.command_topic}/response"
 
 @dataclass
-class RegisterDefinition:
-    name: str
-    address: int
-    count: int = 1
-    scale: float = 1.0
-    unit: str = ''
-    data_type: str = 'int16'  # Options: int16, uint16, int32, uint32, float32
-    byte_order: str = 'big'   # Options: big, little
+class DeviceConfig(ModbusConfig):
+    """A device polled in fleet mode, with optional device-specific registers"""
+    name: str = ''
+    topic: str = ''  # defaults to <mqtt.topic>/<name>
+    registers: Optional[List[RegisterDefinition]] = None
+    scan_groups: List[ScanGroup] = field(default_factory=list, init=False, repr=False)
     
     def __post_init__(self):
-        # Convert from user-friendly 4XXXX addressing to 0-based addressing used by pymodbus
-        if self.address >= 40001:
-            self.address -= 40001
+        if not self.name:
+            self.name = f"{self.host}-{self.port}-{self.unit_id}"
+
+class ExceptionReporter:
+    """Report-by-exception filter backed by a last-published value cache.
+    
+    A numeric point is reported when it moved by more than its deadband
+    (absolute, or percent of the last published value) since it was last
+    published; any other value is reported when it differs. Every point is
+    re-published at least once per heartbeat so consumers can tell a steady
+    value from a dead bridge.
+    """
+    
+    def __init__(self, registers: List[RegisterDefinition], heartbeat_interval: float):
+        self.heartbeat_interval = heartbeat_interval
+        self._registers = {reg.name: reg for reg in registers}
+        self._last: Dict[str, tuple] = {}  # name -> (value, monotonic time published)
+        
+    def _changed(self, reg: Optional[RegisterDefinition], value: Any, last_value: Any) -> bool:
+        numeric = (int, float)
+        if (reg is None or isinstance(value, bool) or isinstance(last_value, bool)
+                or not isinstance(value, numeric) or not isinstance(last_value, numeric)):
+            return value != last_value
+            
+        delta = abs(value - last_value)
+        if reg.deadband_type == 'percent':
+            if last_value == 0:
+                return delta > 0
+            return delta > abs(last_value) * reg.deadband / 100.0
+        if reg.deadband:
+            return delta > reg.deadband
+        return delta > 0
+        
+    def changes(self, data: Dict[str, Any], now: Optional[float] = None) -> Dict[str, Any]:
+        """Return the points of a sample that should be published"""
+        now = time.monotonic() if now is None else now
+        changed = {}
+        
+        for name, point in data.items():
+            last = self._last.get(name)
+            reg = self._registers.get(name)
+            if last is None:
+                changed[name] = point
+                continue
+                
+            max_silence = reg.max_silence if reg and reg.max_silence is not None else self.heartbeat_interval
+            if now - last[1] >= max_silence or self._changed(reg, point.get("value"), last[0]):
+                changed[name] = point
+                
+        return changed
+        
+    def mark_published(self, data: Dict[str, Any], now: Optional[float] = None) -> None:
+        """Remember the values of points that were handed to MQTT"""
+        now = time.monotonic() if now is None else now
+        for name, point in data.items():
+            self._last[name] = (point.get("value"), now)
+
+class SampleBatcher:
+    """Accumulates samples until a batch is full or its oldest sample is too old.
+    
+    A batch is handed out when it holds ``max_samples`` samples, when the
+    next sample would push it over ``max_bytes``, or once ``max_latency``
+    seconds passed since its first sample (see ``deadline``). Payload sizes
+    are estimated from the average sample size of the previous batch, the
+    very first sample is measured with ``estimate``.
+    """
+    
+    def __init__(self, max_samples: int, max_latency: float, max_bytes: int,
+                 estimate: Callable[[Dict[str, Any]], int]):
+        self.max_samples = max(1, max_samples)
+        self.max_latency = max_latency
+        self.max_bytes = max_bytes
+        self._estimate = estimate
+        self._samples: List[Dict[str, Any]] = []
+        self._deadline: Optional[float] = None
+        self._sample_bytes = 0.0
+        
+    def __len__(self) -> int:
+        return len(self._samples)
+        
+    @property
+    def deadline(self) -> Optional[float]:
+        """Monotonic time by which the pending batch must be published"""
+        return self._deadline
+        
+    def add(self, sample: Dict[str, Any], now: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """Add a sample, returning a batch to publish once a limit is reached"""
+        now = time.monotonic() if now is None else now
+        if not self._sample_bytes:
+            self._sample_bytes = float(self._estimate(sample))
+            
+        ready = None
+        if self._samples and (len(self._samples) + 1) * self._sample_bytes > self.max_bytes:
+            ready = self.take()
+        if not self._samples:
+            self._deadline = now + self.max_latency
+        self._samples.append(sample)
+        if ready is None and len(self._samples) >= self.max_samples:
+            ready = self.take()
+        return ready
+        
+    def due(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self._deadline is not None and now >= self._deadline
+        
+    def take(self) -> List[Dict[str, Any]]:
+        """Hand out the pending samples and start a new batch"""
+        samples, self._samples = self._samples, []
+        self._deadline = None
+        return samples
+        
+    def record_size(self, samples: int, size: int) -> None:
+        """Update the per-sample size estimate from an encoded batch"""
+        if samples:
+            self._sample_bytes = size / samples
+
+def _is_unavailable(error: Exception) -> bool:
+    """Whether an error means the device did not answer at all, as opposed to an exception response"""
+    from pymodbus.exceptions import ConnectionException, ModbusIOException
+    return isinstance(error, (ModbusIOException, ConnectionException, TimeoutError, asyncio.TimeoutError, OSError))
+
+def _check_gateway_response(response) -> None:
+    """Treat a gateway's path unavailable / target failed answer like no answer at all"""
+    if response.isError():
+        from modbus_pipeline import GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED
+        if getattr(response, 'exception_code', None) in (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED):
+            from pymodbus.exceptions import ModbusIOException
+            raise ModbusIOException(f"Gateway could not reach the unit: {response}")
 
 @dataclass
 class AppConfig:
     modbus: ModbusConfig
     mqtt: MQTTConfig
     registers: List[RegisterDefinition]
-    loop_interval: int = 10   # seconds
+    loop_interval: int = 10   # seconds, default poll period of registers
     reconnect_interval: int = 30  # seconds
     health_check_interval: int = 60  # seconds
-    json_file: str = "modbus_data.json"
+    buffer_dir: str = "buffer"  # store-and-forward log directory
+    buffer_segment_bytes: int = 1024 * 1024  # size at which a new log segment is started
+    buffer_max_bytes: int = 64 * 1024 * 1024  # oldest segments are dropped beyond this size
+    buffer_fsync_interval: float = 1.0  # seconds between fsyncs of the log
+    max_read_gap: int = 10  # unused registers allowed inside a coalesced block read
+    max_block_size: int = MAX_READ_REGISTERS  # registers per block read
+    scan_classes: Dict[str, float] = field(default_factory=dict)  # name -> poll period in seconds
+    devices: List[DeviceConfig] = field(default_factory=list)  # enables fleet mode
+    max_concurrency: int = 50  # devices read at the same time in fleet mode
+    report_by_exception: bool = False  # publish only points that changed beyond their deadband
+    heartbeat_interval: float = 300  # seconds, max silence of an unchanged point
+    aggregate_window: float = 60  # seconds, window of registers not published raw
+    aggregate_time_weighted: bool = False  # add the time-weighted mean to window statistics
+    metrics_port: int = 0  # Prometheus metrics endpoint, 0 disables it
+    metrics_host: str = "127.0.0.1"
+    breaker_backoff_max: float = 300  # seconds, longest backoff of an unresponsive device
+    breaker_jitter: float = 0.2  # random spread of each backoff, as a fraction
+    workers: int = 0  # worker processes polling the devices in fleet mode, 0 or 1 polls in-process
+    worker_restart_delay: float = 5  # seconds before a dead worker is restarted
+    config_watch_interval: float = 0  # seconds between checks of the config file for changes, 0 disables
+    log_file: str = "modbus_bridge.log"  # empty logs to the console only
+    log_level: str = "INFO"
+    log_format: str = "text"  # Options: text, json (one JSON object per line)
+    log_max_bytes: int = 10 * 1024 * 1024  # size at which the log file is rotated, 0 disables rotation
+    log_backup_count: int = 5  # rotated log files kept
+    log_rate_limit: float = 60  # seconds, identical warnings and errors are logged once per window, 0 disables
+    previous: InitVar[Optional['AppConfig']] = None  # running config a reload takes unchanged plans from
+    scan_groups: List[ScanGroup] = field(init=False, repr=False)
+    read_plan: List[ReadBlock] = field(init=False, repr=False)
+
+    def __post_init__(self, previous: Optional['AppConfig'] = None):
+        if self.log_format not in LOG_FORMATS:
+            raise ValueError(f"Unknown log_format '{self.log_format}'")
+        if not isinstance(logging.getLevelName(self.log_level.upper()), int):
+            raise ValueError(f"Unknown log_level '{self.log_level}'")
+        # Compile the read plans once at config load instead of on every cycle
+        self.compile(previous)
+
+    @property
+    def plan_settings(self) -> tuple:
+        """Settings every compiled read plan depends on"""
+        return self.scan_classes, self.loop_interval, self.max_read_gap, self.max_block_size
+
+    def _compile_registers(self, registers: List[RegisterDefinition]) -> List[ScanGroup]:
+        return build_scan_groups(registers, self.scan_classes, self.loop_interval,
+                                 self.max_read_gap, self.max_block_size)
+
+    def compile(self, previous: Optional['AppConfig'] = None) -> None:
+        """Compile the scan groups of the top-level registers and of every device.
+        
+        Register lists equal to those of ``previous`` are replaced by the
+        running objects, decoders included, and keep their compiled scan
+        groups, so a reload only recompiles what changed and unchanged
+        devices can be recognized by identity.
+        """
+        reuse = previous is not None and self.plan_settings == previous.plan_settings
+        if previous is not None and self.registers == previous.registers:
+            self.registers = previous.registers
+        if reuse and self.registers is previous.registers:
+            self.scan_groups = previous.scan_groups
+        else:
+            self.scan_groups = self._compile_registers(self.registers)
+        self.read_plan = [block for group in self.scan_groups for block in group.read_plan]
+        
+        # Devices without their own registers share the compiled top-level plan
+        running = {device.name: device for device in previous.devices} if previous is not None else {}
+        for device in self.devices:
+            if device.registers is None:
+                device.scan_groups = self.scan_groups
+                continue
+            old = running.get(device.name)
+            if old is not None and device.registers == old.registers:
+                device.registers = old.registers
+            if reuse and old is not None and device.registers is old.registers:
+                device.scan_groups = old.scan_groups
+            else:
+                device.scan_groups = self._compile_registers(device.registers)
+
+# Settings a config reload cannot change while the bridge runs
+RESTART_SETTINGS = ('mqtt', 'buffer_dir', 'buffer_segment_bytes', 'buffer_max_bytes', 'buffer_fsync_interval',
+                    'metrics_port', 'metrics_host', 'max_concurrency', 'workers', 'log_file', 'log_level',
+                    'log_format', 'log_max_bytes', 'log_backup_count', 'log_rate_limit')
+
+def configure_logging(config: Optional[AppConfig] = None, text_format: str = TEXT_FORMAT) -> None:
+    """Route logging through the background writer; called by the entry points, not on import.
+    
+    Without a config it logs to the console only, until the config is loaded.
+    """
+    if config is None:
+        setup_logging(log_file='', text_format=text_format)
+        return
+    setup_logging(config.log_file, config.log_level, config.log_format, text_format, config.log_max_bytes,
+                  config.log_backup_count, config.log_rate_limit)
+
+def _connection_settings(modbus_config: ModbusConfig) -> tuple:
+    """Settings of a device that take a new connection and breaker to change"""
+    return tuple(getattr(modbus_config, f.name) for f in fields(ModbusConfig))
+
+class ConfigWatcher:
+    """Notices changes of the config file by polling its modification time and size"""
+    
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._stamp = self._read_stamp()
+        self._next_check = time.monotonic() + interval
+        
+    def _read_stamp(self) -> Optional[tuple]:
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return info.st_mtime_ns, info.st_size
+        
+    def changed(self, now: Optional[float] = None) -> bool:
+        """Whether the file changed since the last check, at most once per interval"""
+        now = time.monotonic() if now is None else now
+        if self.interval <= 0 or now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        stamp = self._read_stamp()
+        # A missing file is being replaced, the new one is picked up by a later check
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return True
 
 class ModbusMQTTBridge:
-    def __init__(self, config: AppConfig):
+    def __init__(self, config: AppConfig, config_file: Optional[str] = None):
         self.config = config
-        self._modbus_client: Optional[ModbusTcpClient] = None
-        
-        # Use MQTTv311 instead of MQTTv5 to avoid callback issues
-        self._mqtt_client = mqtt.Client(client_id=config.mqtt.client_id, 
-                                    protocol=mqtt.MQTTv311)
+        self.config_file = config_file  # reloaded on SIGHUP and, if watched, when it changes
+        self._modbus_client = None  # created by _connect_modbus
+        self._pipelined = False  # whether _modbus_client is a PipelinedModbusClient
+        self._mqtt_client = self._create_mqtt_client()
         
         self._running = False
+        self._stop_event = threading.Event()
         self._last_reconnect_attempt = 0
         self._last_health_check = 0
         self._loop_count = 0
+        self._reporter = ExceptionReporter(config.registers, config.heartbeat_interval)
+        self._encoder = CompactEncoder(config.registers) if config.mqtt.payload_format == 'compact' else None
+        self._batcher = self._create_batcher(self._encoder)
+        self._aggregator = WindowAggregator(config.registers, config.aggregate_window,
+                                            config.aggregate_time_weighted)
+        
+        # Samples are buffered on disk until the broker acknowledged them
+        self._store = self._create_store()
         
-        # Configure MQTT client
-        self._mqtt_client.on_connect = self._on_mqtt_connect
-        self._mqtt_client.on_disconnect = self._on_mqtt_disconnect
+        self._metrics = BridgeMetrics()
+        self._metrics_server: Optional[MetricsServer] = None
+        self._device_name = f"{config.modbus.host}-{config.modbus.port}-{config.modbus.unit_id}"
+        # In fleet mode every device gets its own breaker instead
+        self._breaker = None if config.devices else self._create_breaker(config.modbus, self._device_name)
+        
+        # Publishing runs on its own thread so a slow broker never delays acquisition
+        self._publisher = self._create_publisher()
+        self._metrics.queue_depth.set_function(lambda: self._publisher.queue_depth)
+        self._metrics.inflight.set_function(lambda: self._publisher.inflight)
+        self._metrics.published.set_function(lambda: self._publisher.published)
+        self._metrics.dropped.set_function(lambda: self._publisher.dropped)
+        if self._store is not None:
+            self._metrics.store_pending.set_function(lambda: self._store.pending)
+            
+        # Write commands are checked against the writable registers of each device
+        self._writable = self._writable_registers(config)
+        self._commands: Deque[WriteCommand] = deque()
+        self._wakeup = threading.Event()  # interrupts the poll loop's sleep for commands, reloads and shutdown
+            
+        self._reload_requested = False
+        self._watcher = ConfigWatcher(config_file, config.config_watch_interval) if config_file else None
+
+    def _writable_registers(self, config: AppConfig) -> Dict[str, Dict[str, RegisterDefinition]]:
+        """Registers write commands may target, by device"""
+        if config.devices:
+            return {
+                device.name: {reg.name: reg for reg in device.registers or config.registers if reg.writable}
+                for device in config.devices
+            }
+        return {self._device_name: {reg.name: reg for reg in config.registers if reg.writable}}
+
+    def _create_mqtt_client(self):
+        """MQTT client with the bridge's callbacks, credentials and TLS settings"""
+        mqtt = _import_on_first_use('paho.mqtt.client', 'import paho-mqtt')
+        mqtt_config = self.config.mqtt
+        
+        # Use MQTTv311 instead of MQTTv5 to avoid callback issues
+        client = mqtt.Client(client_id=mqtt_config.client_id, protocol=mqtt.MQTTv311)
+        client.on_connect = self._on_mqtt_connect
+        client.on_disconnect = self._on_mqtt_disconnect
         
         # Set MQTT credentials if provided
-        if config.mqtt.username:
-            self._mqtt_client.username_pw_set(config.mqtt.username, config.mqtt.password)
+        if mqtt_config.username:
+            client.username_pw_set(mqtt_config.username, mqtt_config.password)
             
         # Enable TLS if configured
-        if config.mqtt.tls:
-            self._mqtt_client.tls_set()
+        if mqtt_config.tls:
+            client.tls_set()
+            
+        if mqtt_config.command_topic:
+            client.message_callback_add(mqtt_config.command_topic, self._on_mqtt_command)
+        return client
+
+    def _create_store(self) -> Optional[SegmentedLog]:
+        config = self.config
+        if config.mqtt.backpressure != 'spill':
+            return None
+        return SegmentedLog(
+            config.buffer_dir,
+            segment_bytes=config.buffer_segment_bytes,
+            max_bytes=config.buffer_max_bytes,
+            fsync_interval=config.buffer_fsync_interval
+        )
+
+    def _create_publisher(self) -> MqttPublisher:
+        mqtt_config = self.config.mqtt
+        publisher = MqttPublisher(
+            self._mqtt_client,
+            queue_size=mqtt_config.queue_size,
+            max_inflight=mqtt_config.max_inflight,
+            backpressure=mqtt_config.backpressure,
+            store=self._store,
+            block_timeout=mqtt_config.block_timeout,
+            observe=self._metrics.observe_phase
+        )
+        self._mqtt_client.on_publish = publisher.on_publish
+        return publisher
+
+    def _create_batcher(self, encoder: Optional[CompactEncoder]) -> Optional[SampleBatcher]:
+        """Batching stage between acquisition and publishing, if enabled"""
+        mqtt_config = self.config.mqtt
+        if mqtt_config.batch_max_samples <= 1:
+            return None
+        if encoder:
+            estimate = lambda sample: encoder.size
+        else:
+            estimate = lambda sample: len(json.dumps(sample))
+        return SampleBatcher(
+            mqtt_config.batch_max_samples,
+            mqtt_config.batch_max_latency_ms / 1000.0,
+            mqtt_config.batch_max_bytes,
+            estimate
+        )
+
+    def _create_breaker(self, modbus_config: ModbusConfig, name: str) -> CircuitBreaker:
+        """Circuit breaker of a device, exported as a metric"""
+        breaker = CircuitBreaker(
+            name,
+            failure_threshold=modbus_config.retries,
+            backoff_initial=modbus_config.retry_delay,
+            backoff_max=self.config.breaker_backoff_max,
+            jitter=self.config.breaker_jitter
+        )
+        self._metrics.breaker_state.labels(name).set_function(
+            lambda: CircuitBreaker.STATE_VALUES[breaker.state])
+        return breaker
+
+    def _start_metrics_server(self) -> None:
+        if not self.config.metrics_port:
+            return
+        try:
+            self._metrics_server = MetricsServer(self._metrics, self.config.metrics_host,
+                                                 self.config.metrics_port)
+            self._metrics_server.start()
+        except OSError as e:
+            logger.error("Failed to start metrics endpoint on port %d: %s", self.config.metrics_port, e)
+            self._metrics_server = None
+
+    def _scan_observer(self, device: str) -> Callable[[ScanGroup, float, int], None]:
+        """Scheduler callback recording cycle jitter and overruns of a device"""
+        jitter = self._metrics.cycle_jitter_seconds
+        overruns = self._metrics.overruns
+        
+        def observe(group: ScanGroup, lateness: float, missed: int) -> None:
+            jitter.labels(device, group.name).observe(lateness)
+            if missed:
+                overruns.labels(device, group.name).inc(missed)
+        return observe
+
+    def _count_errors(self, registers: List[RegisterDefinition], kind: str,
+                      device: Optional[str] = None) -> None:
+        counter = self._metrics.register_errors
+        for reg in registers:
+            counter.labels(device or self._device_name, reg.name, kind).inc()
 
     def _connect_modbus(self) -> bool:
-        """Connect to Modbus device with retries"""
-        for attempt in range(self.config.modbus.retries):
-            try:
-                if self._modbus_client and self._modbus_client.connected:
-                    self._modbus_client.close()
-                
-                self._modbus_client = ModbusTcpClient(
-                    self.config.modbus.host,
-                    port=self.config.modbus.port,
-                    timeout=self.config.modbus.timeout
+        """Make one connection attempt, leaving retries and backoff to the circuit breaker"""
+        try:
+            if self._modbus_client and self._modbus_client.connected:
+                self._modbus_client.close()
+            
+            # Requests are not retried by the client: a retry of a timed out
+            # request waits out the full timeout again
+            modbus_config = self.config.modbus
+            self._pipelined = modbus_config.pipeline_window > 1
+            if self._pipelined:
+                pipeline = _import_on_first_use('modbus_pipeline', 'import pymodbus')
+                self._modbus_client = pipeline.PipelinedModbusClient(
+                    modbus_config.host,
+                    port=modbus_config.port,
+                    timeout=modbus_config.timeout,
+                    window=modbus_config.pipeline_window
                 )
-                
-                if self._modbus_client.connect():
-                    logger.info("Connected to Modbus device at %s:%d", 
-                              self.config.modbus.host, self.config.modbus.port)
-                    return True
-                else:
-                    logger.error("Failed to connect to Modbus device (attempt %d/%d)",
-                               attempt+1, self.config.modbus.retries)
-            except Exception as e:
-                logger.error("Modbus connection attempt %d/%d failed: %s", 
-                           attempt+1, self.config.modbus.retries, e)
-                
-            if attempt < self.config.modbus.retries - 1:
-                time.sleep(self.config.modbus.retry_delay)
-                
+            else:
+                pymodbus_client = _import_on_first_use('pymodbus.client', 'import pymodbus')
+                self._modbus_client = pymodbus_client.ModbusTcpClient(
+                    modbus_config.host,
+                    port=modbus_config.port,
+                    timeout=modbus_config.timeout,
+                    retries=0
+                )
+            
+            if self._modbus_client.connect():
+                logger.info("Connected to Modbus device at %s:%d", 
+                          self.config.modbus.host, self.config.modbus.port)
+                return True
+            logger.error("Failed to connect to Modbus device at %s:%d",
+                         self.config.modbus.host, self.config.modbus.port)
+        except Exception as e:
+            logger.error("Modbus connection attempt failed: %s", e)
+            
+        self._breaker.record_failure()
         return False
 
     def _on_mqtt_connect(self, client, userdata, flags, rc):
         """MQTT connection callback"""
         if rc == 0:
+            startup.mark('mqtt connected')
             logger.info("Connected to MQTT broker at %s:%d", 
                       self.config.mqtt.broker, self.config.mqtt.port)
+            # Subscriptions do not survive a reconnect with a clean session
+            if self.config.mqtt.command_topic:
+                client.subscribe(self.config.mqtt.command_topic, qos=self.config.mqtt.qos)
         else:
             rc_messages = {
                 1: "incorrect protocol version",
@@ -151,49 +653,255 @@ class ModbusMQTTBridge:
         else:
             logger.warning("Unexpected disconnect from MQTT broker (rc=%d)", rc)
 
+    def _on_mqtt_command(self, client, userdata, message):
+        """MQTT callback for the command topic, on the network thread"""
+        received = time.monotonic()
+        try:
+            request = json.loads(message.payload)
+        except ValueError as e:
+            self._reject(None, f"invalid JSON: {e}", received)
+            return
+        try:
+            command = parse_write_command(request, self._writable, received)
+        except CommandError as e:
+            self._reject(request, str(e), received)
+            return
+        logger.info("Write command %s: %s of %s = %r", command.correlation_id,
+                    command.register.name, command.device, command.value)
+        self._dispatch_command(command)
+
+    def _reject(self, request: Any, error: str, received: float) -> None:
+        request = request if isinstance(request, dict) else {}
+        device = request.get('device')
+        logger.warning("Rejected write command %s: %s", request.get('id'), error)
+        known = isinstance(device, str) and device in self._writable
+        self._metrics.commands.labels(device if known else '', 'rejected').inc()
+        self._publish_response({
+            "id": request.get('id'),
+            "device": device,
+            "register": request.get('register'),
+            "value": request.get('value'),
+            "status": "rejected",
+            "latency_ms": round((time.monotonic() - received) * 1000, 1),
+            "error": error,
+        })
+
+    def _dispatch_command(self, command: WriteCommand) -> None:
+        """Hand a validated command to the poll loop, which writes it before its next block read"""
+        self._commands.append(command)
+        self._wakeup.set()
+
+    def _finish_command(self, command: WriteCommand, error: Optional[str] = None) -> None:
+        """Count a command's outcome and acknowledge it on the response topic"""
+        status = 'failed' if error else 'ok'
+        if error:
+            logger.error("Write of %s to %s failed: %s", command.register.name, command.device, error)
+        else:
+            logger.info("Wrote %s of %s in %.1fms", command.register.name, command.device, command.latency * 1000)
+        self._metrics.commands.labels(command.device, status).inc()
+        self._metrics.command_seconds.labels(command.device).observe(command.latency)
+        self._publish_response(command.result(status, error))
+
+    def _publish_response(self, result: Dict[str, Any]) -> None:
+        # Acknowledgements jump the publish queue and are never spilled to the store
+        self._publisher.submit_urgent(OutgoingMessage(
+            self.config.mqtt.response_topic,
+            json.dumps(result),
+            qos=self.config.mqtt.qos
+        ))
+
+    def _write_registers(self, address: int, words: List[int]):
+        """Write holding registers of the device"""
+        if self._pipelined:
+            return self._modbus_client.write(address, words, self.config.modbus.unit_id)
+        unit = {unit_id_kwarg(): self.config.modbus.unit_id}
+        if len(words) == 1:
+            return self._modbus_client.write_register(address, words[0], **unit)
+        return self._modbus_client.write_registers(address, words, **unit)
+
+    def _execute_commands(self) -> None:
+        """Write the queued commands, in the order they arrived"""
+        while self._commands:
+            command = self._commands.popleft()
+            error = None
+            if not self._modbus_client or not self._modbus_client.connected:
+                if not self._breaker.allow() or not self._connect_modbus():
+                    error = "device unavailable"
+            if error is None:
+                try:
+                    response = self._write_registers(command.register.address, command.words)
+                    if response.isError():
+                        error = f"device answered {response}"
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+            self._finish_command(command, error)
+
     def _process_register_value(self, reg: RegisterDefinition, registers: List[int]) -> Union[float, List[float], str]:
         """Process register values based on data type and byte order"""
         if not registers:
             return "error"
             
         try:
-            # Handle single register case
-            if reg.count == 1:
-                value = registers[0] * reg.scale
-                return value
-                
-            # Handle multi-register cases
-            if reg.data_type == 'int32' or reg.data_type == 'uint32':
-                if reg.byte_order == 'big':
-                    value = (registers[0] << 16) + registers[1]
-                else:
-                    value = (registers[1] << 16) + registers[0]
-                    
-                # Handle signed integers
-                if reg.data_type == 'int32' and value > 0x7FFFFFFF:
-                    value -= 0x100000000
-                    
-                return value * reg.scale
-                
-            elif reg.data_type == 'float32' and len(registers) >= 2:
-                import struct
-                if reg.byte_order == 'big':
-                    bytes_val = struct.pack('>HH', registers[0], registers[1])
-                else:
-                    bytes_val = struct.pack('<HH', registers[0], registers[1])
-                    
-                value = struct.unpack('>f', bytes_val)[0]
-                return value * reg.scale
-                
-            # Default case: return scaled list
-            return [v * reg.scale for v in registers]
-            
+            return reg.decoder.decode(registers_to_bytes(registers))
         except Exception as e:
             logger.exception("Error processing register value: %s", e)
             return "error"
 
-    def _read_registers(self) -> Dict[str, Any]:
-        """Read all configured registers with error handling"""
+    def _read_block_registers(self, register_type: str, address: int, count: int):
+        """Issue a single read request against the holding or input register table"""
+        if self._pipelined:
+            response = self._modbus_client.read_blocks(
+                [(REGISTER_FUNCTION_CODES[register_type], address, count)], self.config.modbus.unit_id)[0]
+            if isinstance(response, Exception):
+                raise response
+            return response
+        unit = {unit_id_kwarg(): self.config.modbus.unit_id}
+        if register_type == 'input':
+            return self._modbus_client.read_input_registers(address, count=count, **unit)
+        return self._modbus_client.read_holding_registers(address, count=count, **unit)
+
+    def _store_block_values(self, block: ReadBlock, registers: List[int], data: Dict[str, Any],
+                            device: Optional[str] = None) -> None:
+        """Slice each register's value out of a block response"""
+        buffer = registers_to_bytes(registers)
+        
+        for reg in block.registers:
+            try:
+                value = reg.decoder.decode(buffer, (reg.address - block.address) * 2)
+            except struct.error as e:
+                logger.error("Short response decoding %s (address %d): %s", reg.name, reg.display_address, e)
+                self._count_errors([reg], 'decode', device)
+                value = "error"
+            data[reg.name] = {
+                "value": value,
+                "unit": reg.unit,
+                "address": reg.display_address
+            }
+
+    def _store_error_response(self, block: ReadBlock, response, data: Dict[str, Any],
+                              device: Optional[str] = None) -> None:
+        """Record an exception response for a single-register block"""
+        reg = block.registers[0]
+        self._count_errors([reg], 'exception_response', device)
+        logger.warning(
+            "Error response reading %s (address %d): %s", 
+            reg.name, reg.display_address, response
+        )
+        data[reg.name] = {
+            "value": "error",
+            "unit": reg.unit,
+            "address": reg.display_address
+        }
+
+    def _read_block(self, block: ReadBlock, data: Dict[str, Any], response=None,
+                    groups: Iterable[ScanGroup] = ()) -> bool:
+        """Read one coalesced block and slice each register's value out of it.
+        
+        ``response`` is the block's answer when it was already fetched by a
+        pipelined read, either a response or the exception that failed it.
+        A block the device rejects is replaced by smaller reads in the plan of
+        ``groups``. Returns False when the device did not answer at all.
+        """
+        if response is None:
+            logger.debug(
+                "Reading %s block (address %d, count=%d, %d registers) from unit %d",
+                block.register_type, block.address, block.count,
+                len(block.registers), self.config.modbus.unit_id
+            )
+            
+            start = time.perf_counter()
+            try:
+                response = self._read_block_registers(block.register_type, block.address, block.count)
+            except Exception as e:
+                response = e
+            else:
+                self._metrics.block_read_seconds.labels(self._device_name, block.label).observe(
+                    time.perf_counter() - start)
+                
+        answered, parts = self._store_block_response(block, response, data, groups)
+        for index, part in enumerate(parts):
+            if not self._read_block(part, data, groups=groups):
+                self._mark_unavailable([reg for rest in parts[index + 1:] for reg in rest.registers], data)
+                return False
+        return answered
+
+    def _store_block_response(self, block: ReadBlock, response, data: Dict[str, Any],
+                              groups: Iterable[ScanGroup] = (),
+                              device: Optional[str] = None) -> Tuple[bool, List[ReadBlock]]:
+        """Record a block's answer, or the exception that failed its read, in ``data``.
+        
+        Shared by the single device and fleet read paths, which only differ
+        in how they fetch a block. Returns whether the device answered, and
+        the smaller blocks to read instead of a block of several registers
+        it rejected; they also replace the block in the plan of ``groups``.
+        """
+        try:
+            if isinstance(response, Exception):
+                raise response
+            _check_gateway_response(response)
+            
+            if not response.isError():
+                self._store_block_values(block, response.registers, data, device)
+                return True, []
+            if len(block.registers) == 1:
+                self._store_error_response(block, response, data, device)
+                return True, []
+            # A hole inside the block may not be readable on this device,
+            # read it in smaller parts from now on
+            parts = split_read_block(block)
+            logger.warning("Error response reading block %s from %s: %s, "
+                           "reading it as %d smaller blocks from now on",
+                           block.label, device or self._device_name, response, len(parts))
+            replace_read_block(groups, block, parts)
+            return True, parts
+            
+        except Exception as e:
+            from pymodbus.exceptions import ModbusException
+            unavailable = _is_unavailable(e)
+            if isinstance(e, ModbusException):
+                logger.error("Modbus error reading block at %d (count=%d) from %s: %s",
+                             block.address, block.count, device or self._device_name, e)
+            else:
+                # Anything but a lost connection or timeout is a bug worth a traceback
+                logger.error("Unexpected error reading block at %d (count=%d) from %s: %s",
+                             block.address, block.count, device or self._device_name, e,
+                             exc_info=not unavailable)
+            self._mark_block_error(block, data, e, device)
+            return not unavailable, []
+
+    def _mark_block_error(self, block: ReadBlock, data: Dict[str, Any], error: Exception,
+                          device: Optional[str] = None) -> None:
+        """Record a read error for every register in a block"""
+        from pymodbus.exceptions import ModbusIOException
+        timed_out = isinstance(error, (ModbusIOException, TimeoutError, asyncio.TimeoutError))
+        self._count_errors(block.registers, 'timeout' if timed_out else 'exception', device)
+        for reg in block.registers:
+            data[reg.name] = {
+                "value": "error",
+                "unit": reg.unit,
+                "address": reg.display_address,
+                "error": str(error)
+            }
+
+    def _mark_unavailable(self, registers: List[RegisterDefinition], data: Dict[str, Any],
+                          device: Optional[str] = None) -> None:
+        """Record the registers skipped in a cycle once the device stopped answering"""
+        self._count_errors(registers, 'unavailable', device)
+        for reg in registers:
+            data[reg.name] = {
+                "value": "error",
+                "unit": reg.unit,
+                "address": reg.display_address,
+                "error": "device unavailable"
+            }
+
+    def _read_registers(self, groups: Optional[List[ScanGroup]] = None) -> Dict[str, Any]:
+        """Read the registers of the given scan groups (all by default) block by block.
+        
+        The cycle is skipped while the device's circuit breaker is open, and
+        the remaining blocks are given up as soon as the device stops answering
+        instead of each waiting out the timeout.
+        """
         results = {
             "timestamp": time.time(), 
             "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
@@ -201,116 +909,144 @@ class ModbusMQTTBridge:
             "data": {}
         }
         
-        if not self._modbus_client or not self._modbus_client.connected:
-            logger.error("Modbus client not connected")
+        if not self._breaker.allow():
+            logger.debug("Modbus device unavailable, next attempt in %.1fs",
+                         self._breaker.retry_at - time.monotonic())
             return results
+        
+        if not self._modbus_client or not self._modbus_client.connected:
+            if not self._connect_modbus():
+                return results
 
-        for reg in self.config.registers:
-            try:
-                # Set the slave ID explicitly
-                self._modbus_client.unit_id = self.config.modbus.unit_id
-                
-                # Log detailed register info
-                logger.debug(
-                    "Reading %s (address %d, count=%d) from unit %d",
-                    reg.name, reg.address, reg.count, self.config.modbus.unit_id
-                )
-                
-                response = self._modbus_client.read_holding_registers(
-                    reg.address,
-                    count=reg.count
-                )
-                
-                if response.isError():
-                    logger.warning(
-                        "Error response reading %s (address %d): %s", 
-                        reg.name, reg.address + 40001, response
-                    )
-                    value = "error"
-                else:
-                    value = self._process_register_value(reg, response.registers)
-                    
-                results["data"][reg.name] = {
-                    "value": value,
-                    "unit": reg.unit,
-                    "address": reg.address + 40001
-                }
-                
-            except ModbusException as e:
-                logger.error(
-                    "Modbus error reading %s (address %d): %s", 
-                    reg.name, reg.address + 40001, e
-                )
-                results["data"][reg.name] = {
-                    "value": "error",
-                    "unit": reg.unit,
-                    "address": reg.address + 40001,
-                    "error": str(e)
-                }
-            except Exception as e:
-                logger.exception(
-                    "Unexpected error reading %s (address %d)", 
-                    reg.name, reg.address + 40001
+        if groups is None:
+            groups = self.config.scan_groups
+
+        start = time.perf_counter()
+        blocks = [block for group in groups for block in group.read_plan]
+        responses = [None] * len(blocks)
+        for index, block in enumerate(blocks):
+            # Commands take the connection ahead of the next block read
+            if self._commands:
+                self._execute_commands()
+            if self._pipelined and index % self._modbus_client.window == 0:
+                # Send the next window of reads back to back, commands still wait for one window at most
+                chunk = blocks[index:index + self._modbus_client.window]
+                responses[index:index + len(chunk)] = self._modbus_client.read_blocks(
+                    [(part.function_code, part.address, part.count) for part in chunk],
+                    self.config.modbus.unit_id
                 )
-                results["data"][reg.name] = {
-                    "value": "error",
-                    "unit": reg.unit,
-                    "address": reg.address + 40001,
-                    "error": str(e)
-                }
+            if not self._read_block(block, results["data"], responses[index], groups):
+                self._mark_unavailable([reg for rest in blocks[index + 1:] for reg in rest.registers],
+                                       results["data"])
+                self._breaker.record_failure()
+                break
+        else:
+            self._breaker.record_success()
+        elapsed = time.perf_counter() - start
+        self._metrics.device_read_seconds.labels(self._device_name).observe(elapsed)
+        self._metrics.observe_phase('read', elapsed)
 
         return results
 
-    def _save_to_json(self, data: Dict[str, Any]) -> bool:
-        """Save data to JSON file"""
+    def _publish_schema(self, encoder: CompactEncoder) -> None:
+        """Publish the retained schema that compact data messages refer to"""
+        topic = f"{self.config.mqtt.topic}/schema/{encoder.schema_id:08x}"
+        self._publisher.submit(OutgoingMessage(
+            topic,
+            encoder.schema_message(),
+            qos=self.config.mqtt.qos,
+            retain=True
+        ))
+        logger.info("Compact payload schema %08x queued for %s", encoder.schema_id, topic)
+
+    def _publish_data(self, data: Dict, topic: Optional[str] = None,
+                      on_delivered: Optional[Callable[[], None]] = None,
+                      encoder: Optional[CompactEncoder] = None) -> bool:
+        """Hand data to the publish queue without waiting for the broker"""
         try:
-            with open(self.config.json_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            logger.debug("Data saved to %s", self.config.json_file)
-            return True
+            encoder = encoder or self._encoder
+            start = time.perf_counter()
+            payload = encoder.encode(data) if encoder else json.dumps(data)
+            self._metrics.observe_phase('serialize', time.perf_counter() - start)
+            return self._submit_payload(payload, topic, on_delivered)
         except Exception as e:
-            logger.error("Failed to save data to JSON file: %s", e)
+            logger.error("MQTT publish failed: %s", e)
             return False
 
-    def _publish_data(self, data: Dict) -> bool:
-        """Publish data to MQTT with QoS handling"""
-        if not self._mqtt_client.is_connected():
-            logger.warning("MQTT client not connected, cannot publish")
-            return False
-            
+    def _publish_batch(self, samples: List[Dict[str, Any]], batcher: SampleBatcher,
+                       topic: Optional[str] = None, encoder: Optional[CompactEncoder] = None) -> bool:
+        """Publish several samples as one columnar message"""
+        if not samples:
+            return True
         try:
-            payload = json.dumps(data)
-            result = self._mqtt_client.publish(
-                self.config.mqtt.topic,
-                payload=payload,
-                qos=self.config.mqtt.qos,
-                retain=self.config.mqtt.retain
-            )
-            
-            # Wait for publish to complete with a reasonable timeout
-            if not result.is_published():
-                result.wait_for_publish(timeout=5)
-                
-            if result.rc == 0:
-                logger.debug("Data published to MQTT topic %s", self.config.mqtt.topic)
-                return True
-            else:
-                logger.warning("MQTT publish failed (rc=%d)", result.rc)
-                return False
+            encoder = encoder or self._encoder
+            start = time.perf_counter()
+            payload = encoder.encode_batch(samples) if encoder else encode_json_batch(samples)
+            self._metrics.observe_phase('serialize', time.perf_counter() - start)
+            batcher.record_size(len(samples), len(payload))
+            return self._submit_payload(payload, topic)
         except Exception as e:
-            logger.error("MQTT publish failed: %s", e)
+            logger.error("MQTT publish of a %d sample batch failed: %s", len(samples), e)
             return False
 
-    def _clear_json_file(self) -> None:
-        """Clear JSON file after successful MQTT publishing"""
+    def _publish_sample(self, data: Dict[str, Any], batcher: Optional[SampleBatcher] = None,
+                        topic: Optional[str] = None, encoder: Optional[CompactEncoder] = None) -> bool:
+        """Publish a sample directly or through the batching stage"""
+        if batcher is None:
+            return self._publish_data(data, topic, encoder=encoder)
+        batch = batcher.add(data)
+        if batch:
+            self._publish_batch(batch, batcher, topic, encoder)
+        return True
+
+    def _publish_aggregates(self, aggregator: WindowAggregator, topic: Optional[str] = None,
+                            final: bool = False) -> None:
+        """Publish the statistics of the aggregation windows that closed, as JSON on <topic>/aggregate"""
+        topic = f"{topic or self.config.mqtt.topic}/aggregate"
+        for message in aggregator.take(time.time(), final):
+            self._submit_payload(json.dumps(message), topic)
+
+    def _submit_payload(self, payload: Union[str, bytes], topic: Optional[str] = None,
+                        on_delivered: Optional[Callable[[], None]] = None) -> bool:
+        if not startup.sample_queued:
+            on_delivered = startup.track_first_sample(on_delivered)
+        topic = topic or self.config.mqtt.topic
+        accepted = self._publisher.submit(OutgoingMessage(
+            topic,
+            payload,
+            qos=self.config.mqtt.qos,
+            retain=self.config.mqtt.retain,
+            on_delivered=on_delivered
+        ))
+        if accepted:
+            logger.debug("Data queued for MQTT topic %s", topic)
+        return accepted
+
+    def _connect_mqtt(self) -> None:
+        """Initiate the MQTT connection and start the network loop"""
         try:
-            open(self.config.json_file, 'w').close()
-            logger.debug("Cleared JSON file contents")
+            logger.info("Attempting to connect to MQTT broker at %s:%d", 
+                    self.config.mqtt.broker, self.config.mqtt.port)
+            self._mqtt_client.connect(
+                self.config.mqtt.broker,
+                port=self.config.mqtt.port,
+                keepalive=60
+            )
+            self._mqtt_client.loop_start()
+            startup.mark('mqtt connect sent')
+            logger.info("MQTT connection initiated")
         except Exception as e:
-            logger.error("Failed to clear JSON file: %s", e)
+            logger.error("Initial MQTT connection failed: %s", e)
+        finally:
+            if not self._publisher.running:
+                self._publisher.start()
 
     def _check_connections(self) -> None:
-        """Check and restore connections if needed"""
+        """Check and restore the MQTT connection if needed.
+        
+        The Modbus connection is restored by the read cycle as the device's
+        circuit breaker allows.
+        """
         now = time.monotonic()
         
         # Only attempt reconnections at the specified interval
@@ -318,11 +1054,6 @@ class ModbusMQTTBridge:
             return
             
         self._last_reconnect_attempt = now
-        
-        # Check Modbus connection
-        if not self._modbus_client or not self._modbus_client.connected:
-            logger.info("Attempting to reconnect to Modbus...")
-            self._connect_modbus()
             
         # Check MQTT connection
         if not self._mqtt_client.is_connected():
@@ -343,71 +1074,206 @@ class ModbusMQTTBridge:
         self._last_health_check = now
         
         # Basic health check implementation
-        logger.info("Health check: Modbus connected: %s, MQTT connected: %s", 
+        logger.info("Health check: Modbus connected: %s (%s), MQTT connected: %s", 
                   bool(self._modbus_client and self._modbus_client.connected),
-                  self._mqtt_client.is_connected())
+                  self._breaker.state, self._mqtt_client.is_connected())
+        self._log_publisher_stats()
+
+    def _log_publisher_stats(self) -> None:
+        publisher = self._publisher
+        logger.info("Publisher: %d queued, %d in flight, %d published, %d delivered, %d dropped, %d stored",
+                    publisher.queue_depth, publisher.inflight, publisher.published,
+                    publisher.delivered, publisher.dropped, publisher.stored)
+        if self._store is not None:
+            logger.info("Store-and-forward log: %d undelivered records, %d bytes, %d dropped",
+                        self._store.pending, self._store.size, self._store.dropped)
+
+    def _request_reload(self, *args) -> None:
+        """SIGHUP handler: reload the config file at the next opportunity"""
+        self._reload_requested = True
+        self._wakeup.set()
+
+    def _reload_due(self) -> bool:
+        """Whether a reload was requested or the watched config file changed"""
+        if self._reload_requested:
+            self._reload_requested = False
+            return True
+        return self._watcher is not None and self._watcher.changed()
+
+    def _keep_restart_settings(self, config: AppConfig) -> None:
+        """Carry over the running values of settings that only take effect after a restart"""
+        if bool(config.devices) != bool(self.config.devices):
+            raise ValueError("switching between single device and fleet mode needs a restart")
+        for name in RESTART_SETTINGS:
+            if getattr(config, name) != getattr(self.config, name):
+                logger.warning("Config reload: changes of %s take effect after a restart", name)
+                setattr(config, name, getattr(self.config, name))
+
+    def _read_new_config(self) -> Optional[AppConfig]:
+        """Parse and compile the config file again, None if it is invalid"""
+        if not self.config_file:
+            logger.warning("Config reload requested, but no config file was given")
+            return None
+        logger.info("Reloading config from %s", self.config_file)
+        try:
+            config = read_config(self.config_file, previous=self.config)
+            self._keep_restart_settings(config)
+        except Exception as e:
+            logger.error("Rejected the new config, keeping the running one: %s", e)
+            self._metrics.config_reloads.labels('rejected').inc()
+            return None
+        return config
+
+    def _switch_config(self, config: AppConfig) -> bool:
+        """Apply a new config, or keep the running one if it cannot be applied"""
+        try:
+            self._apply_config(config)
+        except Exception as e:
+            logger.exception("Rejected the new config, keeping the running one: %s", e)
+            self._metrics.config_reloads.labels('rejected').inc()
+            return False
+        if self._watcher:
+            self._watcher.interval = config.config_watch_interval
+        self._metrics.config_reloads.labels('applied').inc()
+        return True
+
+    def _reload_config(self) -> bool:
+        config = self._read_new_config()
+        return config is not None and self._switch_config(config)
+
+    def _apply_config(self, config: AppConfig) -> None:
+        """Switch to a reloaded config, keeping the connection and state of what did not change.
+        
+        Everything that can fail is built before the first change, so a
+        config is either applied completely or not at all.
+        """
+        old = self.config
+        registers_changed = config.registers is not old.registers
+        reconnect = _connection_settings(config.modbus) != _connection_settings(old.modbus)
+        
+        encoder = CompactEncoder(config.registers) if self._encoder and registers_changed else self._encoder
+        reporter = self._reporter
+        if registers_changed or config.heartbeat_interval != old.heartbeat_interval:
+            reporter = ExceptionReporter(config.registers, config.heartbeat_interval)
+        aggregator = self._aggregator
+        if registers_changed or ((config.aggregate_window, config.aggregate_time_weighted)
+                                 != (old.aggregate_window, old.aggregate_time_weighted)):
+            aggregator = WindowAggregator(config.registers, config.aggregate_window,
+                                          config.aggregate_time_weighted)
+        device_name = f"{config.modbus.host}-{config.modbus.port}-{config.modbus.unit_id}"
+        
+        # Samples of the old registers are published in the old layout
+        if encoder is not self._encoder:
+            if self._batcher:
+                self._publish_batch(self._batcher.take(), self._batcher)
+            self._batcher = self._create_batcher(encoder)
+            self._encoder = encoder
+            self._publish_schema(encoder)
+        if aggregator is not self._aggregator:
+            if self._aggregator:
+                self._publish_aggregates(self._aggregator, final=True)
+            self._aggregator = aggregator
+        self._reporter = reporter
+        
+        self.config = config
+        if reconnect:
+            if self._modbus_client:
+                self._modbus_client.close()
+                self._modbus_client = None
+            self._device_name = device_name
+            self._breaker = self._create_breaker(config.modbus, device_name)
+        self._writable = self._writable_registers(config)
+        logger.info("Config reloaded: %d registers%s%s", len(config.registers),
+                    ", new read plan" if registers_changed else "", ", reconnecting" if reconnect else "")
 
     def run(self):
         """Main execution loop"""
         self._running = True
+        self._stop_event.clear()
         self._loop_count = 0
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
-
-        # Initial connections
-        modbus_connected = self._connect_modbus()
-        if not modbus_connected:
-            logger.warning("Initial Modbus connection failed, will retry in loop")
+        signal.signal(signal.SIGHUP, self._request_reload)
+        self._start_metrics_server()
 
         try:
-            # Connect to MQTT broker
-            try:
-                logger.info("Attempting to connect to MQTT broker at %s:%d", 
-                        self.config.mqtt.broker, self.config.mqtt.port)
-                self._mqtt_client.connect(
-                    self.config.mqtt.broker,
-                    port=self.config.mqtt.port,
-                    keepalive=60
-                )
-                self._mqtt_client.loop_start()
-                logger.info("MQTT connection initiated")
-            except Exception as e:
-                logger.error("Initial MQTT connection failed: %s", e)
+            # Connect to the MQTT broker first, its handshake completes while Modbus connects
+            self._connect_mqtt()
+            if self._encoder:
+                self._publish_schema(self._encoder)
+            
+            if self._connect_modbus():
+                startup.mark('modbus connected')
+            else:
+                logger.warning("Initial Modbus connection failed, will retry in loop")
 
+            scheduler = PollScheduler(self.config.scan_groups,
+                                      observer=self._scan_observer(self._device_name))
+            
             while self._running:
-                start_time = time.monotonic()
-                self._loop_count += 1
+                self._wakeup.clear()
+                self._execute_commands()
                 
-                logger.info("Starting loop %d", self._loop_count)
+                # A reload restarts the schedule only if the read plan changed
+                if self._reload_due():
+                    scan_groups = self.config.scan_groups
+                    if self._reload_config() and self.config.scan_groups is not scan_groups:
+                        scheduler = PollScheduler(self.config.scan_groups,
+                                                  observer=self._scan_observer(self._device_name))
                 
-                # Check connections
-                self._check_connections()
+                due = scheduler.pop_due()
                 
-                # Periodic health check
-                self._perform_health_check()
-                
-                # Read registers and process data
-                data = self._read_registers()
-                
-                # Save to JSON
-                json_saved = self._save_to_json(data)
-                
-                # Publish to MQTT if JSON was saved successfully
-                if json_saved:
-                    mqtt_published = self._publish_data(data)
+                if due:
+                    start_time = time.monotonic()
+                    self._loop_count += 1
+                    
+                    logger.debug("Starting loop %d (%s)", self._loop_count,
+                                ", ".join(group.name for group in due))
+                    
+                    # Check connections
+                    self._check_connections()
+                    
+                    # Periodic health check
+                    self._perform_health_check()
+                    
+                    # Read the registers of every group that fell due in this cycle
+                    data = self._read_registers(due)
+                    if self._loop_count == 1:
+                        startup.mark('first read')
                     
-                    # Clear JSON file after successful MQTT publish
-                    if mqtt_published:
-                        self._clear_json_file()
+                    # Registers published as window statistics leave the raw sample
+                    if self._aggregator:
+                        data["data"] = self._aggregator.add(data["data"], data["timestamp"])
+                    
+                    # Drop points that did not change beyond their deadband
+                    if self.config.report_by_exception:
+                        data["data"] = self._reporter.changes(data["data"])
+                    
+                    # Hand the sample to the store-and-forward publisher
+                    if data["data"] or not (self.config.report_by_exception or self._aggregator):
+                        if self._publish_sample(data, self._batcher):
+                            self._reporter.mark_published(data["data"])
+                    
+                    logger.debug("Loop %d done in %.3f seconds", self._loop_count,
+                                time.monotonic() - start_time)
                 
-                logger.info("Loop %d done", self._loop_count)
+                # Publish a partial batch once its oldest sample reached the latency limit
+                if self._batcher and self._batcher.due():
+                    self._publish_batch(self._batcher.take(), self._batcher)
+                if self._aggregator:
+                    self._publish_aggregates(self._aggregator)
                 
-                # Maintain consistent loop timing
-                elapsed = time.monotonic() - start_time
-                if elapsed < self.config.loop_interval:
-                    time.sleep(self.config.loop_interval - elapsed)
-                else:
-                    logger.warning("Loop iteration overrun by %.2f seconds", elapsed - self.config.loop_interval)
+                # Sleep only until the next scan group, batch or aggregation window falls due
+                next_deadline = scheduler.next_deadline()
+                if next_deadline is None:
+                    next_deadline = time.monotonic() + self.config.loop_interval
+                if self._batcher and self._batcher.deadline is not None:
+                    next_deadline = min(next_deadline, self._batcher.deadline)
+                if self._aggregator and self._aggregator.deadline is not None:
+                    next_deadline = min(next_deadline, time.monotonic() + self._aggregator.deadline - time.time())
+                delay = next_deadline - time.monotonic()
+                if delay > 0:
+                    self._wakeup.wait(delay)
 
         except Exception as e:
             logger.exception("Unexpected error in main loop: %s", e)
@@ -418,6 +1284,8 @@ class ModbusMQTTBridge:
         """Handle system signals for graceful shutdown"""
         logger.info("Received signal %d, shutting down...", signum)
         self._running = False
+        self._stop_event.set()
+        self._wakeup.set()
 
     def shutdown(self):
         """Cleanup resources"""
@@ -431,6 +1299,13 @@ class ModbusMQTTBridge:
             except Exception as e:
                 logger.error("Error closing Modbus connection: %s", e)
 
+        # Flush the pending batch, open windows and queued messages before closing MQTT connection
+        if self._batcher:
+            self._publish_batch(self._batcher.take(), self._batcher)
+        if self._aggregator:
+            self._publish_aggregates(self._aggregator, final=True)
+        self._publisher.stop()
+        
         # Close MQTT connection
         try:
             self._mqtt_client.loop_stop()
@@ -438,36 +1313,144 @@ class ModbusMQTTBridge:
             logger.info("MQTT connection closed")
         except Exception as e:
             logger.error("Error closing MQTT connection: %s", e)
+            
+        if self._metrics_server:
+            self._metrics_server.stop()
+
+# Part of the config cache key, bump when the layout of cache entries changes
+CONFIG_CACHE_VERSION = 1
+
+def config_cache_dir() -> str:
+    """Directory of the parsed config cache, in the cache directory of the user running the bridge"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'modbus_mqtt_bridge')
+
+def _owned_privately(info: os.stat_result) -> bool:
+    """Whether only the user running the bridge can have written a cache file or directory"""
+    return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def _load_cached_config(path: str, key: str) -> Optional[Dict[str, Any]]:
+    """The parsed config stored under ``key``, None on a miss or a cache entry not to be trusted"""
+    try:
+        directory = os.lstat(os.path.dirname(path))
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    with os.fdopen(fd, 'rb') as f:
+        info = os.fstat(fd)
+        if not (stat.S_ISDIR(directory.st_mode) and _owned_privately(directory)
+                and stat.S_ISREG(info.st_mode) and _owned_privately(info)):
+            logger.warning("Ignoring config cache %s, it is writable by other users", path)
+            return None
+        try:
+            entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable config cache %s: %s", path, e)
+            return None
+    if isinstance(entry, dict) and entry.get('key') == key and isinstance(entry.get('config'), dict):
+        return entry['config']
+    return None
+
+def _store_cached_config(path: str, key: str, config_data: Dict[str, Any]) -> None:
+    """Cache a parsed config as JSON, unless JSON cannot hold it exactly"""
+    try:
+        payload = json.dumps({'key': key, 'config': config_data})
+        # e.g. YAML dates or numbers as mapping keys
+        if json.loads(payload)['config'] != config_data:
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not _owned_privately(os.lstat(directory)):
+            logger.warning("Not caching the config in %s, it is writable by other users", directory)
+            return
+        temp = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(payload)
+        os.replace(temp, path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning("Could not cache the config in %s: %s", path, e)
+
+def _parse_config(config_file: str, source: bytes, cache_dir: Optional[str] = None) -> Any:
+    """Parse a YAML or JSON config file, taking parsed YAML from the cache in ``cache_dir`` if given.
+    
+    Parsing YAML takes tens of milliseconds and importing PyYAML as long
+    again, the cached JSON copy loads in well under one. Entries are keyed
+    by a hash of the file's contents, so an edited file is parsed again.
+    """
+    if not config_file.endswith(('.yaml', '.yml')):
+        return json.loads(source)
+    # Without user ids there is no telling who wrote a cache entry
+    cached = cache_dir is not None and hasattr(os, 'getuid')
+    if cached:
+        key = hashlib.sha256(b'%d\0' % CONFIG_CACHE_VERSION + source).hexdigest()
+        path = os.path.join(cache_dir, hashlib.sha256(os.path.abspath(config_file).encode()).hexdigest() + '.json')
+        config_data = _load_cached_config(path, key)
+        if config_data is not None:
+            logger.debug("Loaded the parsed config from %s", path)
+            return config_data
+    import yaml
+    config_data = yaml.safe_load(source)
+    if cached and isinstance(config_data, dict):
+        _store_cached_config(path, key, config_data)
+    return config_data
+
+def read_config(config_file: str, previous: Optional[AppConfig] = None,
+                cache_dir: Optional[str] = None) -> AppConfig:
+    """Parse and compile a config file, raising on any error.
+    
+    With ``previous``, the running config, unchanged registers keep their
+    decoders and compiled read plans instead of being compiled again. With
+    ``cache_dir``, parsed YAML is cached there, see ``_parse_config``.
+    """
+    with open(config_file, 'rb') as f:
+        source = f.read()
+    config_data = _parse_config(config_file, source, cache_dir)
+    if not isinstance(config_data, dict):
+        raise ValueError(f"{config_file} does not hold a configuration mapping")
+            
+    # Create config objects from loaded data
+    modbus_data = config_data.get('modbus', {})
+    if config_data.get('devices'):
+        # In fleet mode the modbus section only holds defaults for the devices
+        modbus_data = {'host': '', **modbus_data}
+    modbus_config = ModbusConfig(**modbus_data)
+    mqtt_config = MQTTConfig(**config_data.get('mqtt', {}))
+    
+    # Convert register dictionaries to RegisterDefinition objects
+    registers = []
+    for reg_data in config_data.get('registers', []):
+        registers.append(RegisterDefinition(**reg_data))
+        
+    # Devices inherit connection defaults from the modbus section
+    devices = []
+    for device_data in config_data.get('devices', []):
+        device_data = {**modbus_data, **device_data}
+        if device_data.get('registers') is not None:
+            device_data['registers'] = [RegisterDefinition(**reg_data)
+                                        for reg_data in device_data['registers']]
+        devices.append(DeviceConfig(**device_data))
+        
+    # Create main config
+    main_config = {k: v for k, v in config_data.items() 
+                  if k not in ('modbus', 'mqtt', 'registers', 'devices')}
+    if main_config.pop('json_file', None):
+        logger.warning("json_file is no longer used, samples are buffered in buffer_dir")
+    
+    return AppConfig(
+        modbus=modbus_config,
+        mqtt=mqtt_config,
+        registers=registers,
+        devices=devices,
+        previous=previous,
+        **main_config
+    )
 
 def load_config(config_file=None):
     """Load configuration from file or use defaults"""
     if config_file and os.path.exists(config_file):
         try:
-            with open(config_file, 'r') as f:
-                if config_file.endswith('.yaml') or config_file.endswith('.yml'):
-                    config_data = yaml.safe_load(f)
-                else:
-                    config_data = json.load(f)
-                    
-            # Create config objects from loaded data
-            modbus_config = ModbusConfig(**config_data.get('modbus', {}))
-            mqtt_config = MQTTConfig(**config_data.get('mqtt', {}))
-            
-            # Convert register dictionaries to RegisterDefinition objects
-            registers = []
-            for reg_data in config_data.get('registers', []):
-                registers.append(RegisterDefinition(**reg_data))
-                
-            # Create main config
-            main_config = {k: v for k, v in config_data.items() 
-                          if k not in ('modbus', 'mqtt', 'registers')}
-            
-            return AppConfig(
-                modbus=modbus_config,
-                mqtt=mqtt_config,
-                registers=registers,
-                **main_config
-            )
+            return read_config(config_file, cache_dir=config_cache_dir())
         except Exception as e:
             logger.error("Error loading config from %s: %s", config_file, e)
             
@@ -488,15 +1471,33 @@ def load_config(config_file=None):
         ]
     )
 
+startup.mark('define bridge classes')
+
 if __name__ == "__main__":
-    # Check for config file argument
-    config_file = None
-    if len(sys.argv) > 1:
-        config_file = sys.argv[1]
+    # Usage: modbus_mqtt_bridge.py [--startup-profile] [config_file]
+    args = sys.argv[1:]
+    if '--startup-profile' in args:
+        args.remove('--startup-profile')
+        startup.enabled = True
+    config_file = args[0] if args else None
+    configure_logging()
         
     # Load configuration
     config = load_config(config_file)
+    startup.mark('load config')
+    configure_logging(config)
     
-    # Create and run the bridge
-    bridge = ModbusMQTTBridge(config)
-    bridge.run()
\ No newline at end of file
+    # Create and run the bridge, polling a whole fleet if devices are configured
+    if config.devices and config.workers > 1:
+        bridge = _import_on_first_use('supervisor', 'import supervisor').SupervisorBridge(config, config_file)
+    elif config.devices:
+        # The fleet poller's clients need pymodbus up front
+        bridge = _import_on_first_use('fleet', 'import fleet and pymodbus').FleetBridge(config, config_file)
+    else:
+        bridge = ModbusMQTTBridge(config, config_file)
+    startup.mark('create bridge')
+    try:
+        bridge.run()
+    finally:
+        # Without a delivered sample the profile ends with the run
+        startup.finish()
@@ -0,0 +1,364 @@
+import asyncio
+import logging
+import socket
+import struct
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+logger = logging.getLogger(__name__)
+
+# MBAP header: transaction id, protocol id, length of unit id and PDU, unit id
+MBAP_HEADER = struct.Struct('>HHHB')
+MAX_PDU_SIZE = 253
+READ_REQUEST = struct.Struct('>BHH')
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+GATEWAY_PATH_UNAVAILABLE = 0x0A  # a gateway has no path to the unit
+GATEWAY_TARGET_FAILED = 0x0B  # the unit behind a gateway did not answer
+
+# Read Device Identification (function 43 / MEI type 14)
+READ_DEVICE_ID = 0x2B
+MEI_DEVICE_ID = 0x0E
+
+# A read request: function code, 0-based address, register count
+ReadRequest = Tuple[int, int, int]
+
+def write_request(address: int, words: Sequence[int]) -> bytes:
+    """PDU writing ``words`` from a 0-based holding register address.
+
+    A single word uses Write Single Register (6), more words Write Multiple
+    Registers (16).
+    """
+    if len(words) == 1:
+        return struct.pack('>BHH', WRITE_SINGLE_REGISTER, address, words[0])
+    return struct.pack(f'>BHHB{len(words)}H', WRITE_MULTIPLE_REGISTERS, address, len(words),
+                       2 * len(words), *words)
+
+def parse_header(header: bytes) -> Tuple[int, int, int]:
+    """Transaction id, PDU length and unit id of a response's MBAP header.
+
+    Raises ConnectionException when the protocol id is not Modbus or the
+    length cannot hold a PDU: the stream cannot be resynchronized after that.
+    """
+    transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack_from(header)
+    if protocol_id != 0 or not 2 <= length <= MAX_PDU_SIZE + 1:
+        raise ConnectionException(f"Malformed Modbus TCP header (protocol id {protocol_id}, length {length})")
+    return transaction_id, length - 1, unit_id
+
+def check_unit(unit_id: int, expected: int) -> None:
+    if unit_id != expected:
+        raise ConnectionException(f"Response from unit {unit_id} to a request for unit {expected}")
+
+class RegisterResponse:
+    """Answer to one request, duck-typed like a pymodbus response"""
+
+    __slots__ = ('function_code', 'registers', 'exception_code')
+
+    def __init__(self, function_code: int, registers: List[int], exception_code: int = 0):
+        self.function_code = function_code
+        self.registers = registers
+        self.exception_code = exception_code
+
+    def isError(self) -> bool:
+        return bool(self.exception_code)
+
+    def __str__(self) -> str:
+        if self.exception_code:
+            return f"Exception Response({self.function_code | 0x80}, {self.function_code}, {self.exception_code})"
+        return f"RegisterResponse({self.function_code}, {len(self.registers)} registers)"
+
+def parse_response(pdu: bytes) -> RegisterResponse:
+    function_code = pdu[0]
+    if function_code & 0x80:
+        return RegisterResponse(function_code & 0x7F, [], pdu[1] if len(pdu) > 1 else 0)
+    if function_code not in (3, 4):
+        # Write responses echo the request and carry no register values
+        return RegisterResponse(function_code, [])
+    byte_count = pdu[1] if len(pdu) > 1 else 0
+    data = pdu[2:2 + byte_count]
+    return RegisterResponse(function_code, list(struct.unpack(f'>{len(data) // 2}H', data[:len(data) & ~1])))
+
+class _TransactionIds:
+    def __init__(self):
+        self._last = 0
+
+    def next(self) -> int:
+        self._last = self._last % 0xFFFF + 1
+        return self._last
+
+class PipelinedModbusClient:
+    """Blocking Modbus TCP client keeping up to ``window`` reads outstanding.
+
+    ``read_blocks`` writes requests back to back and matches the responses
+    by transaction id as they arrive, refilling the window as each one is
+    answered, so a cycle of many block reads costs about one round trip
+    instead of one per block. Only use it with devices and gateways that
+    accept several outstanding transactions per connection.
+
+    A read that is not answered within ``timeout`` of being sent fails the
+    reads still outstanding too, and the connection is closed so that late
+    answers cannot be mistaken for those of the next cycle. So does a
+    malformed response frame or one from another unit id.
+    """
+
+    def __init__(self, host: str, port: int = 502, timeout: float = 3.0, window: int = 8):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.window = max(1, window)
+        self._sock: Optional[socket.socket] = None
+        self._buffer = bytearray()
+        self._ids = _TransactionIds()
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self) -> bool:
+        self.close()
+        try:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            logger.debug("Connection to %s:%d failed: %s", self.host, self.port, e)
+            self._sock = None
+        return self._sock is not None
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._buffer.clear()
+
+    def _receive(self, deadline: float) -> Tuple[int, int, bytes]:
+        """Next response frame as transaction id, unit id and PDU"""
+        buffer = self._buffer
+        while True:
+            if len(buffer) >= MBAP_HEADER.size:
+                transaction_id, length, unit_id = parse_header(buffer)
+                end = MBAP_HEADER.size + length
+                if len(buffer) >= end:
+                    pdu = bytes(buffer[MBAP_HEADER.size:end])
+                    del buffer[:end]
+                    return transaction_id, unit_id, pdu
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout()
+            self._sock.settimeout(remaining)
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionError("Connection closed by the device")
+            buffer += data
+
+    def read_blocks(self, requests: Sequence[ReadRequest],
+                    unit_id: int) -> List[Union[RegisterResponse, Exception]]:
+        """Responses to the read requests in order, or the exception that failed each one"""
+        return self._exchange([READ_REQUEST.pack(*request) for request in requests], unit_id)
+
+    def write(self, address: int, words: Sequence[int], unit_id: int) -> RegisterResponse:
+        """Write holding registers, raising on timeout or connection loss"""
+        response = self._exchange([write_request(address, words)], unit_id)[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def _exchange(self, requests: Sequence[bytes],
+                  unit_id: int) -> List[Union[RegisterResponse, Exception]]:
+        """Responses to the request PDUs in order, or the exception that failed each one"""
+        results: List[Union[RegisterResponse, Exception, None]] = [None] * len(requests)
+        if self._sock is None:
+            return [ConnectionException(f"Not connected to {self.host}:{self.port}")] * len(requests)
+
+        pending: Dict[int, Tuple[int, float]] = {}  # transaction id -> (request index, deadline)
+        next_index = 0
+        error: Optional[Exception] = None
+        try:
+            while next_index < len(requests) or pending:
+                frames = bytearray()
+                now = time.monotonic()
+                while next_index < len(requests) and len(pending) < self.window:
+                    transaction_id = self._ids.next()
+                    frames += MBAP_HEADER.pack(transaction_id, 0, len(requests[next_index]) + 1, unit_id)
+                    frames += requests[next_index]
+                    pending[transaction_id] = (next_index, now + self.timeout)
+                    next_index += 1
+                if frames:
+                    self._sock.sendall(frames)
+
+                # Requests were sent in order, so the first pending one expires first
+                transaction_id, response_unit, pdu = self._receive(next(iter(pending.values()))[1])
+                entry = pending.pop(transaction_id, None)
+                if entry is None:
+                    logger.debug("Discarding response with unknown transaction id %d", transaction_id)
+                    continue
+                check_unit(response_unit, unit_id)
+                results[entry[0]] = parse_response(pdu)
+        except socket.timeout:
+            error = ModbusIOException(f"No response from {self.host}:{self.port} within {self.timeout}s")
+        except OSError as e:
+            error = ConnectionException(f"Connection to {self.host}:{self.port} failed: {e}")
+        except ConnectionException as e:
+            error = e
+
+        if error is not None:
+            self.close()
+            results = [error if result is None else result for result in results]
+        return results
+
+class _Slots:
+    """Semaphore over the in-flight window that hands free slots to urgent waiters first"""
+
+    def __init__(self, count: int):
+        self._free = count
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._urgent: Deque[asyncio.Future] = deque()
+
+    async def acquire(self, urgent: bool = False) -> None:
+        if self._free and not self._waiters and not self._urgent:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        (self._urgent if urgent else self._waiters).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was handed over just before the cancellation
+            raise
+
+    def release(self) -> None:
+        for waiters in (self._urgent, self._waiters):
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self._free += 1
+
+class AsyncPipelinedModbusClient:
+    """asyncio counterpart of ``PipelinedModbusClient`` for fleet mode.
+
+    A reader task resolves the future of each outstanding transaction id;
+    a semaphore keeps at most ``window`` requests in flight. With
+    ``close_on_timeout`` off, a timed out read leaves the connection open
+    for the other requests; its late answer is discarded as its transaction
+    id is no longer pending. A malformed response frame or one from another
+    unit id than the request's closes the connection. Writes take the next
+    free slot ahead of the reads waiting for one.
+    """
+
+    def __init__(self, host: str, port: int = 502, timeout: float = 3.0, window: int = 8,
+                 close_on_timeout: bool = True):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.window = max(1, window)
+        self.close_on_timeout = close_on_timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, Tuple[asyncio.Future, int]] = {}  # transaction id -> (future, unit id)
+        self._slots: Optional[_Slots] = None
+        self._ids = _TransactionIds()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> bool:
+        self.close()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug("Connection to %s:%d failed: %s", self.host, self.port, e)
+            return False
+        self._slots = _Slots(self.window)
+        self._reader_task = asyncio.create_task(self._read_responses(self._reader))
+        return True
+
+    def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(ConnectionException(f"Connection to {self.host}:{self.port} closed"))
+
+    def _fail_pending(self, error: Exception) -> None:
+        pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, length, unit_id = parse_header(header)
+                pdu = await reader.readexactly(length)
+                entry = self._pending.get(transaction_id)
+                if entry is None:
+                    # The late answer to a read that timed out
+                    continue
+                future, expected_unit = entry
+                check_unit(unit_id, expected_unit)
+                del self._pending[transaction_id]
+                if not future.done():
+                    future.set_result(parse_response(pdu))
+        except (asyncio.IncompleteReadError, OSError, ConnectionException) as e:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if not isinstance(e, ConnectionException):
+                e = ConnectionException(f"Connection to {self.host}:{self.port} failed: {e}")
+            self._fail_pending(e)
+
+    async def read(self, request: ReadRequest, unit_id: int) -> RegisterResponse:
+        """Send one read and wait for its response, raising on timeout or connection loss"""
+        return await self.execute(READ_REQUEST.pack(*request), unit_id)
+
+    async def write(self, address: int, words: Sequence[int], unit_id: int) -> RegisterResponse:
+        """Write holding registers, raising on timeout or connection loss"""
+        return await self.execute(write_request(address, words), unit_id, urgent=True)
+
+    async def execute(self, pdu: bytes, unit_id: int, urgent: bool = False) -> RegisterResponse:
+        """Send one request PDU and wait for its response"""
+        if self._slots is None:
+            raise ConnectionException(f"Not connected to {self.host}:{self.port}")
+        slots = self._slots
+        await slots.acquire(urgent)
+        try:
+            if not self.connected:
+                raise ConnectionException(f"Not connected to {self.host}:{self.port}")
+            transaction_id = self._ids.next()
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction_id] = (future, unit_id)
+            self._writer.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self._pending.pop(transaction_id, None)
+                if self.close_on_timeout:
+                    # Late answers must not be taken for the next cycle's
+                    self.close()
+                raise ModbusIOException(f"No response from {self.host}:{self.port} within {self.timeout}s")
+        finally:
+            slots.release()
+
+    async def read_blocks(self, requests: Sequence[ReadRequest],
+                          unit_id: int) -> List[Union[RegisterResponse, Exception]]:
+        """Responses to the read requests in order, or the exception that failed each one"""
+        if not self.connected:
+            return [ConnectionException(f"Not connected to {self.host}:{self.port}")] * len(requests)
+        return await asyncio.gather(*(self.read(request, unit_id) for request in requests),
+                                    return_exceptions=True)
@@ -0,0 +1,266 @@
+import logging
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, Union
+
+from store_forward import SegmentedLog
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ('drop_oldest', 'block', 'spill')
+
+# Store-and-forward record header: qos, retain flag and topic length
+MESSAGE_HEADER = struct.Struct('>BBH')
+
+@dataclass
+class OutgoingMessage:
+    topic: str
+    payload: Union[str, bytes]
+    qos: int = 1
+    retain: bool = False
+    on_delivered: Optional[Callable[[], None]] = None  # called once the broker acknowledged
+    seq: Optional[int] = None  # sequence number in the store-and-forward log
+
+    def encode(self) -> bytes:
+        """Serialize the message as a store-and-forward record"""
+        topic = self.topic.encode('utf-8')
+        payload = self.payload.encode('utf-8') if isinstance(self.payload, str) else self.payload
+        return MESSAGE_HEADER.pack(self.qos, int(self.retain), len(topic)) + topic + payload
+
+    @classmethod
+    def decode(cls, record: bytes, seq: Optional[int] = None) -> 'OutgoingMessage':
+        qos, retain, topic_length = MESSAGE_HEADER.unpack_from(record)
+        start = MESSAGE_HEADER.size
+        topic = record[start:start + topic_length].decode('utf-8')
+        return cls(topic, record[start + topic_length:], qos, bool(retain), seq=seq)
+
+class MqttPublisher:
+    """Publishes messages from a bounded queue on a dedicated thread.
+
+    Acquisition hands messages over with ``submit`` and never waits for the
+    broker. The publisher thread keeps at most ``max_inflight`` QoS 1/2
+    messages unacknowledged and only publishes while the client is connected.
+    When the queue is full the backpressure policy decides what happens:
+
+    - ``drop_oldest``: discard the oldest queued message
+    - ``block``: wait up to ``block_timeout`` seconds for room, then drop the new message
+    - ``spill``: store-and-forward, every message is appended to the on-disk
+      ``store`` first and published from there, acknowledged records are
+      removed and the backlog is replayed after reconnects and restarts
+
+    ``observe`` is called with a phase name (``persist`` or ``publish``) and
+    its duration in seconds, for metrics.
+    """
+
+    def __init__(self, client, queue_size: int = 1000, max_inflight: int = 20,
+                 backpressure: str = 'spill', store: Optional[SegmentedLog] = None,
+                 block_timeout: float = 1.0,
+                 observe: Optional[Callable[[str, float], None]] = None):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{backpressure}'")
+        if backpressure == 'spill' and store is None:
+            raise ValueError("Backpressure policy 'spill' needs a store-and-forward log")
+
+        self._client = client
+        self.queue_size = queue_size
+        self.max_inflight = max(1, max_inflight)
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self._store = store if backpressure == 'spill' else None
+        self._observe = observe
+
+        self._queue: Deque[OutgoingMessage] = deque()
+        self._inflight: Dict[int, OutgoingMessage] = {}
+        self._early_acks = set()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.stored = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Messages waiting to be published, including the unread on-disk backlog"""
+        if self._store is not None:
+            return len(self._queue) + self._store.unread
+        return len(self._queue)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, drain_timeout: float = 5.0) -> None:
+        """Stop the publisher thread, giving queued messages a chance to go out"""
+        deadline = time.monotonic() + drain_timeout
+        with self._changed:
+            while (self.queue_depth or self._inflight) and self._client.is_connected():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            self._running = False
+            self._changed.notify_all()
+
+        if self._thread:
+            self._thread.join(timeout=1.0)
+
+        if self._store is not None:
+            # Undelivered records stay in the log and are replayed on the next run
+            self._store.close()
+        elif self._queue or self._inflight:
+            logger.warning("Publisher stopped with %d queued and %d in-flight messages",
+                           len(self._queue), len(self._inflight))
+
+    def submit(self, message: OutgoingMessage) -> bool:
+        """Queue a message for publishing without waiting for the broker"""
+        if self._store is not None:
+            return self._append_to_store(message)
+
+        with self._changed:
+            if len(self._queue) >= self.queue_size:
+                if self.backpressure == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                    logger.warning("Publish queue full, dropped oldest message")
+                elif self.backpressure == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.queue_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.dropped += 1
+                            logger.warning("Publish queue full for %.1f seconds, dropped message",
+                                           self.block_timeout)
+                            return False
+                        self._changed.wait(remaining)
+
+            self._queue.append(message)
+            self._changed.notify_all()
+            return True
+
+    def submit_urgent(self, message: OutgoingMessage) -> None:
+        """Queue a message ahead of all others, bypassing the queue limit and the store.
+
+        For short replies such as command acknowledgements, which must not
+        wait behind a backlog and are worthless once replayed after a restart.
+        """
+        with self._changed:
+            self._queue.appendleft(message)
+            self._changed.notify_all()
+
+    def _append_to_store(self, message: OutgoingMessage) -> bool:
+        start = time.perf_counter()
+        try:
+            seq = self._store.append(message.encode())
+        except Exception as e:
+            self.dropped += 1
+            logger.error("Failed to append message to store-and-forward log: %s", e)
+            return False
+        if self._observe:
+            self._observe('persist', time.perf_counter() - start)
+
+        with self._changed:
+            if message.on_delivered:
+                self._callbacks[seq] = message.on_delivered
+            self.stored += 1
+            self._changed.notify_all()
+        return True
+
+    def _load_from_store(self) -> None:
+        """Stage the next records of the on-disk log for publishing"""
+        for seq, record in self._store.read(self.max_inflight):
+            message = OutgoingMessage.decode(record, seq)
+            message.on_delivered = self._callbacks.pop(seq, None)
+            self._queue.append(message)
+
+    def _delivered(self, message: OutgoingMessage) -> None:
+        if message.seq is not None:
+            self._store.ack(message.seq)
+        if message.on_delivered:
+            message.on_delivered()
+
+    def on_publish(self, client, userdata, mid, *args) -> None:
+        """paho on_publish callback: the broker acknowledged message ``mid``"""
+        with self._changed:
+            message = self._inflight.pop(mid, None)
+            if message is None:
+                # The acknowledgement raced ahead of the publish() call returning
+                self._early_acks.add(mid)
+                return
+            self.delivered += 1
+            self._changed.notify_all()
+
+        self._delivered(message)
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                while self._running and not (
+                    self._client.is_connected()
+                    and len(self._inflight) < self.max_inflight
+                    and (self._queue or (self._store is not None and self._store.unread))
+                ):
+                    self._changed.wait(0.5)
+                    if self._store is not None:
+                        # Persist the ack cursor while idle or disconnected
+                        self._store.sync(force=False)
+                if not self._running:
+                    return
+
+                if not self._queue:
+                    self._load_from_store()
+                    continue
+                message = self._queue.popleft()
+                self._changed.notify_all()
+
+            # paho calls on_publish with its own locks held, so publishing while
+            # holding ours could deadlock against the network thread
+            start = time.perf_counter()
+            try:
+                result = self._client.publish(
+                    message.topic,
+                    payload=message.payload,
+                    qos=message.qos,
+                    retain=message.retain
+                )
+            except Exception as e:
+                logger.error("MQTT publish failed: %s", e)
+                result = None
+            failed = result is None or result.rc != 0
+
+            with self._changed:
+                if failed:
+                    if result is not None:
+                        logger.warning("MQTT publish failed (rc=%d), will retry", result.rc)
+                    self._queue.appendleft(message)
+                    self._changed.wait(1.0)
+                    continue
+
+                self.published += 1
+                if self._observe:
+                    self._observe('publish', time.perf_counter() - start)
+                if result.mid in self._early_acks:
+                    self._early_acks.discard(result.mid)
+                    self.delivered += 1
+                else:
+                    self._inflight[result.mid] = message
+                    message = None
+
+            if message is not None:
+                self._delivered(message)
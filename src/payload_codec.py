@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Compact binary payload encoding for the Modbus MQTT bridge.
+
+The bridge publishes a schema (register names, units, types and order) once,
+retained, on ``<topic>/schema/<schema id>``. Data messages then only carry the
+schema id, a timestamp, a presence bitmap and the packed value vector:
+
+    header   '>BBId'  magic, version, schema id, timestamp
+    bitmap   one bit per field, set when the field holds a valid value
+    values   all fields packed with a single precompiled struct format
+
+Batches of samples use the magic byte 0xCC, a sample count and a shared
+timestamps array followed by one bitmap and value vector per sample:
+
+    header      '>BBIH'  magic, version, schema id, sample count
+    timestamps  one float64 per sample
+    rows        bitmap and packed values of each sample
+
+JSON batches use the same columnar idea with ``encode_json_batch``.
+
+Run this module to decode compact messages on the consuming side:
+
+    python payload_codec.py <broker> <topic> [port]
+"""
+
+import json
+import struct
+import sys
+import zlib
+from typing import Any, Dict, List, Optional
+
+MAGIC = 0xCB
+BATCH_MAGIC = 0xCC
+VERSION = 1
+HEADER = struct.Struct('>BBId')
+BATCH_HEADER = struct.Struct('>BBIH')
+
+# Integer struct codes by register width for types published without scaling
+_INTEGER_CODES = {'int16': 'h', 'uint16': 'H', 'int32': 'i', 'uint32': 'I',
+                  'int64': 'q', 'uint64': 'Q'}
+_BITFIELD_CODES = {1: 'H', 2: 'I', 3: 'Q', 4: 'Q'}
+
+def _field_code(reg) -> str:
+    """Struct code of a single value of a register as published"""
+    if reg.data_type == 'string':
+        return f'{reg.count * 2}s'
+    if reg.data_type == 'bitfield':
+        # Wider than 64 bits: the big-endian register bytes
+        return _BITFIELD_CODES.get(reg.count, f'{reg.count * 2}s')
+    if reg.scale != 1:
+        return 'd'
+    if reg.data_type in _INTEGER_CODES:
+        return _INTEGER_CODES[reg.data_type]
+    return 'f' if reg.data_type == 'float32' else 'd'
+
+def build_schema(registers: List[Any]) -> Dict[str, Any]:
+    """Describe the published value vector of a register list"""
+    fields = []
+    for reg in registers:
+        field = {
+            "name": reg.name,
+            "unit": reg.unit,
+            "address": reg.display_address,
+            "type": _field_code(reg),
+            "count": reg.decoder.values,
+        }
+        if reg.data_type in ('string', 'bitfield'):
+            field["data_type"] = reg.data_type
+        if reg.bits:
+            field["bits"] = reg.bits
+        fields.append(field)
+    return {"version": VERSION, "fields": fields}
+
+def schema_id(schema: Dict[str, Any]) -> int:
+    """Stable id of a schema: CRC32 of its canonical JSON form"""
+    return zlib.crc32(json.dumps(schema, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+class _Layout:
+    """Struct layout shared by the encoder and decoder of a schema"""
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self.schema_id = schema_id(schema)
+        self.fields = schema["fields"]
+        self.bitmap_size = (len(self.fields) + 7) // 8
+        codes = ''.join(
+            field["type"] if field["type"].endswith('s') else f'{field["count"]}{field["type"]}'
+            for field in self.fields
+        )
+        self.values = struct.Struct('>' + codes)
+        self.size = HEADER.size + self.bitmap_size + self.values.size
+
+class CompactEncoder(_Layout):
+    """Packs bridge samples into compact data messages for one register list"""
+
+    def __init__(self, registers: List[Any]):
+        super().__init__(build_schema(registers))
+        self._defaults = []
+        for field in self.fields:
+            code = field["type"]
+            default = b'' if code.endswith('s') else (0.0 if code in 'fd' else 0)
+            self._defaults.extend([default] * (1 if code.endswith('s') else field["count"]))
+        self._slots = []
+        slot = 0
+        for field in self.fields:
+            width = 1 if field["type"].endswith('s') else field["count"]
+            self._slots.append((field, slot, width))
+            slot += width
+
+    def schema_message(self) -> str:
+        return json.dumps({"schema_id": self.schema_id, **self.schema})
+
+    def encode(self, sample: Dict[str, Any]) -> bytes:
+        """Encode a sample as produced by the bridge's _read_registers"""
+        return (HEADER.pack(MAGIC, VERSION, self.schema_id, sample.get("timestamp", 0.0))
+                + self._encode_row(sample))
+
+    def encode_batch(self, samples: List[Dict[str, Any]]) -> bytes:
+        """Encode several samples into one message with a shared timestamps array"""
+        timestamps = [sample.get("timestamp", 0.0) for sample in samples]
+        return b''.join([
+            BATCH_HEADER.pack(BATCH_MAGIC, VERSION, self.schema_id, len(samples)),
+            struct.pack(f'>{len(samples)}d', *timestamps),
+            *(self._encode_row(sample) for sample in samples)
+        ])
+
+    def _encode_row(self, sample: Dict[str, Any]) -> bytes:
+        data = sample.get("data", {})
+        values = list(self._defaults)
+        bitmap = bytearray(self.bitmap_size)
+
+        for index, (field, slot, width) in enumerate(self._slots):
+            point = data.get(field["name"])
+            if point is None:
+                continue
+            value = point.get("value")
+            if value == "error" or value is None:
+                continue
+            code = field["type"]
+            if field.get("data_type") == 'bitfield':
+                if isinstance(value, dict):
+                    value = sum(1 << bit for name, bit in field["bits"].items() if value.get(name))
+                value = int(value)
+                if code.endswith('s'):
+                    value = value.to_bytes(int(code[:-1]), 'big')
+            elif code.endswith('s'):
+                value = value.encode('ascii', errors='replace')
+            elif code not in 'fd':
+                value = int(value)
+            if width == 1:
+                values[slot] = value
+            else:
+                values[slot:slot + width] = value
+            bitmap[index >> 3] |= 1 << (index & 7)
+
+        return bytes(bitmap) + self.values.pack(*values)
+
+class CompactDecoder(_Layout):
+    """Unpacks compact data messages back into the bridge's JSON sample format"""
+
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        magic, version, payload_schema_id, timestamp = HEADER.unpack_from(payload)
+        if magic == BATCH_MAGIC:
+            return self.decode_batch(payload)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a compact bridge payload")
+        self._check_schema(payload_schema_id)
+        return {"timestamp": timestamp, "data": self._decode_row(payload, HEADER.size)}
+
+    def decode_batch(self, payload: bytes) -> Dict[str, Any]:
+        """Decode a compact batch into the columnar JSON batch layout"""
+        magic, version, payload_schema_id, count = BATCH_HEADER.unpack_from(payload)
+        if magic != BATCH_MAGIC or version != VERSION:
+            raise ValueError("Not a compact bridge batch")
+        self._check_schema(payload_schema_id)
+        timestamps = list(struct.unpack_from(f'>{count}d', payload, BATCH_HEADER.size))
+        offset = BATCH_HEADER.size + 8 * count
+        row_size = self.bitmap_size + self.values.size
+        samples = [
+            {"timestamp": timestamp, "data": self._decode_row(payload, offset + index * row_size)}
+            for index, timestamp in enumerate(timestamps)
+        ]
+        return json.loads(encode_json_batch(samples))
+
+    def _check_schema(self, payload_schema_id: int) -> None:
+        if payload_schema_id != self.schema_id:
+            raise ValueError(f"Payload uses schema {payload_schema_id:08x}, not {self.schema_id:08x}")
+
+    def _decode_row(self, payload: bytes, offset: int) -> Dict[str, Any]:
+        bitmap = payload[offset:offset + self.bitmap_size]
+        values = self.values.unpack_from(payload, offset + self.bitmap_size)
+        data = {}
+        slot = 0
+        for index, field in enumerate(self.fields):
+            code = field["type"]
+            width = 1 if code.endswith('s') else field["count"]
+            if bitmap[index >> 3] & (1 << (index & 7)):
+                value = values[slot] if width == 1 else list(values[slot:slot + width])
+                if field.get("data_type") == 'bitfield':
+                    if code.endswith('s'):
+                        value = int.from_bytes(value, 'big')
+                    if "bits" in field:
+                        value = {name: bool(value >> bit & 1) for name, bit in field["bits"].items()}
+                elif code.endswith('s'):
+                    value = value.decode('ascii', errors='replace').rstrip('\x00 ')
+                data[field["name"]] = {"value": value, "unit": field["unit"], "address": field["address"]}
+            slot += width
+        return data
+
+def encode_json_batch(samples: List[Dict[str, Any]]) -> str:
+    """Columnar JSON batch: a shared timestamps array and one value array per register.
+
+    Registers missing from a sample, for example because their scan group was
+    not due, get ``null`` in their value array.
+    """
+    data: Dict[str, Dict[str, Any]] = {}
+    for index, sample in enumerate(samples):
+        for name, point in sample.get("data", {}).items():
+            column = data.get(name)
+            if column is None:
+                column = data[name] = {
+                    "unit": point.get("unit", ""),
+                    "address": point.get("address"),
+                    "values": [None] * len(samples)
+                }
+            column["values"][index] = point.get("value")
+
+    batch = {
+        "batch": len(samples),
+        "timestamps": [sample.get("timestamp") for sample in samples],
+        "data": data
+    }
+    if "device" in samples[0]:
+        batch["device"] = samples[0]["device"]
+    return json.dumps(batch)
+
+class SchemaCache:
+    """Collects retained schema messages and decodes data messages against them"""
+
+    def __init__(self):
+        self._decoders: Dict[int, CompactDecoder] = {}
+
+    def add_schema(self, message: bytes) -> int:
+        schema = json.loads(message)
+        schema.pop("schema_id", None)
+        decoder = CompactDecoder(schema)
+        self._decoders[decoder.schema_id] = decoder
+        return decoder.schema_id
+
+    def decode(self, payload: bytes) -> Optional[Dict[str, Any]]:
+        """Decode a data message, or None while its schema has not been seen yet"""
+        _, _, payload_schema_id = struct.unpack_from('>BBI', payload)
+        decoder = self._decoders.get(payload_schema_id)
+        return decoder.decode(payload) if decoder else None
+
+def main():
+    import paho.mqtt.client as mqtt
+
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <broker> <topic> [port]")
+        sys.exit(1)
+    broker, topic = sys.argv[1], sys.argv[2]
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 1883
+    cache = SchemaCache()
+
+    def on_message(client, userdata, message):
+        if '/schema/' in message.topic:
+            print(f"# schema {cache.add_schema(message.payload):08x} from {message.topic}")
+            return
+        if not message.payload or message.payload[0] not in (MAGIC, BATCH_MAGIC):
+            print(message.topic, message.payload.decode('utf-8', errors='replace'))
+            return
+        sample = cache.decode(message.payload)
+        if sample is None:
+            print(f"# {message.topic}: schema not received yet")
+        else:
+            print(message.topic, json.dumps(sample))
+
+    client = mqtt.Client()
+    client.on_message = on_message
+    client.connect(broker, port)
+    base = topic.rstrip('#').rstrip('/')
+    client.subscribe(f"{base}/#" if base else "#", qos=1)
+    client.loop_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,245 @@
-from pymodbus.client import ModbusTcpClient
+import argparse
+import asyncio
+import ipaddress
+import re
+import struct
+import sys
 import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
-# Inverter IP address
-INVERTER_IP = '192.168.1.100'
+import yaml
 
-# Range of ports to test
-START_PORT = 0
-END_PORT = 2000
+from modbus_pipeline import GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED, MBAP_HEADER, MEI_DEVICE_ID, READ_DEVICE_ID
 
-def test_modbus_connection(ip, port):
-    """Attempt to connect to a Modbus server at the specified IP and port."""
-    client = ModbusTcpClient(ip, port=port)
-    connection = client.connect()
-    client.close()
-    return connection
+# Basic objects of Read Device Identification
+DEVICE_ID_OBJECTS = {0: 'vendor', 1: 'product_code', 2: 'revision', 4: 'product_name', 5: 'model_name'}
 
-def main():
-    successful_ports = []
-    start_time = time.time()
-    
-    print(f"Starting port scan on {INVERTER_IP} from port {START_PORT} to {END_PORT}")
-    print("-" * 50)
+@dataclass
+class ScanResult:
+    """A unit that answered the Modbus probe"""
+    host: str
+    port: int
+    unit_id: int
+    response_time: float
+    exception_code: Optional[int] = None  # the probe read was answered with an exception
+    identification: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        product = self.identification.get('product_code') or self.identification.get('product_name')
+        if product:
+            return re.sub(r'[^A-Za-z0-9_.-]+', '-', f"{product}-{self.host}-{self.port}-{self.unit_id}")
+        return f"{self.host}-{self.port}-{self.unit_id}"
+
+def parse_ranges(spec: str) -> List[int]:
+    """Numbers from a list like '502,1502,5020-5030'"""
+    numbers = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        numbers.extend(range(int(start), int(end or start) + 1))
+    return list(dict.fromkeys(numbers))
+
+def probe_request(address: int) -> Tuple[int, int]:
+    """Function code and 0-based address of the probe read for a bridge config address"""
+    if address >= 40001:
+        return 3, address - 40001
+    if address >= 30001:
+        return 4, address - 30001
+    return 3, address
+
+def iter_hosts(targets: Sequence[str]) -> Iterator[str]:
+    """Addresses of hosts and CIDR ranges, network and broadcast addresses excluded"""
+    for target in targets:
+        network = ipaddress.ip_network(target, strict=False)
+        if network.num_addresses == 1:
+            yield str(network.network_address)
+        else:
+            yield from (str(host) for host in network.hosts())
+
+class ModbusScanner:
+    """Concurrent Modbus TCP discovery over hosts, ports and unit ids.
+
+    Every host and port is tried with a non-blocking connect by a pool of
+    ``concurrency`` workers, so thousands of connects can be in flight
+    without running out of file descriptors. An open port is only reported
+    when a unit answers a one-register read with a Modbus response; an
+    exception other than the gateway ones still proves a Modbus device.
+    Responding units can also be asked for their basic device identification.
+    """
+
+    def __init__(self, ports: Sequence[int], unit_ids: Sequence[int] = (1,),
+                 concurrency: int = 500, timeout: float = 1.0, address: int = 40001,
+                 identify: bool = False):
+        self.ports = list(ports)
+        self.unit_ids = list(unit_ids)
+        self.timeout = timeout
+        self.identify = identify
+        self.function_code, self.address = probe_request(address)
+        self.open_ports = 0
+        self.endpoints = 0
+        self._concurrency = concurrency
+        self._transaction_id = 0
+
+    def _next_transaction_id(self) -> int:
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        return self._transaction_id
+
+    async def _request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       unit_id: int, pdu: bytes) -> Optional[bytes]:
+        """Response PDU for a request, None on timeout"""
+        transaction_id = self._next_transaction_id()
+        writer.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+        await writer.drain()
+
+        async def receive() -> bytes:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                response_id, protocol_id, length, _ = MBAP_HEADER.unpack(header)
+                if protocol_id != 0 or length < 2:
+                    raise ConnectionError("Not a Modbus TCP response")
+                response = await reader.readexactly(length - 1)
+                if response_id == transaction_id:
+                    return response
+                # A late answer to an earlier probe that timed out
 
-    for port in range(START_PORT, END_PORT + 1):
-        result = test_modbus_connection(INVERTER_IP, port)
-        if result:
-            print(f"✓ Connection successful on port {port}")
-            successful_ports.append(port)
+        try:
+            return await asyncio.wait_for(receive(), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _identify(self, reader, writer, unit_id: int) -> Dict[str, str]:
+        response = await self._request(reader, writer, unit_id, bytes((READ_DEVICE_ID, MEI_DEVICE_ID, 1, 0)))
+        if not response or response[0] != READ_DEVICE_ID or len(response) < 7:
+            return {}
+        identification = {}
+        offset, objects = 7, response[6]
+        for _ in range(objects):
+            if offset + 2 > len(response):
+                break
+            object_id, length = response[offset], response[offset + 1]
+            value = response[offset + 2:offset + 2 + length].decode('ascii', errors='replace')
+            identification[DEVICE_ID_OBJECTS.get(object_id, f"object_{object_id}")] = value
+            offset += 2 + length
+        return identification
+
+    async def _scan_endpoint(self, host: str, port: int) -> List[ScanResult]:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return []
+        self.open_ports += 1
+        results = []
+        request = struct.pack('>BHH', self.function_code, self.address, 1)
+        try:
+            for unit_id in self.unit_ids:
+                start = time.perf_counter()
+                response = await self._request(reader, writer, unit_id, request)
+                if response is None:
+                    continue
+                exception_code = None
+                if response[0] & 0x80:
+                    exception_code = response[1] if len(response) > 1 else 0
+                    if exception_code in (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED):
+                        continue
+                result = ScanResult(host, port, unit_id, time.perf_counter() - start, exception_code)
+                if self.identify:
+                    result.identification = await self._identify(reader, writer, unit_id)
+                results.append(result)
+        except (OSError, asyncio.IncompleteReadError):
+            # Closed or not speaking Modbus; keep the units found so far
+            pass
+        finally:
+            writer.close()
+        self.endpoints += bool(results)
+        return results
+
+    async def scan(self, hosts: Sequence[str]) -> List[ScanResult]:
+        # A fixed pool of workers pulls endpoints from one lazy iterator, so a
+        # large range costs ``concurrency`` tasks rather than one per endpoint
+        endpoints = enumerate((host, port) for host in hosts for port in self.ports)
+        found: Dict[int, List[ScanResult]] = {}
+
+        async def worker() -> None:
+            for index, (host, port) in endpoints:
+                results = await self._scan_endpoint(host, port)
+                if results:
+                    found[index] = results
+
+        await asyncio.gather(*(worker() for _ in range(max(1, self._concurrency))))
+        return [result for index in sorted(found) for result in found[index]]
+
+def bridge_config(results: Sequence[ScanResult], template: Optional[str] = None) -> dict:
+    """Bridge config polling the discovered units, based on an optional template config"""
+    config = {}
+    if template:
+        with open(template, 'r') as f:
+            config = yaml.safe_load(f) or {}
+        modbus = config.get('modbus') or {}
+        # In fleet mode the modbus section only holds defaults shared by the devices
+        for key in ('host', 'port', 'unit_id'):
+            modbus.pop(key, None)
+        if modbus:
+            config['modbus'] = modbus
         else:
-            print(f"✗ Port {port}", end='\r')
+            config.pop('modbus', None)
+    names = set()
+    devices = []
+    for result in results:
+        name = result.name
+        while name in names:
+            name += '_'
+        names.add(name)
+        devices.append({'name': name, 'host': result.host, 'port': result.port, 'unit_id': result.unit_id})
+    config['devices'] = devices
+    return config
+
+def main():
+    parser = argparse.ArgumentParser(description="Discover Modbus TCP devices on hosts and CIDR ranges")
+    parser.add_argument('targets', nargs='+', help="IP addresses or CIDR ranges, e.g. 192.168.1.0/24")
+    parser.add_argument('--ports', default='502', help="ports and port ranges (default 502), e.g. 502,5020-5030")
+    parser.add_argument('--units', default='1', help="unit ids to probe per port (default 1), e.g. 1-10")
+    parser.add_argument('--address', type=int, default=40001,
+                        help="register read by the probe, bridge config numbering (default 40001)")
+    parser.add_argument('--identify', action='store_true', help="read the device identification of each unit")
+    parser.add_argument('--concurrency', type=int, default=500, help="max connections in flight (default 500)")
+    parser.add_argument('--timeout', type=float, default=1.0,
+                        help="connect and response timeout in seconds (default 1)")
+    parser.add_argument('--output', metavar='PATH', help="write a bridge config with the discovered devices")
+    parser.add_argument('--template', metavar='PATH',
+                        help="bridge config whose mqtt and register settings the output reuses")
+    args = parser.parse_args()
+
+    hosts = list(dict.fromkeys(iter_hosts(args.targets)))
+    scanner = ModbusScanner(parse_ranges(args.ports), parse_ranges(args.units), args.concurrency,
+                            args.timeout, args.address, args.identify)
+    print(f"Scanning {len(hosts)} host(s) x {len(scanner.ports)} port(s) for unit id(s) {args.units}")
+    print("-" * 50)
 
-    # Summary report
+    start_time = time.time()
+    results = asyncio.run(scanner.scan(hosts))
     elapsed_time = time.time() - start_time
-    print("\n" + "=" * 50)
-    print(f"Scan completed in {elapsed_time:.2f} seconds")
-    print(f"Tested port range: {START_PORT}-{END_PORT}")
-    
-    if successful_ports:
-        print("\nSuccessful connections found on ports:")
-        print("-" * 30)
-        for port in successful_ports:
-            print(f"Port {port}")
-    else:
-        print("\nNo successful connections found.")
-    
+
+    for result in results:
+        details = f" (exception {result.exception_code})" if result.exception_code is not None else ""
+        identification = ', '.join(result.identification.values())
+        if identification:
+            details += f" [{identification}]"
+        print(f"✓ {result.host}:{result.port} unit {result.unit_id} "
+              f"in {result.response_time * 1000:.1f}ms{details}")
+
     print("=" * 50)
+    print(f"Scan completed in {elapsed_time:.2f} seconds: {scanner.open_ports} open port(s), "
+          f"{scanner.endpoints} Modbus endpoint(s), {len(results)} unit(s)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            yaml.safe_dump(bridge_config(results, args.template), f, sort_keys=False)
+        print(f"Wrote bridge config with {len(results)} device(s) to {args.output}")
+    return 0 if results else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
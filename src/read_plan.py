@@ -0,0 +1,170 @@
+import heapq
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+from registers import MAX_READ_REGISTERS, REGISTER_FUNCTION_CODES, RegisterDefinition
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ReadBlock:
+    """A contiguous span of registers fetched with a single Modbus request"""
+    register_type: str
+    address: int
+    count: int
+    registers: List[RegisterDefinition] = field(default_factory=list)
+
+    @property
+    def function_code(self) -> int:
+        return REGISTER_FUNCTION_CODES[self.register_type]
+        
+    @property
+    def label(self) -> str:
+        """Display address range of the block, e.g. 30001-30020"""
+        base = 30001 if self.register_type == 'input' else 40001
+        return f"{self.address + base}-{self.address + base + self.count - 1}"
+
+def build_read_plan(registers: List[RegisterDefinition], max_gap: int = 10,
+                    max_block_size: int = MAX_READ_REGISTERS) -> List[ReadBlock]:
+    """Coalesce register definitions into as few block reads as possible.
+    
+    Registers are grouped by table (holding/input) and neighbours are merged
+    when the hole between them is at most ``max_gap`` registers and the
+    resulting block still fits in ``max_block_size`` registers. Overlapping
+    definitions share the same block.
+    """
+    max_block_size = min(max_block_size, MAX_READ_REGISTERS)
+    plan = []
+    
+    for register_type in REGISTER_FUNCTION_CODES:
+        table = sorted(
+            (reg for reg in registers if reg.register_type == register_type),
+            key=lambda reg: (reg.address, reg.count)
+        )
+        block = None
+        
+        for reg in table:
+            if reg.count > max_block_size:
+                raise ValueError(f"Register {reg.name} spans {reg.count} registers, "
+                                 f"more than the maximum block size of {max_block_size}")
+            reg_end = reg.address + reg.count
+            if block is not None:
+                block_end = block.address + block.count
+                if (reg.address <= block_end + max_gap
+                        and max(reg_end, block_end) - block.address <= max_block_size):
+                    block.count = max(reg_end, block_end) - block.address
+                    block.registers.append(reg)
+                    continue
+            block = ReadBlock(register_type, reg.address, reg.count, [reg])
+            plan.append(block)
+            
+    return plan
+
+def split_read_block(block: ReadBlock) -> List[ReadBlock]:
+    """Smaller reads for a block the device rejected.
+    
+    The block is cut at its holes into runs of adjacent registers; a block
+    that already is a single run is split into its registers.
+    """
+    parts = build_read_plan(block.registers, max_gap=0, max_block_size=block.count)
+    if len(parts) > 1:
+        return parts
+    return [ReadBlock(reg.register_type, reg.address, reg.count, [reg]) for reg in block.registers]
+
+def replace_read_block(groups: Iterable['ScanGroup'], block: ReadBlock, parts: List[ReadBlock]) -> None:
+    """Put ``parts`` in place of ``block`` in the read plan of the group holding it"""
+    for group in groups:
+        for index, planned in enumerate(group.read_plan):
+            if planned is block:
+                group.read_plan[index:index + 1] = parts
+                return
+
+@dataclass
+class ScanGroup:
+    """Registers sharing a poll period, with their own compiled read plan"""
+    name: str
+    interval: float
+    registers: List[RegisterDefinition] = field(default_factory=list)
+    read_plan: List[ReadBlock] = field(default_factory=list)
+
+def build_scan_groups(registers: List[RegisterDefinition], scan_classes: Dict[str, float],
+                      default_interval: float, max_gap: int = 10,
+                      max_block_size: int = MAX_READ_REGISTERS) -> List[ScanGroup]:
+    """Group registers by effective poll period and compile a read plan per group"""
+    groups: Dict[float, ScanGroup] = {}
+    
+    for reg in registers:
+        if reg.poll_interval is not None:
+            interval = reg.poll_interval
+        elif reg.scan_class:
+            if reg.scan_class not in scan_classes:
+                raise ValueError(f"Register {reg.name}: unknown scan_class '{reg.scan_class}'")
+            interval = scan_classes[reg.scan_class]
+        else:
+            interval = default_interval
+            
+        if interval <= 0:
+            raise ValueError(f"Register {reg.name}: poll interval must be positive")
+            
+        interval = float(interval)
+        if interval not in groups:
+            groups[interval] = ScanGroup(f"{interval:g}s", interval)
+        groups[interval].registers.append(reg)
+        
+    for group in groups.values():
+        group.read_plan = build_read_plan(group.registers, max_gap, max_block_size)
+        
+    return sorted(groups.values(), key=lambda group: group.interval)
+
+class PollScheduler:
+    """Deadline-ordered poll scheduler backed by a priority queue.
+    
+    Each scan group sits in a heap keyed by its next deadline. Groups whose
+    deadlines fall within ``batch_window`` of each other are returned together
+    so they are read in the same cycle. Deadlines advance by whole periods so
+    the cadence does not drift; periods missed during an overrun are skipped.
+    """
+    
+    def __init__(self, groups: List[ScanGroup], batch_window: float = 0.05,
+                 start: Optional[float] = None,
+                 observer: Optional[Callable[[ScanGroup, float, int], None]] = None):
+        self.batch_window = batch_window
+        self.observer = observer  # called with group, lateness in seconds and skipped cycles
+        self._queue: List[tuple] = []
+        self._sequence = 0
+        now = time.monotonic() if start is None else start
+        
+        for group in groups:
+            self._push(now, group)
+            
+    def _push(self, deadline: float, group: ScanGroup) -> None:
+        # The sequence number keeps heap ordering stable for equal deadlines
+        heapq.heappush(self._queue, (deadline, self._sequence, group))
+        self._sequence += 1
+        
+    def next_deadline(self) -> Optional[float]:
+        """Monotonic time at which the next scan group falls due"""
+        return self._queue[0][0] if self._queue else None
+        
+    def pop_due(self, now: Optional[float] = None) -> List[ScanGroup]:
+        """Return all scan groups due by now and schedule their next deadlines"""
+        now = time.monotonic() if now is None else now
+        due = []
+        
+        while self._queue and self._queue[0][0] <= now + self.batch_window:
+            deadline, _, group = heapq.heappop(self._queue)
+            due.append(group)
+            
+            next_deadline = deadline + group.interval
+            missed = 0
+            if next_deadline <= now:
+                missed = int((now - deadline) // group.interval)
+                next_deadline += missed * group.interval
+                logger.warning("Scan group %s overrun, skipped %d cycle(s)", group.name, missed)
+            self._push(next_deadline, group)
+            if self.observer:
+                self.observer(group, max(0.0, now - deadline), missed)
+            
+        return due
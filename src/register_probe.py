@@ -0,0 +1,268 @@
+import argparse
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import yaml
+from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ModbusException
+
+from modbus_mqtt_bridge import unit_id_kwarg
+from modbus_pipeline import ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE, ILLEGAL_FUNCTION
+from read_plan import ReadBlock
+from registers import MAX_READ_REGISTERS, REGISTER_FUNCTION_CODES
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a probe read
+READABLE = 'readable'
+INVALID = 'invalid'
+UNSUPPORTED = 'unsupported'
+FAILED = 'failed'
+
+# Addresses stepped over per request inside a hole
+DEFAULT_RESOLUTION = 16
+
+@dataclass
+class TableMap:
+    """Probe result for one register table"""
+    register_type: str
+    spans: List[Tuple[int, int]] = field(default_factory=list)  # (0-based address, count)
+    failed: List[Tuple[int, int]] = field(default_factory=list)  # ranges that never answered
+    supported: bool = True
+
+    @property
+    def base(self) -> int:
+        return 30001 if self.register_type == 'input' else 40001
+
+    def add_span(self, address: int, count: int) -> None:
+        """Record a readable range, merged with the previous one when adjacent"""
+        if self.spans and sum(self.spans[-1]) == address:
+            start, previous = self.spans[-1]
+            self.spans[-1] = (start, previous + count)
+        else:
+            self.spans.append((address, count))
+
+    def read_plan(self, max_block_size: int = MAX_READ_REGISTERS) -> List[ReadBlock]:
+        """Fewest block reads covering every readable register.
+
+        Unlike the bridge's plan, blocks never bridge a hole between spans:
+        reading across an invalid address fails the whole request.
+        """
+        plan = []
+        for address, count in self.spans:
+            for offset in range(0, count, max_block_size):
+                plan.append(ReadBlock(self.register_type, address + offset,
+                                      min(max_block_size, count - offset)))
+        return plan
+
+class RegisterProbe:
+    """Finds the readable address ranges of a device by bisecting block reads.
+
+    Each table is read in blocks of up to 125 registers. A block that
+    answers is readable as a whole. In a block rejected with Illegal Data
+    Address (or Illegal Data Value, which some devices send for the same
+    reason) every readable run is measured by bisecting on the longest read
+    that still succeeds, and addresses that cannot be read on their own are
+    stepped over ``resolution`` addresses at a time. Readable registers thus
+    cost one request per block plus a few per hole, and a hole costs one
+    request per ``resolution`` addresses. A readable island shorter than the
+    step can fall between two probes and be missed; ``resolution`` 1 tests
+    every invalid address, as a register-by-register sweep does. Reads are
+    paced by ``delay`` to go easy on production devices.
+    """
+
+    def __init__(self, client: ModbusTcpClient, unit_id: int = 1, delay: float = 0.05,
+                 retries: int = 1, max_block_size: int = MAX_READ_REGISTERS,
+                 resolution: int = DEFAULT_RESOLUTION):
+        self.client = client
+        self.unit_id = unit_id
+        self.delay = delay
+        self.retries = retries
+        self.max_block_size = min(max_block_size, MAX_READ_REGISTERS)
+        self.resolution = max(1, resolution)
+        self.requests = 0
+
+    def _read(self, register_type: str, address: int, count: int) -> str:
+        unit = {unit_id_kwarg(): self.unit_id}
+        read = (self.client.read_input_registers if register_type == 'input'
+                else self.client.read_holding_registers)
+        for attempt in range(self.retries + 1):
+            if self.requests and self.delay:
+                time.sleep(self.delay)
+            self.requests += 1
+            try:
+                response = read(address, count=count, **unit)
+            except ModbusException as e:
+                logger.debug("Read %s %d+%d failed (attempt %d): %s",
+                             register_type, address, count, attempt + 1, e)
+                continue
+            if not response.isError():
+                return READABLE
+            code = getattr(response, 'exception_code', None)
+            if code in (ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE):
+                return INVALID
+            if code == ILLEGAL_FUNCTION:
+                return UNSUPPORTED
+            logger.debug("Read %s %d+%d returned %s (attempt %d)",
+                         register_type, address, count, response, attempt + 1)
+        return FAILED
+
+    def _run_length(self, register_type: str, address: int, limit: int) -> Tuple[int, bool]:
+        """Readable registers from an address known to be readable, and whether the next one is invalid.
+
+        The run length is bracketed by doubling reads and then bisected, so
+        finding the end of a run of n registers takes about 2 * log2(n) reads.
+        """
+        good, bad = 1, None
+        count = 2
+        while good < limit:
+            count = min(count, limit)
+            if self._read(register_type, address, count) != READABLE:
+                bad = count
+                break
+            good = count
+            count *= 2
+        if bad is None:
+            return good, False
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if self._read(register_type, address, middle) == READABLE:
+                good = middle
+            else:
+                bad = middle
+        return good, True
+
+    def _run_start(self, register_type: str, address: int, limit: int) -> int:
+        """First address of the readable run containing ``address``, at most ``limit`` registers back"""
+        good, bad = 0, limit + 1
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if self._read(register_type, address - middle, middle + 1) == READABLE:
+                good = middle
+            else:
+                bad = middle
+        return address - good
+
+    def _refine(self, table: TableMap, address: int, count: int) -> None:
+        """Find the readable runs in a block whose read was rejected"""
+        end = address + count
+        skipped = 0  # unread addresses behind the current one, when stepping over a hole
+        while address < end:
+            outcome = self._read(table.register_type, address, 1)
+            if outcome == UNSUPPORTED:
+                table.supported = False
+                return
+            if outcome == FAILED:
+                table.failed.append((address, 1))
+            if outcome != READABLE:
+                step = min(self.resolution, end - address - 1) or 1
+                skipped = step - 1
+                address += step
+                continue
+            if skipped:
+                address = self._run_start(table.register_type, address, skipped)
+                skipped = 0
+            length, invalid_next = self._run_length(table.register_type, address, end - address)
+            table.add_span(address, length)
+            address += length + invalid_next
+
+    def _probe_block(self, table: TableMap, address: int, count: int) -> None:
+        outcome = self._read(table.register_type, address, count)
+        if outcome == READABLE:
+            table.add_span(address, count)
+        elif outcome == UNSUPPORTED:
+            table.supported = False
+        elif outcome == FAILED:
+            table.failed.append((address, count))
+            logger.warning("No answer for %s registers %d-%d", table.register_type,
+                           address + table.base, address + table.base + count - 1)
+        elif count > 1:
+            self._refine(table, address, count)
+
+    def probe_table(self, register_type: str, start: int, end: int) -> TableMap:
+        """Readable spans of a table between 0-based addresses ``start`` and ``end`` inclusive"""
+        table = TableMap(register_type)
+        for address in range(start, end + 1, self.max_block_size):
+            self._probe_block(table, address, min(self.max_block_size, end + 1 - address))
+            if not table.supported:
+                logger.info("Device does not support reading %s registers", register_type)
+                break
+        return table
+
+def probe_report(tables: List[TableMap], requests: int, start: int, end: int,
+                 resolution: int = DEFAULT_RESOLUTION) -> dict:
+    """Probe results with display addresses, ready to be written as YAML"""
+    report = {'requests': requests, 'sweep_requests': len(tables) * (end - start + 1),
+              'resolution': resolution, 'tables': {}}
+    for table in tables:
+        base = table.base
+        plan = table.read_plan()
+        report['tables'][table.register_type] = {
+            'supported': table.supported,
+            'registers': sum(count for _, count in table.spans),
+            'spans': [f"{address + base}-{address + base + count - 1}" for address, count in table.spans],
+            'failed': [f"{address + base}-{address + base + count - 1}" for address, count in table.failed],
+            'read_plan': [{'address': block.address + base, 'count': block.count} for block in plan],
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Map the readable registers of a Modbus TCP device")
+    parser.add_argument('host')
+    parser.add_argument('port', nargs='?', type=int, default=502)
+    parser.add_argument('--unit', type=int, default=1, help="unit id (default 1)")
+    parser.add_argument('--tables', default='input,holding', help="tables to probe (default input,holding)")
+    parser.add_argument('--start', type=int, default=0, help="first 0-based address (default 0)")
+    parser.add_argument('--end', type=int, default=9998, help="last 0-based address (default 9998)")
+    parser.add_argument('--block-size', type=int, default=MAX_READ_REGISTERS,
+                        help=f"registers per probe read (default {MAX_READ_REGISTERS})")
+    parser.add_argument('--resolution', type=int, default=DEFAULT_RESOLUTION,
+                        help="step over invalid addresses this many at a time; readable runs shorter "
+                             f"than the step may be missed (default {DEFAULT_RESOLUTION}, 1 is exact)")
+    parser.add_argument('--delay', type=float, default=0.05, help="seconds between requests (default 0.05)")
+    parser.add_argument('--timeout', type=float, default=3, help="response timeout in seconds (default 3)")
+    parser.add_argument('--retries', type=int, default=1, help="retries of an unanswered read (default 1)")
+    parser.add_argument('--output', metavar='PATH', help="write the map and read plan as YAML")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', force=True)
+    tables = [name.strip() for name in args.tables.split(',') if name.strip()]
+    for name in tables:
+        if name not in REGISTER_FUNCTION_CODES:
+            parser.error(f"unknown table '{name}'")
+
+    client = ModbusTcpClient(args.host, port=args.port, timeout=args.timeout, retries=0)
+    if not client.connect():
+        logger.error("Could not connect to %s:%d", args.host, args.port)
+        return 1
+
+    probe = RegisterProbe(client, args.unit, args.delay, args.retries, args.block_size, args.resolution)
+    start_time = time.time()
+    try:
+        results = [probe.probe_table(name, args.start, args.end) for name in tables]
+    finally:
+        client.close()
+
+    report = probe_report(results, probe.requests, args.start, args.end, probe.resolution)
+    report['device'] = {'host': args.host, 'port': args.port, 'unit_id': args.unit}
+    for name, table in report['tables'].items():
+        logger.info("%s: %d readable register(s) in %d span(s), read plan of %d block(s)",
+                    name, table['registers'], len(table['spans']), len(table['read_plan']))
+        for span in table['spans']:
+            logger.info("  %s", span)
+    logger.info("Probe took %d requests in %.1fs (a register-by-register sweep takes %d)",
+                probe.requests, time.time() - start_time, report['sweep_requests'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            yaml.safe_dump(report, f, sort_keys=False)
+        logger.info("Wrote register map to %s", args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
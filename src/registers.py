@@ -0,0 +1,239 @@
+import operator
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+# Modbus PDU limit for a single read holding/input registers request
+MAX_READ_REGISTERS = 125
+
+# Register tables and the function codes used to read them
+REGISTER_FUNCTION_CODES = {
+    'holding': 3,
+    'input': 4,
+}
+
+# data_type -> (struct format character, registers per value)
+DATA_TYPES = {
+    'int16': ('h', 1),
+    'uint16': ('H', 1),
+    'int32': ('i', 2),
+    'uint32': ('I', 2),
+    'float32': ('f', 2),
+    'int64': ('q', 4),
+    'uint64': ('Q', 4),
+    'float64': ('d', 4),
+    'string': ('s', 1),
+    'bitfield': ('H', 1),
+}
+
+BYTE_ORDERS = ('big', 'little')
+
+# Value range of the integer struct formats, used to clamp encoded values
+INTEGER_RANGES = {
+    'h': (-2 ** 15, 2 ** 15 - 1),
+    'H': (0, 2 ** 16 - 1),
+    'i': (-2 ** 31, 2 ** 31 - 1),
+    'I': (0, 2 ** 32 - 1),
+    'q': (-2 ** 63, 2 ** 63 - 1),
+    'Q': (0, 2 ** 64 - 1),
+}
+
+DEADBAND_TYPES = ('absolute', 'percent')
+
+# How a register is published: raw samples, window statistics, or both
+PUBLISH_MODES = ('raw', 'aggregate', 'both')
+
+# Cached struct formats for packing block responses back into wire bytes
+_WORD_STRUCTS: Dict[int, struct.Struct] = {}
+
+def registers_to_bytes(registers: List[int]) -> bytes:
+    """Pack 16-bit register values into big-endian bytes as sent on the wire"""
+    packer = _WORD_STRUCTS.get(len(registers))
+    if packer is None:
+        packer = _WORD_STRUCTS[len(registers)] = struct.Struct(f'>{len(registers)}H')
+    return packer.pack(*registers)
+
+class RegisterDecoder:
+    """Decoder compiled once per register definition.
+    
+    The struct format, word-swap plan and scaling are worked out up front so
+    decoding a value is a single ``unpack_from`` on the block buffer. Multi
+    register values use ``byte_order`` as the word order: ``big`` keeps the
+    most significant register first, ``little`` puts it last. For strings
+    ``little`` swaps the two bytes inside every register instead.
+    """
+    
+    __slots__ = ('data_type', 'byte_order', 'count', 'scale', 'bits',
+                 'size', 'values', '_struct', '_split', '_word_plan', '_decode')
+    
+    def __init__(self, data_type: str, byte_order: str, count: int,
+                 scale: float = 1.0, bits: Optional[Dict[str, int]] = None):
+        self.data_type = data_type
+        self.byte_order = byte_order
+        self.count = count
+        self.scale = scale
+        self.bits = bits
+        self.size = count * 2
+        
+        code, width = DATA_TYPES[data_type]
+        self.values = 1 if data_type in ('string', 'bitfield') else count // width
+        
+        # Registers are reordered before unpacking only for little word order:
+        # split the span into 2-byte words and pick them back in swapped order
+        self._word_plan = None
+        self._split = None
+        if byte_order == 'little' and width > 1 and data_type != 'bitfield':
+            self._split = struct.Struct('>' + '2s' * count)
+            self._word_plan = operator.itemgetter(*(
+                first + index
+                for first in range(0, count, width)
+                for index in reversed(range(width))
+            ))
+            
+        if data_type == 'string':
+            self._struct = struct.Struct(f'>{self.size}s')
+            self._decode = self._decode_string
+        elif data_type == 'bitfield':
+            self._struct = struct.Struct(f'>{count}H')
+            self._decode = self._decode_bitfield
+        else:
+            self._struct = struct.Struct(f'>{self.values}{code}')
+            self._decode = self._decode_number if self.values == 1 else self._decode_array
+
+    def __reduce__(self):
+        return (RegisterDecoder, (self.data_type, self.byte_order, self.count, self.scale, self.bits))
+
+    def _unpack(self, buffer: bytes, offset: int) -> tuple:
+        if self._word_plan is None:
+            return self._struct.unpack_from(buffer, offset)
+        return self._struct.unpack(b''.join(self._word_plan(self._split.unpack_from(buffer, offset))))
+
+    def _decode_number(self, buffer: bytes, offset: int) -> Union[int, float]:
+        value = self._unpack(buffer, offset)[0]
+        return value * self.scale if self.scale != 1 else value
+
+    def _decode_array(self, buffer: bytes, offset: int) -> List[Union[int, float]]:
+        values = self._unpack(buffer, offset)
+        if self.scale != 1:
+            return [value * self.scale for value in values]
+        return list(values)
+
+    def _decode_string(self, buffer: bytes, offset: int) -> str:
+        raw = self._struct.unpack_from(buffer, offset)[0]
+        if self.byte_order == 'little':
+            swapped = bytearray(raw)
+            swapped[0::2], swapped[1::2] = raw[1::2], raw[0::2]
+            raw = bytes(swapped)
+        return raw.decode('ascii', errors='replace').rstrip('\x00 ')
+
+    def _decode_bitfield(self, buffer: bytes, offset: int) -> Union[int, Dict[str, bool]]:
+        value = 0
+        words = self._struct.unpack_from(buffer, offset)
+        if self.byte_order == 'little':
+            words = reversed(words)
+        for word in words:
+            value = (value << 16) | word
+        if not self.bits:
+            return value
+        return {name: bool(value >> bit & 1) for name, bit in self.bits.items()}
+
+    def decode(self, buffer: bytes, offset: int = 0) -> Any:
+        """Decode the value starting at byte ``offset`` of a block buffer"""
+        return self._decode(buffer, offset)
+        
+    def encode(self, value: Any) -> List[int]:
+        """Inverse of ``decode``: the register words that decode to ``value``.
+        
+        Used by the simulator to serve a register map. Scaling is undone and
+        integers are rounded and clamped to the range of their type.
+        """
+        if self.data_type == 'string':
+            raw = str(value).encode('ascii', errors='replace')[:self.size].ljust(self.size, b'\x00')
+            if self.byte_order == 'little':
+                swapped = bytearray(raw)
+                swapped[0::2], swapped[1::2] = raw[1::2], raw[0::2]
+                raw = bytes(swapped)
+            return list(struct.unpack(f'>{self.count}H', raw))
+            
+        if self.data_type == 'bitfield':
+            if isinstance(value, dict):
+                value = sum(1 << self.bits[name] for name, on in value.items() if on and name in self.bits)
+            value = int(value) & ((1 << (16 * self.count)) - 1)
+            words = [(value >> (16 * index)) & 0xFFFF for index in reversed(range(self.count))]
+            return words[::-1] if self.byte_order == 'little' else words
+            
+        values = list(value) if isinstance(value, (list, tuple)) else [value]
+        if self.scale != 1:
+            values = [item / self.scale for item in values]
+        code = DATA_TYPES[self.data_type][0]
+        if code in INTEGER_RANGES:
+            low, high = INTEGER_RANGES[code]
+            values = [min(high, max(low, int(round(item)))) for item in values]
+        words = struct.unpack(f'>{self.count}H', self._struct.pack(*values))
+        if self._word_plan is not None:
+            words = self._word_plan(words)
+        return list(words)
+
+@dataclass
+class RegisterDefinition:
+    name: str
+    address: int
+    count: int = 1
+    scale: float = 1.0
+    unit: str = ''
+    data_type: str = 'int16'  # Options: int16, uint16, int32, uint32, float32, int64, uint64, float64, string, bitfield
+    byte_order: str = 'big'   # Options: big, little
+    register_type: str = ''   # Options: holding, input (inferred from 3XXXX/4XXXX addressing)
+    poll_interval: Optional[float] = None  # seconds, overrides scan_class and loop_interval
+    scan_class: str = ''      # Name of a period defined in AppConfig.scan_classes
+    bits: Optional[Dict[str, int]] = None  # bitfield only: flag name -> bit number
+    deadband: float = 0.0     # change needed before a value is reported by exception
+    deadband_type: str = 'absolute'  # Options: absolute, percent
+    max_silence: Optional[float] = None  # seconds, overrides AppConfig.heartbeat_interval
+    writable: bool = False    # may be written by MQTT commands, holding registers only
+    min_value: Optional[float] = None  # lowest value a command may write
+    max_value: Optional[float] = None  # highest value a command may write
+    publish: str = 'raw'      # Options: raw, aggregate, both
+    aggregate_window: Optional[float] = None  # seconds, overrides AppConfig.aggregate_window
+    decoder: RegisterDecoder = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Convert from user-friendly 3XXXX/4XXXX addressing to 0-based addressing used by pymodbus
+        if self.address >= 40001:
+            self.address -= 40001
+            self.register_type = self.register_type or 'holding'
+        elif self.address >= 30001:
+            self.address -= 30001
+            self.register_type = self.register_type or 'input'
+        
+        self.register_type = self.register_type or 'holding'
+        if self.register_type not in REGISTER_FUNCTION_CODES:
+            raise ValueError(f"Register {self.name}: unknown register_type '{self.register_type}'")
+        if self.data_type not in DATA_TYPES:
+            raise ValueError(f"Register {self.name}: unknown data_type '{self.data_type}'")
+        if self.byte_order not in BYTE_ORDERS:
+            raise ValueError(f"Register {self.name}: unknown byte_order '{self.byte_order}'")
+        if self.deadband_type not in DEADBAND_TYPES:
+            raise ValueError(f"Register {self.name}: unknown deadband_type '{self.deadband_type}'")
+        if self.writable and self.register_type != 'holding':
+            raise ValueError(f"Register {self.name}: only holding registers can be writable")
+        if self.publish not in PUBLISH_MODES:
+            raise ValueError(f"Register {self.name}: unknown publish mode '{self.publish}'")
+            
+        # A single count on a wide type means one value of that type
+        width = DATA_TYPES[self.data_type][1]
+        if self.count == 1:
+            self.count = width
+        if not 1 <= self.count <= MAX_READ_REGISTERS:
+            raise ValueError(f"Register {self.name}: count must be between 1 and {MAX_READ_REGISTERS}")
+        if self.count % width:
+            raise ValueError(f"Register {self.name}: count must be a multiple of {width} for {self.data_type}")
+            
+        self.decoder = RegisterDecoder(self.data_type, self.byte_order, self.count, self.scale, self.bits)
+        if self.publish != 'raw' and (self.data_type in ('string', 'bitfield') or self.decoder.values != 1):
+            raise ValueError(f"Register {self.name}: only single numeric values can be aggregated")
+
+    @property
+    def display_address(self) -> int:
+        """User-facing 3XXXX/4XXXX address of the register"""
+        return self.address + (30001 if self.register_type == 'input' else 40001)
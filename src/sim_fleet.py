@@ -0,0 +1,172 @@
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from registers import DATA_TYPES, INTEGER_RANGES, RegisterDefinition
+from sim_server import VirtualDevice
+
+logger = logging.getLogger(__name__)
+
+# Quantities with a bounded random walk: initial range, max step per tick, lower and upper clamp
+RANDOM_WALKS = {
+    'dc_voltage': (330.0, 370.0, 5.0, 300.0, 400.0),
+    'dc_current': (6.0, 11.0, 0.5, 0.0, 15.0),
+    'ac_voltage': (230.0, 230.0, 2.0, 220.0, 240.0),
+    'ac_current': (5.0, 9.0, 0.3, 0.0, 10.0),
+    'ac_frequency': (50.0, 50.0, 0.1, 49.5, 50.5),
+    'temperature': (30.0, 40.0, 1.0, 20.0, 60.0),
+}
+
+# Derived quantities follow the random walks in the state matrix
+QUANTITIES = tuple(RANDOM_WALKS) + ('power', 'energy', 'status')
+
+# Largest integer a float64 holds exactly, 64-bit registers are clamped to it
+_MAX_EXACT = 2.0 ** 53
+
+def quantity_for(name: str) -> Optional[str]:
+    """Simulated quantity a register serves, guessed from its name"""
+    name = name.lower()
+    if 'energy' in name:
+        return 'energy'
+    if 'temp' in name:
+        return 'temperature'
+    if 'freq' in name:
+        return 'ac_frequency'
+    if 'status' in name or 'state' in name:
+        return 'status'
+    if 'power' in name:
+        return 'power'
+    if 'volt' in name:
+        return 'dc_voltage' if 'dc' in name else 'ac_voltage'
+    if 'curr' in name:
+        return 'dc_current' if 'dc' in name else 'ac_current'
+    return None
+
+class FleetState:
+    """Simulated inverter values of a whole fleet in one (quantity, device) matrix.
+
+    A tick is a handful of vectorized operations regardless of the fleet
+    size: one random draw for all walks, one clamp, then power and energy.
+    """
+
+    def __init__(self, devices: int, update_interval: float = 5, seed: Optional[int] = None):
+        self.devices = devices
+        self.update_interval = update_interval
+        self.rng = np.random.default_rng(seed)
+        self.index = {name: row for row, name in enumerate(QUANTITIES)}
+        self.values = np.zeros((len(QUANTITIES), devices))
+
+        walks = np.array(list(RANDOM_WALKS.values()))
+        self._walks = len(RANDOM_WALKS)
+        self._steps = walks[:, 2:3]
+        self._low = walks[:, 3:4]
+        self._high = walks[:, 4:5]
+        self.values[:self._walks] = self.rng.uniform(walks[:, 0:1], walks[:, 1:2], (self._walks, devices))
+        self['energy'][:] = self.rng.uniform(5000, 20000, devices)  # Wh
+        self['status'][:] = 1  # 1=Running
+        self._update_power()
+
+    def __getitem__(self, quantity: str) -> np.ndarray:
+        return self.values[self.index[quantity]]
+
+    def _update_power(self) -> None:
+        np.multiply(self['ac_voltage'], self['ac_current'], out=self['power'])
+
+    def step(self) -> None:
+        walks = self.values[:self._walks]
+        walks += self.rng.uniform(-1.0, 1.0, walks.shape) * self._steps
+        np.clip(walks, self._low, self._high, out=walks)
+        self._update_power()
+        self['energy'][:] += self['power'] * (self.update_interval / 3600)
+
+class BulkEncoder:
+    """Encodes one register for every device at once into register words"""
+
+    def __init__(self, reg: RegisterDefinition):
+        self.reg = reg
+        code, width = DATA_TYPES[reg.data_type]
+        self.width = width
+        self.repeat = reg.decoder.values
+        self.little = reg.byte_order == 'little' and width > 1
+        self.dtype = np.dtype('>' + code) if reg.data_type not in ('string', 'bitfield') else None
+        self.range = None
+        if code in INTEGER_RANGES and self.dtype is not None:
+            low, high = INTEGER_RANGES[code]
+            self.range = (max(low, -_MAX_EXACT), min(high, _MAX_EXACT))
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        """(devices, count) big-endian words of the register for a value per device"""
+        reg = self.reg
+        if reg.data_type == 'string':
+            return np.array([reg.decoder.encode(value) for value in values], dtype='>u2').reshape(
+                len(values), reg.count)
+        if reg.data_type == 'bitfield':
+            bits = np.asarray(values).astype(np.uint64)
+            words = np.stack([(bits >> np.uint64(16 * index)) & np.uint64(0xFFFF)
+                              for index in reversed(range(reg.count))], axis=1).astype('>u2')
+            return words[:, ::-1] if reg.byte_order == 'little' else words
+
+        raw = values / reg.scale if reg.scale != 1 else values
+        if self.range is not None:
+            raw = np.clip(np.rint(raw), *self.range)
+        words = raw.astype(self.dtype).view('>u2').reshape(len(values), self.width)
+        if self.little:
+            words = words[:, ::-1]
+        if self.repeat > 1:
+            words = np.tile(words, (1, self.repeat))
+        return words
+
+class FleetImage:
+    """Register tables of all devices, one (devices, size) word matrix per table.
+
+    Every ``VirtualDevice`` gets views onto its own rows, so the server
+    answers requests straight from the matrices that ``write`` fills in bulk.
+    """
+
+    def __init__(self, unit_ids: List[int], size: int):
+        devices = len(unit_ids)
+        self._raw = {table: np.zeros((devices, 2 * size), dtype=np.uint8)
+                     for table in ('holding', 'input')}
+        self.words = {table: raw.view('>u2') for table, raw in self._raw.items()}
+        self.devices = [
+            VirtualDevice(unit_id, size, {table: memoryview(raw[row]) for table, raw in self._raw.items()})
+            for row, unit_id in enumerate(unit_ids)
+        ]
+
+    def write(self, register_type: str, address: int, words: np.ndarray) -> None:
+        self.words[register_type][:, address:address + words.shape[1]] = words
+
+class FleetModel:
+    """Simulated fleet: vectorized state encoded into the register image of every device"""
+
+    def __init__(self, registers: List[RegisterDefinition], unit_ids: List[int],
+                 update_interval: float = 5, seed: Optional[int] = None):
+        size = max((reg.address + reg.count for reg in registers), default=1000)
+        self.state = FleetState(len(unit_ids), update_interval, seed)
+        self.image = FleetImage(unit_ids, size)
+        self.points = [(reg, quantity_for(reg.name), BulkEncoder(reg)) for reg in registers]
+        self._zeros = np.zeros(len(unit_ids))
+        self._constants: Dict[str, np.ndarray] = {}
+
+    @property
+    def devices(self) -> List[VirtualDevice]:
+        return self.image.devices
+
+    def _constant(self, reg: RegisterDefinition) -> np.ndarray:
+        """Words of a string register, encoded once since they never change"""
+        words = self._constants.get(reg.name)
+        if words is None:
+            values = [f"SIM{device.unit_id:05d}" for device in self.devices]
+            words = self._constants[reg.name] = BulkEncoder(reg).encode(values)
+        return words
+
+    def update(self) -> None:
+        """Advance the simulation one tick and encode every register"""
+        self.state.step()
+        for reg, quantity, encoder in self.points:
+            if reg.data_type == 'string':
+                words = self._constant(reg)
+            else:
+                words = encoder.encode(self.state[quantity] if quantity else self._zeros)
+            self.image.write(reg.register_type, reg.address, words)
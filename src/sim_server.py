@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import random
+import socket
+import struct
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from modbus_pipeline import (GATEWAY_TARGET_FAILED, ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE, ILLEGAL_FUNCTION,
+                             MBAP_HEADER, MEI_DEVICE_ID, READ_DEVICE_ID)
+
+logger = logging.getLogger(__name__)
+
+READ_FUNCTION_CODES = {3: 'holding', 4: 'input'}
+
+DELAY_DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'exponential')
+
+@dataclass
+class ExceptionRange:
+    """Answer requests touching an address range with a Modbus exception code.
+
+    Addresses follow the bridge config: 30001+ are input registers, 40001+
+    holding registers and smaller values 0-based addresses in both tables.
+    """
+    start: int
+    end: int
+    code: int = ILLEGAL_DATA_ADDRESS
+    rate: float = 1.0  # probability that a matching request fails
+    register_type: str = field(default='', init=False)
+
+    def __post_init__(self):
+        for base, register_type in ((40001, 'holding'), (30001, 'input')):
+            if self.start >= base:
+                self.register_type = register_type
+                self.start -= base
+                self.end -= base
+                break
+
+    def matches(self, register_type: str, address: int, count: int) -> bool:
+        if self.register_type and self.register_type != register_type:
+            return False
+        return address <= self.end and address + count - 1 >= self.start
+
+@dataclass
+class FaultProfile:
+    """Network and device misbehaviour injected by the simulator server.
+
+    ``delay_ms`` and ``jitter_ms`` shape the response delay distribution:
+
+    - ``fixed``: always ``delay_ms``
+    - ``uniform``: between ``delay_ms`` and ``delay_ms + jitter_ms``
+    - ``normal``: mean ``delay_ms`` and standard deviation ``jitter_ms``
+    - ``exponential``: ``delay_ms`` plus a long tail with mean ``jitter_ms``
+
+    Requests on a connection are answered in order, so a delayed response
+    also holds back the ones queued behind it, as on a serial gateway.
+    ``latency_ms`` instead models the round trip of a slow link (VPN,
+    cellular): every answer is delayed by it, but requests sent back to back
+    are all in flight at the same time.
+    ``accept_delay_ms`` emulates a slow accept: the connection is
+    established but nothing is answered until the delay has passed.
+    """
+    delay_ms: float = 0.0
+    jitter_ms: float = 0.0
+    distribution: str = 'fixed'
+    drop_rate: float = 0.0  # probability that a request is never answered
+    reset_rate: float = 0.0  # probability that a request resets the connection
+    accept_delay_ms: float = 0.0
+    latency_ms: float = 0.0
+    exceptions: List[ExceptionRange] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.distribution not in DELAY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown delay distribution '{self.distribution}'")
+        self.exceptions = [item if isinstance(item, ExceptionRange) else ExceptionRange(**item)
+                           for item in self.exceptions]
+
+    def delay(self, rng: random.Random) -> float:
+        """Response delay in seconds"""
+        if self.distribution == 'uniform':
+            delay = self.delay_ms + rng.uniform(0, self.jitter_ms)
+        elif self.distribution == 'normal':
+            delay = rng.gauss(self.delay_ms, self.jitter_ms)
+        elif self.distribution == 'exponential':
+            delay = self.delay_ms + (rng.expovariate(1.0 / self.jitter_ms) if self.jitter_ms else 0.0)
+        else:
+            delay = self.delay_ms
+        return max(0.0, delay) / 1000.0
+
+    def exception_for(self, rng: random.Random, register_type: str,
+                      address: int, count: int) -> Optional[int]:
+        for item in self.exceptions:
+            if item.matches(register_type, address, count) and rng.random() < item.rate:
+                return item.code
+        return None
+
+def load_fault_profiles(data: Dict[str, Any]) -> Dict[Tuple[int, Optional[int]], FaultProfile]:
+    """Fault profiles keyed by (port, unit id) from a parsed fault config.
+
+    The ``default`` profile is stored under (0, None) and applies to every
+    device without a profile of its own. Entries of ``devices`` name a
+    ``port`` and optionally a ``unit_id``; without a unit id the profile
+    covers every device on that port.
+    """
+    profiles: Dict[Tuple[int, Optional[int]], FaultProfile] = {}
+    if data.get('default'):
+        profiles[(0, None)] = FaultProfile(**data['default'])
+    for entry in data.get('devices', []):
+        entry = dict(entry)
+        key = (int(entry.pop('port', 0)), entry.pop('unit_id', None))
+        profiles[key] = FaultProfile(**entry)
+    return profiles
+
+class VirtualDevice:
+    """Register image of one simulated Modbus device.
+
+    Both register tables are kept as big-endian byte buffers, exactly as the
+    words travel on the wire, so a read request is answered with a single
+    slice. The buffers may be views onto a fleet-wide matrix that is
+    updated in bulk, see ``sim_fleet.FleetImage``.
+    """
+
+    def __init__(self, unit_id: int, size: int = 1000, tables: Optional[Dict[str, memoryview]] = None):
+        self.unit_id = unit_id
+        self.size = size
+        # Writable byte buffers of 2 * size bytes, e.g. rows of a fleet-wide matrix
+        self.tables = tables or {'holding': bytearray(2 * size), 'input': bytearray(2 * size)}
+        # Basic device identification objects: vendor, product code, revision
+        self.identification = {0: 'Simulator', 1: 'SIM-INV', 2: '1.0'}
+
+    def write(self, register_type: str, address: int, words: List[int]) -> None:
+        """Store register words starting at a 0-based protocol address"""
+        start = 2 * address
+        self.tables[register_type][start:start + 2 * len(words)] = struct.pack(f'>{len(words)}H', *words)
+
+    def read(self, register_type: str, address: int, count: int) -> Optional[bytes]:
+        """Raw bytes of ``count`` registers, or None when outside the image"""
+        if address + count > self.size:
+            return None
+        return bytes(self.tables[register_type][2 * address:2 * (address + count)])
+
+def exception_response(function_code: int, code: int) -> bytes:
+    return bytes((function_code | 0x80, code))
+
+class SimulatorServer:
+    """Minimal asyncio Modbus TCP server for many virtual devices.
+
+    Devices are addressed by listening port and unit id, so one process can
+    serve a whole fleet on a single port (a gateway with many unit ids), on
+    many ports, or both. Read holding/input registers (3, 4), write
+    single/multiple registers (6, 16) and the basic device identification
+    (43/14) are supported. Requests for an unknown unit id get a gateway
+    target failed exception, like a real gateway.
+    """
+
+    def __init__(self, host: str = '0.0.0.0', seed: Optional[int] = None):
+        self.host = host
+        self.devices: Dict[int, Dict[int, VirtualDevice]] = {}  # port -> unit id -> device
+        self.faults: Dict[Tuple[int, Optional[int]], FaultProfile] = {}
+        self.stats = Counter()  # injected faults by kind
+        self._rng = random.Random(seed)
+        self._servers: List[asyncio.AbstractServer] = []
+
+    def add_device(self, port: int, device: VirtualDevice) -> None:
+        self.devices.setdefault(port, {})[device.unit_id] = device
+
+    def set_faults(self, profiles: Dict[Tuple[int, Optional[int]], FaultProfile]) -> None:
+        """Install fault profiles keyed by (port, unit id), see ``load_fault_profiles``"""
+        self.faults = dict(profiles)
+
+    def _profile(self, port: int, unit_id: Optional[int]) -> Optional[FaultProfile]:
+        faults = self.faults
+        if not faults:
+            return None
+        return faults.get((port, unit_id)) or faults.get((port, None)) or faults.get((0, None))
+
+    async def start(self) -> None:
+        for port, devices in self.devices.items():
+            server = await asyncio.start_server(
+                lambda reader, writer, port=port: self._serve_connection(port, reader, writer),
+                self.host, port
+            )
+            self._servers.append(server)
+            logger.info("Serving %d virtual device(s) on %s:%d", len(devices), self.host, port)
+
+    async def stop(self) -> None:
+        for server in self._servers:
+            server.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    async def _serve_connection(self, port: int, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        devices = self.devices[port]
+        port_profile = self._profile(port, None)
+        try:
+            if port_profile and port_profile.accept_delay_ms:
+                self.stats['slow_accept'] += 1
+                await asyncio.sleep(port_profile.accept_delay_ms / 1000.0)
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack(header)
+                if length < 2:
+                    break
+                pdu = await reader.readexactly(length - 1)
+
+                profile = self._profile(port, unit_id)
+                if profile is None:
+                    response = self.process(devices.get(unit_id), pdu)
+                else:
+                    response = await self._process_faulty(profile, devices.get(unit_id), pdu, writer)
+                    if response is None:
+                        if writer.is_closing():
+                            return
+                        continue
+                frame = MBAP_HEADER.pack(transaction_id, protocol_id, len(response) + 1, unit_id) + response
+                if profile is not None and profile.latency_ms:
+                    # Link latency delays the answer without holding back the next request
+                    asyncio.get_running_loop().call_later(profile.latency_ms / 1000.0, self._send, writer, frame)
+                    continue
+                writer.write(frame)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutdown while waiting for a request or a delayed response
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, frame: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(frame)
+
+    async def _process_faulty(self, profile: FaultProfile, device: Optional[VirtualDevice],
+                              pdu: bytes, writer: asyncio.StreamWriter) -> Optional[bytes]:
+        """Answer a request under a fault profile, None when no response is sent"""
+        rng = self._rng
+        if profile.reset_rate and rng.random() < profile.reset_rate:
+            self.stats['reset'] += 1
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                # Zero linger turns the close into a TCP reset
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            writer.transport.abort()
+            return None
+        if profile.drop_rate and rng.random() < profile.drop_rate:
+            self.stats['drop'] += 1
+            return None
+
+        delay = profile.delay(rng)
+        if delay:
+            await asyncio.sleep(delay)
+
+        function_code = pdu[0]
+        if device is not None and profile.exceptions and function_code in READ_FUNCTION_CODES \
+                and len(pdu) >= 5:
+            address, count = struct.unpack_from('>HH', pdu, 1)
+            code = profile.exception_for(rng, READ_FUNCTION_CODES[function_code], address, count)
+            if code is not None:
+                self.stats[f'exception_{code}'] += 1
+                return exception_response(function_code, code)
+        return self.process(device, pdu)
+
+    def process(self, device: Optional[VirtualDevice], pdu: bytes) -> bytes:
+        """Answer one request PDU for a device"""
+        function_code = pdu[0]
+        if device is None:
+            return exception_response(function_code, GATEWAY_TARGET_FAILED)
+
+        if function_code in READ_FUNCTION_CODES:
+            if len(pdu) < 5:
+                return exception_response(function_code, ILLEGAL_DATA_VALUE)
+            address, count = struct.unpack_from('>HH', pdu, 1)
+            if not 1 <= count <= 125:
+                return exception_response(function_code, ILLEGAL_DATA_VALUE)
+            data = device.read(READ_FUNCTION_CODES[function_code], address, count)
+            if data is None:
+                return exception_response(function_code, ILLEGAL_DATA_ADDRESS)
+            return bytes((function_code, 2 * count)) + data
+
+        if function_code == 6:
+            address, value = struct.unpack_from('>HH', pdu, 1)
+            if address >= device.size:
+                return exception_response(function_code, ILLEGAL_DATA_ADDRESS)
+            device.write('holding', address, [value])
+            return pdu[:5]
+
+        if function_code == 16:
+            address, count, byte_count = struct.unpack_from('>HHB', pdu, 1)
+            if not 1 <= count <= 123 or byte_count != 2 * count or len(pdu) < 6 + byte_count:
+                return exception_response(function_code, ILLEGAL_DATA_VALUE)
+            if address + count > device.size:
+                return exception_response(function_code, ILLEGAL_DATA_ADDRESS)
+            device.write('holding', address, list(struct.unpack_from(f'>{count}H', pdu, 6)))
+            return pdu[:5]
+
+        if function_code == READ_DEVICE_ID and len(pdu) >= 4 and pdu[1] == MEI_DEVICE_ID:
+            # Basic stream access (code 1) returns every object in a single response
+            objects = b''.join(bytes((object_id, len(value))) + value.encode('ascii')
+                               for object_id, value in sorted(device.identification.items()))
+            return bytes((function_code, MEI_DEVICE_ID, 1, 0x01, 0, 0, len(device.identification))) + objects
+
+        return exception_response(function_code, ILLEGAL_FUNCTION)
@@ -0,0 +1,295 @@
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Record header: payload length and CRC32 of the payload
+RECORD_HEADER = struct.Struct('>II')
+
+SEGMENT_SUFFIX = '.seg'
+ACK_FILE = 'ack'
+
+class SegmentedLog:
+    """Append-only store-and-forward log split into numbered segment files.
+
+    Every record gets a sequence number and is stored length-prefixed with a
+    CRC32 so a record torn by a power cut is detected and cut off on restart.
+    Segment files are named after the sequence number of their first record
+    and a new one is started once the active segment reaches
+    ``segment_bytes``. Appends are flushed to the OS immediately but fsynced
+    at most once per ``fsync_interval`` seconds to limit flash wear.
+
+    Consumers read records in order with ``read`` and acknowledge delivered
+    ones with ``ack``. The first unacknowledged sequence number is persisted
+    so the backlog is replayed after a restart. Fully acknowledged segments
+    are deleted, and when the log grows beyond ``max_bytes`` the oldest
+    segment is dropped even if it was not delivered.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 1024 * 1024,
+                 max_bytes: int = 64 * 1024 * 1024, fsync_interval: float = 1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, segment_bytes)
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.RLock()
+        self._segments: List[Tuple[int, str]] = []  # (first sequence number, path)
+        self._sizes = {}
+        self._writer = None
+        self._next_seq = 0
+        self._ack_seq = 0
+        self._acked = set()
+        self._ack_dirty = False
+        self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+        # Read cursor: next sequence number, segment index and byte offset
+        self._read_seq = 0
+        self._read_segment = 0
+        self._read_offset = 0
+        self._reader = None
+
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    @property
+    def pending(self) -> int:
+        """Records appended but not acknowledged yet"""
+        return self._next_seq - self._ack_seq
+
+    @property
+    def unread(self) -> int:
+        """Records appended but not handed out by ``read`` yet"""
+        return self._next_seq - self._read_seq
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    def _segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{first_seq:020d}{SEGMENT_SUFFIX}")
+
+    def _scan_segment(self, path: str, truncate: bool) -> int:
+        """Count the valid records of a segment, cutting off a torn tail"""
+        count = 0
+        offset = 0
+        with open(path, 'rb') as f:
+            data = f.read()
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + length
+            if end > len(data) or zlib.crc32(data[offset + RECORD_HEADER.size:end]) != crc:
+                break
+            offset = end
+            count += 1
+        if offset < len(data):
+            logger.warning("Discarding %d bytes of torn records at the end of %s",
+                           len(data) - offset, path)
+            if truncate:
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+        return count
+
+    def _recover(self) -> None:
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            self._segments.append((int(name[:-len(SEGMENT_SUFFIX)]), path))
+
+        if self._segments:
+            first_seq, last_path = self._segments[-1]
+            self._next_seq = first_seq + self._scan_segment(last_path, truncate=True)
+            for _, path in self._segments:
+                self._sizes[path] = os.path.getsize(path)
+            self._ack_seq = self._segments[0][0]
+
+        try:
+            with open(os.path.join(self.directory, ACK_FILE), 'r') as f:
+                self._ack_seq = max(self._ack_seq, min(int(f.read().strip() or 0), self._next_seq))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning("Ignoring corrupt ack file in %s", self.directory)
+
+        self._seek(self._ack_seq)
+        self._delete_acked_segments()
+        if self.pending:
+            logger.info("Store-and-forward log holds %d undelivered records", self.pending)
+
+    def _seek(self, seq: int) -> None:
+        """Position the read cursor on sequence number ``seq``"""
+        self._close_reader()
+        self._read_seq = seq
+        self._read_segment = 0
+        self._read_offset = 0
+        for index, (first_seq, _) in enumerate(self._segments):
+            if first_seq <= seq:
+                self._read_segment = index
+        if not self._segments:
+            return
+
+        first_seq, path = self._segments[self._read_segment]
+        with open(path, 'rb') as f:
+            for _ in range(seq - first_seq):
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, _ = RECORD_HEADER.unpack(header)
+                f.seek(length, os.SEEK_CUR)
+            self._read_offset = f.tell()
+
+    def _close_reader(self) -> None:
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def append(self, payload: bytes) -> int:
+        """Append a record and return its sequence number"""
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                self._rotate()
+
+            record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+            self._writer.write(record)
+            self._writer.flush()
+            self._sizes[self._writer.name] = self._writer.tell()
+            self._unsynced = True
+
+            seq = self._next_seq
+            self._next_seq += 1
+
+            if self.size > self.max_bytes:
+                self._drop_oldest_segment()
+            self.sync(force=False)
+            return seq
+
+    def _rotate(self) -> None:
+        """Close the active segment and start a new one at the next sequence number"""
+        if self._writer is not None:
+            self._fsync_writer()
+            self._writer.close()
+            self._writer = None
+
+        if self._segments and self._sizes.get(self._segments[-1][1], 0) < self.segment_bytes:
+            # Keep appending to the last segment left over from a previous run
+            path = self._segments[-1][1]
+        else:
+            path = self._segment_path(self._next_seq)
+            self._segments.append((self._next_seq, path))
+        self._writer = open(path, 'ab')
+        self._sizes[path] = self._writer.tell()
+
+    def _drop_oldest_segment(self) -> None:
+        if len(self._segments) < 2:
+            return
+        first_seq, path = self._segments.pop(0)
+        next_first = self._segments[0][0]
+        lost = max(0, next_first - max(first_seq, self._ack_seq))
+        self.dropped += lost
+        logger.warning("Store-and-forward log over %d bytes, dropped %d undelivered records",
+                       self.max_bytes, lost)
+        self._remove(path)
+
+        self._acked = {seq for seq in self._acked if seq >= next_first}
+        if self._ack_seq < next_first:
+            self._ack_seq = next_first
+            self._ack_dirty = True
+        if self._read_seq < next_first:
+            self._seek(next_first)
+        else:
+            self._read_segment -= 1
+
+    def _remove(self, path: str) -> None:
+        self._sizes.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error("Failed to remove segment %s: %s", path, e)
+
+    def read(self, limit: int) -> List[Tuple[int, bytes]]:
+        """Return up to ``limit`` records after the read cursor and advance it"""
+        records = []
+        with self._lock:
+            while len(records) < limit and self._read_seq < self._next_seq:
+                if self._reader is None:
+                    self._reader = open(self._segments[self._read_segment][1], 'rb')
+                    self._reader.seek(self._read_offset)
+
+                header = self._reader.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    # End of this segment, continue with the next one
+                    self._close_reader()
+                    if self._read_segment + 1 >= len(self._segments):
+                        break
+                    self._read_segment += 1
+                    self._read_offset = 0
+                    continue
+
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = self._reader.read(length)
+                self._read_offset = self._reader.tell()
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    logger.error("Corrupt record %d in store-and-forward log, skipping", self._read_seq)
+                else:
+                    records.append((self._read_seq, payload))
+                self._read_seq += 1
+        return records
+
+    def ack(self, seq: int) -> None:
+        """Mark a record as delivered; the ack cursor advances over contiguous acks"""
+        with self._lock:
+            if seq < self._ack_seq:
+                return
+            self._acked.add(seq)
+            while self._ack_seq in self._acked:
+                self._acked.discard(self._ack_seq)
+                self._ack_seq += 1
+                self._ack_dirty = True
+            self._delete_acked_segments()
+
+    def _delete_acked_segments(self) -> None:
+        # A segment can go once the next one starts at or before the ack cursor
+        while len(self._segments) > 1 and self._segments[1][0] <= self._ack_seq \
+                and self._read_segment > 0:
+            _, path = self._segments.pop(0)
+            self._read_segment -= 1
+            self._remove(path)
+
+    def _fsync_writer(self) -> None:
+        if self._writer is not None and self._unsynced:
+            os.fsync(self._writer.fileno())
+            self._unsynced = False
+
+    def sync(self, force: bool = True) -> None:
+        """fsync pending appends and persist the ack cursor, batched by fsync_interval"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_fsync < self.fsync_interval:
+                return
+            self._last_fsync = now
+            self._fsync_writer()
+
+            if self._ack_dirty:
+                path = os.path.join(self.directory, ACK_FILE)
+                with open(path + '.tmp', 'w') as f:
+                    f.write(str(self._ack_seq))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + '.tmp', path)
+                self._ack_dirty = False
+
+    def close(self) -> None:
+        with self._lock:
+            self.sync()
+            self._close_reader()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
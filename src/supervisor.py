@@ -0,0 +1,272 @@
+import hashlib
+import logging
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from commands import WriteCommand
+from metrics import AggregatedMetrics, MetricsServer
+from modbus_mqtt_bridge import AppConfig, DeviceConfig, ModbusMQTTBridge, configure_logging, startup
+from payload_codec import CompactEncoder
+
+logger = logging.getLogger(__name__)
+
+def _rendezvous_weight(worker: int, key: str) -> int:
+    digest = hashlib.blake2b(f"{worker}/{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def shard_devices(devices: List[DeviceConfig], workers: Iterable[int]) -> Dict[int, List[str]]:
+    """Device names polled by each worker, by rendezvous hashing of the device endpoints.
+    
+    A device goes to the worker with the highest hash of its host and port,
+    so units behind one gateway always share a worker and its connection.
+    When a worker is removed only its own devices move, spread over the
+    others, and they move back once it returns.
+    """
+    workers = sorted(workers)
+    shards: Dict[int, List[str]] = {worker: [] for worker in workers}
+    if not workers:
+        return shards
+    for device in devices:
+        key = f"{device.host}:{device.port}"
+        shards[max(workers, key=lambda worker: _rendezvous_weight(worker, key))].append(device.name)
+    return shards
+
+# Families only the supervisor's publisher maintains
+SUPERVISOR_METRICS = {
+    'bridge_publish_queue_depth', 'bridge_mqtt_inflight_messages', 'bridge_store_pending_records',
+    'bridge_messages_published_total', 'bridge_messages_dropped_total',
+    'bridge_workers_alive', 'bridge_worker_restarts_total',
+}
+WORKER_METRICS_INTERVAL = 5.0  # seconds between metrics snapshots sent to the supervisor
+WORKER_RESTART_MAX_DELAY = 300.0  # seconds, longest wait before restarting a crash-looping worker
+WORKER_STABLE_SECONDS = 60.0  # a worker that ran this long is restarted without backoff
+
+def _run_worker(index: int, config: AppConfig, conn) -> None:
+    """Entry point of a worker process"""
+    configure_logging(config, '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s')
+    # Only workers poll, so only they load the fleet poller and pymodbus
+    from fleet import ShardWorker
+    ShardWorker(config, index, conn).run()
+
+@dataclass
+class WorkerProcess:
+    """A worker process as seen by the supervisor"""
+    index: int
+    process: Optional['multiprocessing.process.BaseProcess'] = None
+    conn: Any = None
+    devices: List[str] = field(default_factory=list)
+    started: float = 0.0  # monotonic start time
+    restart_delay: float = 0.0  # doubles while the worker keeps dying soon after starting
+    restart_at: float = 0.0  # monotonic time to restart a dead worker
+
+    @property
+    def alive(self) -> bool:
+        return self.conn is not None
+
+class SupervisorBridge(ModbusMQTTBridge):
+    """Fleet mode spread over several worker processes.
+    
+    One asyncio process tops out at a single core once decoding and
+    serialization dominate. The supervisor shards the devices over
+    ``workers`` processes with ``shard_devices``, each running a
+    ``ShardWorker``, and publishes what they send back over their pipes
+    through its single MQTT connection and store-and-forward log. A worker
+    that dies has its devices moved to the remaining ones at once and is
+    restarted after ``worker_restart_delay``, after which its devices move
+    back; a worker that keeps dying right after starting is restarted with
+    a doubling delay. The metrics endpoint serves the supervisor's own metrics merged
+    with the latest snapshot of every worker, labelled by worker. Write
+    commands are validated by the supervisor and forwarded to the worker
+    polling their device.
+    """
+    
+    def __init__(self, config: AppConfig, config_file: Optional[str] = None):
+        super().__init__(config, config_file)
+        import multiprocessing
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [WorkerProcess(index) for index in range(config.workers)]
+        self._aggregated_metrics = AggregatedMetrics(self._metrics)
+        self._metrics.workers_alive.set_function(lambda: sum(worker.alive for worker in self._workers))
+        # Commands are forwarded from the MQTT network thread
+        self._conn_lock = threading.Lock()
+        
+    def _start_metrics_server(self) -> None:
+        if not self.config.metrics_port:
+            return
+        try:
+            self._metrics_server = MetricsServer(self._aggregated_metrics, self.config.metrics_host,
+                                                 self.config.metrics_port)
+            self._metrics_server.start()
+        except OSError as e:
+            logger.error("Failed to start metrics endpoint on port %d: %s", self.config.metrics_port, e)
+            self._metrics_server = None
+            
+    def _start_worker(self, worker: WorkerProcess) -> None:
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_run_worker, args=(worker.index, self.config, child_conn),
+                                        name=f"worker-{worker.index}", daemon=True)
+        process.start()
+        # Only the worker holds its end, so its death shows up as end of file here
+        child_conn.close()
+        worker.process, worker.conn, worker.devices = process, conn, []
+        worker.started = time.monotonic()
+        logger.info("Started worker %d (pid %d)", worker.index, process.pid)
+        
+    def _send_to(self, worker: WorkerProcess, message: tuple) -> bool:
+        with self._conn_lock:
+            if worker.conn is None:
+                return False
+            try:
+                worker.conn.send(message)
+                return True
+            except OSError:
+                return False  # its end of file is handled by _receive
+                
+    def _dispatch_command(self, command: WriteCommand) -> None:
+        for worker in self._workers:
+            if command.device in worker.devices and self._send_to(worker, ('write', command)):
+                return
+        self._finish_command(command, "device is not polled")
+        
+    def _apply_config(self, config: AppConfig) -> None:
+        """Switch to a reloaded config and hand it to the workers, which apply it device by device"""
+        self.config = config
+        self._writable = self._writable_registers(config)
+        self._publish_schemas()
+        for worker in self._workers:
+            self._send_to(worker, ('config', config))
+        self._rebalance()
+        logger.info("Config reloaded: %d devices", len(config.devices))
+        
+    def _worker_died(self, worker: WorkerProcess) -> None:
+        with self._conn_lock:
+            worker.conn.close()
+            worker.conn = None
+        worker.process.join(timeout=1.0)
+        self._aggregated_metrics.remove(str(worker.index))
+        if not self._running:
+            return
+        now = time.monotonic()
+        if worker.restart_delay and now - worker.started < WORKER_STABLE_SECONDS:
+            worker.restart_delay = min(worker.restart_delay * 2, WORKER_RESTART_MAX_DELAY)
+        else:
+            worker.restart_delay = self.config.worker_restart_delay
+        worker.restart_at = now + worker.restart_delay
+        logger.error("Worker %d died (exit code %s) while polling %d devices, restarting it in %.0fs",
+                     worker.index, worker.process.exitcode, len(worker.devices), worker.restart_delay)
+        self._rebalance()
+        
+    def _rebalance(self) -> None:
+        """Send every live worker its share of the devices"""
+        alive = [worker for worker in self._workers if worker.alive]
+        if not alive:
+            logger.error("No worker alive, %d devices are not polled", len(self.config.devices))
+            return
+        shards = shard_devices(self.config.devices, [worker.index for worker in alive])
+        for worker in alive:
+            devices = shards[worker.index]
+            if devices != worker.devices:
+                worker.devices = devices
+                self._send_to(worker, ('assign', devices))
+                    
+    def _restart_workers(self) -> None:
+        now = time.monotonic()
+        restarted = False
+        for worker in self._workers:
+            if not worker.alive and now >= worker.restart_at:
+                self._start_worker(worker)
+                self._metrics.worker_restarts.inc()
+                restarted = True
+        if restarted:
+            self._rebalance()
+            
+    def _receive(self, timeout: float) -> None:
+        """Hand the messages of all workers to the publisher, waiting up to ``timeout`` for them"""
+        from multiprocessing.connection import wait as wait_for_connections
+        workers = {worker.conn: worker for worker in self._workers if worker.alive}
+        for conn in wait_for_connections(list(workers), timeout):
+            worker = workers[conn]
+            try:
+                while conn.poll():
+                    kind, *args = conn.recv()
+                    if kind == 'publish':
+                        topic, payload = args
+                        self._submit_payload(payload, topic)
+                    elif kind == 'response':
+                        self._publish_response(args[0])
+                    elif kind == 'metrics':
+                        self._aggregated_metrics.update(str(worker.index), args[0])
+            except (EOFError, OSError):
+                self._worker_died(worker)
+                
+    def _publish_schemas(self) -> None:
+        encoders = {}
+        if self._encoder:
+            for device in self.config.devices:
+                encoder = self._encoder if device.registers is None else CompactEncoder(device.registers)
+                encoders.setdefault(encoder.schema_id, encoder)
+        for encoder in encoders.values():
+            self._publish_schema(encoder)
+            
+    def _perform_health_check(self) -> None:
+        now = time.monotonic()
+        if now - self._last_health_check < self.config.health_check_interval:
+            return
+        self._last_health_check = now
+        
+        logger.info("Health check: %d/%d workers alive, MQTT connected: %s",
+                    sum(worker.alive for worker in self._workers), len(self._workers),
+                    self._mqtt_client.is_connected())
+        for worker in self._workers:
+            if worker.alive:
+                logger.info("Worker %d (pid %d): %d devices", worker.index, worker.process.pid,
+                            len(worker.devices))
+        self._log_publisher_stats()
+        
+    def _stop_workers(self, timeout: float = 10.0) -> None:
+        """Ask the workers to stop and keep publishing what they flush until they exit"""
+        for worker in self._workers:
+            self._send_to(worker, ('stop',))
+        deadline = time.monotonic() + timeout
+        while any(worker.alive for worker in self._workers) and time.monotonic() < deadline:
+            self._receive(0.5)
+        for worker in self._workers:
+            if worker.alive:
+                logger.warning("Worker %d did not stop, terminating it", worker.index)
+                worker.process.terminate()
+                self._worker_died(worker)
+                
+    def run(self):
+        """Supervise the workers and publish their messages"""
+        self._running = True
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        self._start_metrics_server()
+        
+        try:
+            self._connect_mqtt()
+            self._publish_schemas()
+            for worker in self._workers:
+                self._start_worker(worker)
+            self._rebalance()
+            startup.mark('workers started')
+            logger.info("Polling %d devices with %d worker processes",
+                        len(self.config.devices), len(self._workers))
+            
+            while self._running:
+                self._check_connections()
+                self._perform_health_check()
+                if self._reload_due():
+                    self._reload_config()
+                self._restart_workers()
+                self._receive(1.0)
+        except Exception as e:
+            logger.exception("Unexpected error in supervisor: %s", e)
+        finally:
+            self._running = False
+            self._stop_workers()
+            self.shutdown()
@@ -0,0 +1,2 @@
+# A standalone Modbus server for manual tests, not a pytest module
+collect_ignore = ['test_modbus_server.py']
@@ -0,0 +1,153 @@
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import modbus_mqtt_bridge as bridge
+from circuit_breaker import CircuitBreaker
+from registers import RegisterDefinition
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeRng:
+    """Draws ``fraction`` of the way from the low to the high end of every range"""
+
+    def __init__(self, fraction=0.5):
+        self.fraction = fraction
+
+    def uniform(self, low, high):
+        return low + (high - low) * self.fraction
+
+def make_breaker(clock, fraction=0.5, **kwargs):
+    settings = {'failure_threshold': 3, 'backoff_initial': 2.0, 'backoff_max': 30.0, 'jitter': 0.2}
+    settings.update(kwargs)
+    return CircuitBreaker('inverter', rng=FakeRng(fraction), clock=clock, **settings)
+
+def fail_probe(breaker, clock):
+    """Wait out the backoff and fail the half-open probe, returning the new backoff"""
+    clock.now = breaker.retry_at
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_failure()
+    return breaker.retry_at - clock.now
+
+def test_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 1
+    assert breaker.retry_at == clock.now + 2.0
+
+def test_success_resets_the_failure_count():
+    breaker = make_breaker(FakeClock())
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_closed_open_half_open_closed():
+    clock = FakeClock()
+    breaker = make_breaker(clock, failure_threshold=1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 1.9
+    assert not breaker.allow()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 0.1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.retry_at is None
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    # Closed again, so the next failure does not open it before the threshold
+    assert breaker.allow()
+
+def test_failed_probe_doubles_backoff_up_to_the_cap():
+    clock = FakeClock()
+    breaker = make_breaker(clock, failure_threshold=1)
+    breaker.record_failure()
+    backoffs = [fail_probe(breaker, clock) for _ in range(6)]
+    assert backoffs == [4.0, 8.0, 16.0, 30.0, 30.0, 30.0]
+    assert breaker.opened == 1
+
+def test_success_resets_the_backoff():
+    clock = FakeClock()
+    breaker = make_breaker(clock, failure_threshold=1)
+    breaker.record_failure()
+    fail_probe(breaker, clock)
+    clock.now = breaker.retry_at
+    assert breaker.allow()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.retry_at - clock.now == 2.0
+    assert breaker.opened == 2
+
+@pytest.mark.parametrize('fraction, backoff', [(0.0, 1.6), (0.5, 2.0), (1.0, 2.4)])
+def test_jitter_spreads_backoff_within_bounds(fraction, backoff):
+    clock = FakeClock()
+    breaker = make_breaker(clock, fraction=fraction, failure_threshold=1)
+    breaker.record_failure()
+    assert breaker.retry_at - clock.now == pytest.approx(backoff)
+
+def test_jitter_applies_to_the_capped_backoff():
+    clock = FakeClock()
+    breaker = make_breaker(clock, fraction=1.0, failure_threshold=1, backoff_max=5.0)
+    breaker.record_failure()
+    assert [fail_probe(breaker, clock) for _ in range(3)] == pytest.approx([4.8, 6.0, 6.0])
+
+def test_explicit_now_overrides_the_clock():
+    clock = FakeClock()
+    breaker = make_breaker(clock, failure_threshold=1)
+    breaker.record_failure(now=50.0)
+    assert breaker.retry_at == 52.0
+    assert breaker.allow(now=52.0)
+
+def test_open_breaker_skips_io(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    config = bridge.AppConfig(
+        modbus=bridge.ModbusConfig(host='127.0.0.1', port=port, timeout=0.5),
+        mqtt=bridge.MQTTConfig(broker='127.0.0.1', backpressure='drop_oldest'),
+        registers=[RegisterDefinition('DC_Voltage', 30001)])
+    modbus_bridge = bridge.ModbusMQTTBridge(config)
+    clock = FakeClock()
+    breaker = modbus_bridge._breaker = make_breaker(clock, failure_threshold=2)
+    attempts = []
+    connect = modbus_bridge._connect_modbus
+    monkeypatch.setattr(modbus_bridge, '_connect_modbus', lambda: attempts.append(clock.now) or connect())
+
+    # Nothing listens on the port, so both cycles fail to connect and open the breaker
+    for _ in range(2):
+        assert modbus_bridge._read_registers()['data'] == {}
+    assert len(attempts) == 2
+    assert breaker.state == CircuitBreaker.OPEN
+
+    for _ in range(5):
+        clock.now += 0.3
+        assert modbus_bridge._read_registers()['data'] == {}
+    assert len(attempts) == 2
+
+    clock.now = breaker.retry_at
+    modbus_bridge._read_registers()
+    assert len(attempts) == 3
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_at - clock.now == 4.0
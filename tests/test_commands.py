@@ -0,0 +1,164 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import modbus_mqtt_bridge as bridge
+from commands import CommandError, _check_write_value, parse_write_command
+from registers import RegisterDefinition, registers_to_bytes
+
+def writable_registers():
+    registers = [
+        RegisterDefinition('power_limit', 40101, data_type='uint16', scale=0.1, writable=True,
+                           min_value=0, max_value=100),
+        RegisterDefinition('setpoint', 40103, data_type='float32', writable=True),
+        RegisterDefinition('offset', 40105, data_type='int16', writable=True),
+        RegisterDefinition('counter', 40106, data_type='uint32', writable=True),
+        RegisterDefinition('label', 40110, count=2, data_type='string', writable=True),
+        RegisterDefinition('flags', 40112, data_type='bitfield', bits={'enable': 0, 'reset': 4}, writable=True),
+        RegisterDefinition('limits', 40120, count=2, data_type='uint16', writable=True),
+    ]
+    return {register.name: register for register in registers}
+
+WRITABLE = {'inverter1': writable_registers(), 'inverter2': writable_registers()}
+
+def parse(request, writable=WRITABLE):
+    return parse_write_command(request, writable, received=1.0)
+
+def test_parses_valid_command():
+    command = parse({'id': 7, 'device': 'inverter2', 'register': 'power_limit', 'value': 42.5})
+    assert (command.device, command.register.name, command.value) == ('inverter2', 'power_limit', 42.5)
+    assert command.words == [425]
+    assert command.correlation_id == 7
+    assert command.received == 1.0
+
+def test_encoded_words_decode_to_the_value():
+    command = parse({'device': 'inverter1', 'register': 'setpoint', 'value': -12.25})
+    assert command.register.decoder.decode(registers_to_bytes(command.words)) == -12.25
+
+def test_device_may_be_left_out_with_a_single_device():
+    command = parse({'register': 'offset', 'value': -5}, {'inverter1': writable_registers()})
+    assert command.device == 'inverter1'
+    assert command.words == [0xFFFB]
+
+@pytest.mark.parametrize('request_, message', [
+    ([1, 2], 'must be a JSON object'),
+    ('power_limit', 'must be a JSON object'),
+    ({'register': 'power_limit', 'value': 1}, "unknown device None"),
+    ({'device': 'inverter9', 'register': 'power_limit', 'value': 1}, "unknown device 'inverter9'"),
+    ({'device': 'inverter1', 'register': 'DC_Voltage', 'value': 1}, "'DC_Voltage' of inverter1 is not writable"),
+    ({'device': 'inverter1', 'register': ['power_limit'], 'value': 1}, 'is not writable'),
+    ({'device': 'inverter1', 'register': 'power_limit'}, 'has no value'),
+])
+def test_rejects_malformed_or_unknown_targets(request_, message):
+    with pytest.raises(CommandError, match=message):
+        parse(request_)
+
+@pytest.mark.parametrize('value, message', [
+    (-0.1, 'below the minimum 0'),
+    (100.1, 'above the maximum 100'),
+])
+def test_min_and_max_limits(value, message):
+    register = writable_registers()['power_limit']
+    with pytest.raises(CommandError, match=message):
+        _check_write_value(register, value)
+    _check_write_value(register, 0)
+    _check_write_value(register, 100)
+
+@pytest.mark.parametrize('name, value', [
+    ('offset', 32768),
+    ('offset', -32769),
+    ('counter', -1),
+    ('counter', 2 ** 32),
+    ('flags', 1 << 16),
+    ('flags', -1),
+])
+def test_values_outside_the_type_range_are_rejected(name, value):
+    with pytest.raises(CommandError, match='out of range'):
+        _check_write_value(writable_registers()[name], value)
+
+def test_type_range_applies_to_the_scaled_value():
+    # 6553.5 / 0.1 is the largest uint16, without the max_value limit
+    register = RegisterDefinition('limit', 40101, data_type='uint16', scale=0.1, writable=True)
+    _check_write_value(register, 6553.5)
+    with pytest.raises(CommandError, match='out of range'):
+        _check_write_value(register, 6553.6)
+
+@pytest.mark.parametrize('value', ['50', None, True, ['1'], {'value': 1}, float('nan')])
+def test_numbers_are_required(value):
+    with pytest.raises(CommandError):
+        _check_write_value(writable_registers()['offset'], value)
+
+def test_arrays_need_one_value_per_element():
+    register = writable_registers()['limits']
+    _check_write_value(register, [1, 2])
+    with pytest.raises(CommandError, match='expects 2 value'):
+        _check_write_value(register, [1])
+    with pytest.raises(CommandError, match='expects 2 value'):
+        _check_write_value(register, 1)
+
+def test_strings_and_bitfields():
+    registers = writable_registers()
+    _check_write_value(registers['label'], 'ABCD')
+    with pytest.raises(CommandError, match='at most 4 characters'):
+        _check_write_value(registers['label'], 'ABCDE')
+    with pytest.raises(CommandError, match='expects a string'):
+        _check_write_value(registers['label'], 12)
+    assert parse({'device': 'inverter1', 'register': 'flags', 'value': {'reset': True}}).words == [0x0010]
+    with pytest.raises(CommandError, match='has no flags fault'):
+        _check_write_value(registers['flags'], {'fault': True})
+
+class FakePublisher:
+    def __init__(self):
+        self.urgent = []
+
+    def submit_urgent(self, message):
+        self.urgent.append(message)
+        return True
+
+@pytest.fixture
+def command_bridge(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = bridge.AppConfig(
+        modbus=bridge.ModbusConfig(host='127.0.0.1', port=1),
+        mqtt=bridge.MQTTConfig(broker='127.0.0.1', topic='inverter', command_topic='inverter/cmd'),
+        registers=[RegisterDefinition('DC_Voltage', 40001)] + list(writable_registers().values()))
+    modbus_bridge = bridge.ModbusMQTTBridge(config)
+    modbus_bridge._publisher = FakePublisher()
+    return modbus_bridge
+
+def send(modbus_bridge, payload):
+    modbus_bridge._on_mqtt_command(None, None, SimpleNamespace(payload=payload))
+    return [json.loads(message.payload) for message in modbus_bridge._publisher.urgent]
+
+def test_malformed_json_is_rejected_with_a_reply(command_bridge):
+    replies = send(command_bridge, b'{"register": ')
+    assert len(replies) == 1
+    assert replies[0]['status'] == 'rejected'
+    assert replies[0]['error'].startswith('invalid JSON')
+    assert command_bridge._publisher.urgent[0].topic == 'inverter/cmd/response'
+    assert not command_bridge._commands
+
+def test_invalid_command_reply_echoes_the_request(command_bridge):
+    replies = send(command_bridge, json.dumps({'id': 'abc', 'register': 'power_limit', 'value': 150}).encode())
+    assert replies == [{
+        'id': 'abc', 'device': None, 'register': 'power_limit', 'value': 150, 'status': 'rejected',
+        'latency_ms': replies[0]['latency_ms'], 'error': '150 is above the maximum 100 of power_limit'}]
+    assert not command_bridge._commands
+
+def test_only_registers_marked_writable_are_whitelisted(command_bridge):
+    assert sorted(command_bridge._writable[command_bridge._device_name]) == sorted(writable_registers())
+    replies = send(command_bridge, json.dumps({'register': 'DC_Voltage', 'value': 1}).encode())
+    assert replies[0]['status'] == 'rejected'
+    assert replies[0]['error'].endswith('is not writable')
+    assert not command_bridge._commands
+
+def test_valid_command_is_queued_for_the_poll_loop(command_bridge):
+    assert send(command_bridge, json.dumps({'id': 1, 'register': 'power_limit', 'value': 50}).encode()) == []
+    command = command_bridge._commands[0]
+    assert (command.register.name, command.words) == ('power_limit', [500])
+    assert command_bridge._wakeup.is_set()
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import modbus_mqtt_bridge as bridge
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'getuid'), reason='the config cache needs user ids')
+
+CONFIG = """\
+modbus:
+  host: 127.0.0.1
+  port: 5020
+mqtt:
+  broker: 127.0.0.1
+  topic: inverter/test
+loop_interval: 2
+registers:
+  - name: DC_Voltage
+    address: 30001
+    data_type: uint16
+    scale: 0.1
+    unit: V
+  - name: Total_Energy
+    address: 30010
+    data_type: uint32
+    unit: kWh
+"""
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG)
+    return str(path)
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+def cache_files(cache_dir):
+    return [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+
+def fail_yaml(monkeypatch):
+    """Make any YAML parse fail, so only a cache hit can load a config"""
+    import yaml
+
+    def safe_load(source):
+        raise AssertionError("YAML was parsed")
+    monkeypatch.setattr(yaml, 'safe_load', safe_load)
+
+def test_cache_hit_gives_equal_config_without_parsing(config_file, cache_dir, monkeypatch):
+    parsed = bridge.read_config(config_file, cache_dir=cache_dir)
+    assert len(cache_files(cache_dir)) == 1
+    fail_yaml(monkeypatch)
+    cached = bridge.read_config(config_file, cache_dir=cache_dir)
+    assert cached.modbus == parsed.modbus
+    assert cached.mqtt == parsed.mqtt
+    assert cached.loop_interval == parsed.loop_interval
+    assert [register.name for register in cached.registers] == ['DC_Voltage', 'Total_Energy']
+    assert cached.registers[1].count == 2
+
+def test_edited_file_is_parsed_again(config_file, cache_dir):
+    bridge.read_config(config_file, cache_dir=cache_dir)
+    with open(config_file, 'a') as f:
+        f.write("reconnect_interval: 7\n")
+    assert bridge.read_config(config_file, cache_dir=cache_dir).reconnect_interval == 7
+    # The entry of the edited file replaces the old one
+    assert len(cache_files(cache_dir)) == 1
+
+def test_cache_version_is_part_of_the_key(config_file, cache_dir, monkeypatch):
+    bridge.read_config(config_file, cache_dir=cache_dir)
+    monkeypatch.setattr(bridge, 'CONFIG_CACHE_VERSION', bridge.CONFIG_CACHE_VERSION + 1)
+    path = cache_files(cache_dir)[0]
+    with open(path) as f:
+        old_key = json.load(f)['key']
+    bridge.read_config(config_file, cache_dir=cache_dir)
+    with open(path) as f:
+        assert json.load(f)['key'] != old_key
+
+@pytest.mark.parametrize('target', ['file', 'directory'])
+def test_cache_writable_by_others_is_ignored(config_file, cache_dir, monkeypatch, caplog, target):
+    bridge.read_config(config_file, cache_dir=cache_dir)
+    path = cache_files(cache_dir)[0] if target == 'file' else cache_dir
+    os.chmod(path, os.stat(path).st_mode | 0o020)
+    import yaml
+    calls = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load', lambda source: calls.append(source) or safe_load(source))
+    with caplog.at_level(logging.WARNING, logger=bridge.logger.name):
+        assert bridge.read_config(config_file, cache_dir=cache_dir).loop_interval == 2
+    assert len(calls) == 1
+    assert "writable by other users" in caplog.text
+
+def test_symlinked_cache_entry_is_ignored(config_file, cache_dir, tmp_path, monkeypatch):
+    bridge.read_config(config_file, cache_dir=cache_dir)
+    path = cache_files(cache_dir)[0]
+    os.rename(path, str(tmp_path / 'elsewhere.json'))
+    os.symlink(str(tmp_path / 'elsewhere.json'), path)
+    import yaml
+    calls = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load', lambda source: calls.append(source) or safe_load(source))
+    bridge.read_config(config_file, cache_dir=cache_dir)
+    assert len(calls) == 1
+
+@pytest.mark.parametrize('extra', ['commissioned: 2024-05-01\n', 'labels:\n  1: roof\n'])
+def test_values_json_cannot_hold_are_not_cached(tmp_path, cache_dir, extra):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG + extra)
+    bridge._parse_config(str(path), path.read_bytes(), cache_dir)
+    assert not os.path.isdir(cache_dir) or cache_files(cache_dir) == []
+
+def test_without_cache_dir_nothing_is_written(config_file, tmp_path):
+    before = sorted(os.listdir(str(tmp_path)))
+    bridge.read_config(config_file)
+    assert sorted(os.listdir(str(tmp_path))) == before
+
+def test_import_leaves_heavy_dependencies_for_later():
+    code = ("import sys, modbus_mqtt_bridge, supervisor; "
+            "print(' '.join(name for name in ('pymodbus', 'paho', 'yaml', 'fleet', 'multiprocessing') "
+            "if name in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
@@ -0,0 +1,239 @@
+import asyncio
+import copy
+import os
+import sys
+
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import modbus_mqtt_bridge as bridge
+from fleet import FleetBridge
+from modbus_mqtt_bridge import ConfigWatcher, read_config
+
+REGISTERS = [
+    {'name': 'DC_Voltage', 'address': 30001, 'data_type': 'uint16', 'scale': 0.1},
+    {'name': 'DC_Current', 'address': 30002, 'data_type': 'uint16', 'scale': 0.1},
+    {'name': 'Total_Energy', 'address': 30010, 'data_type': 'uint32'},
+]
+
+def single_config():
+    return {
+        'modbus': {'host': '127.0.0.1', 'port': 5020, 'unit_id': 1},
+        'mqtt': {'broker': '127.0.0.1', 'topic': 'inverter', 'backpressure': 'drop_oldest'},
+        'loop_interval': 5,
+        'registers': copy.deepcopy(REGISTERS),
+    }
+
+def fleet_config():
+    config = single_config()
+    config['devices'] = [
+        {'name': 'u1', 'host': '127.0.0.1', 'port': 5021, 'unit_id': 1},
+        {'name': 'u2', 'host': '127.0.0.1', 'port': 5022, 'unit_id': 1, 'registers': copy.deepcopy(REGISTERS[:2])},
+        {'name': 'u3', 'host': '127.0.0.1', 'port': 5023, 'unit_id': 1},
+    ]
+    return config
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'config.yaml')
+
+def save(path, data):
+    with open(path, 'w') as f:
+        yaml.safe_dump(data, f)
+
+def decoders(registers):
+    return [register.decoder for register in registers]
+
+def test_unchanged_config_reuses_registers_plans_and_decoders(config_path):
+    save(config_path, fleet_config())
+    running = read_config(config_path)
+    config = read_config(config_path, previous=running)
+    assert config.registers is running.registers
+    assert config.scan_groups is running.scan_groups
+    devices = {device.name: device for device in running.devices}
+    for device in config.devices:
+        assert device.scan_groups is devices[device.name].scan_groups
+    assert config.devices[1].registers is devices['u2'].registers
+
+def test_changed_registers_are_compiled_again(config_path):
+    data = fleet_config()
+    save(config_path, data)
+    running = read_config(config_path)
+    data['registers'][0]['scale'] = 0.01
+    save(config_path, data)
+    config = read_config(config_path, previous=running)
+    assert config.registers is not running.registers
+    assert config.scan_groups is not running.scan_groups
+    assert config.registers[0].decoder.scale == 0.01
+    # u1 shares the top-level plan, u2 has its own registers, which did not change
+    assert config.devices[0].scan_groups is config.scan_groups
+    assert config.devices[1].scan_groups is running.devices[1].scan_groups
+    assert decoders(config.devices[1].registers) == decoders(running.devices[1].registers)
+
+def test_new_plan_settings_recompile_the_plans(config_path):
+    data = single_config()
+    save(config_path, data)
+    running = read_config(config_path)
+    data['max_read_gap'] = 0
+    save(config_path, data)
+    config = read_config(config_path, previous=running)
+    # The registers and their decoders are kept, the plans are built for the new gap
+    assert config.registers is running.registers
+    assert config.scan_groups is not running.scan_groups
+    assert len(config.read_plan) == 2
+
+def make_single_bridge(config_path):
+    save(config_path, single_config())
+    return bridge.ModbusMQTTBridge(read_config(config_path), config_path)
+
+@pytest.mark.parametrize('broken', [
+    'registers: [\n',
+    yaml.safe_dump({**single_config(), 'registers': [{'name': 'bad', 'address': 40001, 'data_type': 'int24'}]}),
+    yaml.safe_dump({**single_config(), 'log_format': 'xml'}),
+    yaml.safe_dump(fleet_config()),
+])
+def test_invalid_config_is_rejected_and_the_running_one_kept(config_path, broken):
+    modbus_bridge = make_single_bridge(config_path)
+    running, breaker = modbus_bridge.config, modbus_bridge._breaker
+    with open(config_path, 'w') as f:
+        f.write(broken)
+    assert not modbus_bridge._reload_config()
+    assert modbus_bridge.config is running
+    assert modbus_bridge._breaker is breaker
+
+def test_single_bridge_reconnects_only_for_new_connection_settings(config_path):
+    modbus_bridge = make_single_bridge(config_path)
+    breaker = modbus_bridge._breaker
+    data = single_config()
+    data['registers'][1]['scale'] = 1
+    save(config_path, data)
+    assert modbus_bridge._reload_config()
+    assert modbus_bridge._breaker is breaker
+    assert modbus_bridge.config.registers[1].scale == 1
+
+    data['modbus']['unit_id'] = 2
+    save(config_path, data)
+    assert modbus_bridge._reload_config()
+    assert modbus_bridge._breaker is not breaker
+    assert modbus_bridge._device_name == '127.0.0.1-5020-2'
+
+def test_restart_settings_keep_their_running_values(config_path):
+    modbus_bridge = make_single_bridge(config_path)
+    data = single_config()
+    data['mqtt']['topic'] = 'elsewhere'
+    data['loop_interval'] = 7
+    save(config_path, data)
+    assert modbus_bridge._reload_config()
+    assert modbus_bridge.config.mqtt.topic == 'inverter'
+    assert modbus_bridge.config.loop_interval == 7
+
+async def idle_poll(device, start):
+    await asyncio.Event().wait()
+
+def run_fleet(config_path, data, edit):
+    """Start polling the fleet and reload it with ``edit`` applied.
+
+    Returns whether the reload was applied, the names of the poll tasks it
+    cancelled and the tasks, breakers, devices and config before and after.
+    """
+    save(config_path, data)
+
+    async def run():
+        fleet = FleetBridge(read_config(config_path), config_path)
+        fleet._poll_device = idle_poll
+        fleet._assign(device.name for device in fleet.config.devices)
+        before = (dict(fleet._tasks), dict(fleet._breakers), dict(fleet._devices), fleet.config)
+        edit(data)
+        save(config_path, data)
+        applied = fleet._reload_config()
+        await asyncio.sleep(0)
+        cancelled = {name for name, task in before[0].items() if task.cancelled()}
+        after = (dict(fleet._tasks), dict(fleet._breakers), dict(fleet._devices), fleet.config)
+        await fleet._stop_polling()
+        return applied, cancelled, before, after
+
+    return asyncio.run(run())
+
+@pytest.mark.parametrize('setting, value', [('host', '127.0.0.2'), ('port', 6021), ('unit_id', 9)])
+def test_fleet_restarts_only_devices_with_new_connection(config_path, setting, value):
+    def edit(data):
+        data['devices'][0][setting] = value
+        data['devices'][1]['registers'][0]['scale'] = 1
+    applied, cancelled, (tasks, breakers, devices, _), (new_tasks, new_breakers, new_devices, _) = run_fleet(
+        config_path, fleet_config(), edit)
+    assert applied
+    assert cancelled == {'u1'}
+    # u1 gets a new connection, breaker and poll task
+    assert new_tasks['u1'] is not tasks['u1']
+    assert new_breakers['u1'] is not breakers['u1']
+    assert getattr(new_devices['u1'], setting) == value
+    # u2 switches read plans on its running task and connection
+    assert new_tasks['u2'] is tasks['u2']
+    assert new_breakers['u2'] is breakers['u2']
+    assert new_devices['u2'] is not devices['u2']
+    assert new_devices['u2'].registers[0].scale == 1
+    # u3 did not change at all
+    assert new_tasks['u3'] is tasks['u3']
+    assert new_breakers['u3'] is breakers['u3']
+    assert new_devices['u3'] is devices['u3']
+
+def test_fleet_rejects_config_that_fails_to_apply(config_path, monkeypatch):
+    def edit(data):
+        data['devices'].append({'name': 'u4', 'host': '127.0.0.1', 'port': 5024, 'unit_id': 1})
+        data['devices'][0]['unit_id'] = 9
+
+    # The running devices get their breakers, the new device u4 fails to get one
+    create_breaker = FleetBridge._create_breaker
+
+    def failing(self, device, name):
+        if name == 'u4':
+            raise RuntimeError("no breaker for u4")
+        return create_breaker(self, device, name)
+    monkeypatch.setattr(FleetBridge, '_create_breaker', failing)
+    applied, cancelled, (tasks, breakers, devices, config), (new_tasks, new_breakers, new_devices, new_config) = (
+        run_fleet(config_path, fleet_config(), edit))
+    assert not applied
+    assert not cancelled
+    assert new_config is config
+    assert new_tasks == tasks
+    assert new_breakers == breakers
+    assert new_devices == devices
+
+def test_watcher_reports_a_change_once_per_interval(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text('loop_interval: 5\n')
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    watcher = ConfigWatcher(str(path), interval=2.0)
+    start = watcher._next_check
+    assert not watcher.changed(start)
+
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    # Not checked again before the interval is over
+    assert not watcher.changed(start + 1.0)
+    assert watcher.changed(start + 2.0)
+    assert not watcher.changed(start + 4.0)
+
+    # Same modification time, but a different size
+    path.write_text('loop_interval: 10\n')
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert watcher.changed(start + 6.0)
+
+def test_watcher_waits_for_a_replaced_file(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text('loop_interval: 5\n')
+    watcher = ConfigWatcher(str(path), interval=1.0)
+    start = watcher._next_check
+    path.unlink()
+    assert not watcher.changed(start)
+    path.write_text('loop_interval: 50\n')
+    assert watcher.changed(start + 1.0)
+
+def test_watcher_is_disabled_without_interval(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text('loop_interval: 5\n')
+    watcher = ConfigWatcher(str(path), interval=0)
+    path.write_text('loop_interval: 50\n')
+    assert not watcher.changed(watcher._next_check + 100.0)
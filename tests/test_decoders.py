@@ -0,0 +1,175 @@
+import os
+import pickle
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from registers import DATA_TYPES, RegisterDecoder, RegisterDefinition, registers_to_bytes
+
+def decode(words, data_type, byte_order='big', scale=1.0, bits=None, offset=0):
+    decoder = RegisterDecoder(data_type, byte_order, len(words) - offset, scale, bits)
+    return decoder.decode(registers_to_bytes(words), offset * 2)
+
+# (data_type, registers as sent by a device with the most significant word first, value)
+KNOWN_VECTORS = [
+    ('int16', [0x0000], 0),
+    ('int16', [0x7FFF], 32767),
+    ('int16', [0xFFFF], -1),
+    ('int16', [0x8000], -32768),
+    ('uint16', [0xFFFF], 65535),
+    ('int32', [0xFFFF, 0xFFFE], -2),
+    ('int32', [0x8000, 0x0000], -2 ** 31),
+    ('uint32', [0x0001, 0x0002], 65538),
+    ('uint32', [0xFFFF, 0xFFFF], 2 ** 32 - 1),
+    ('float32', [0x4049, 0x0FDB], struct.unpack('>f', bytes.fromhex('40490FDB'))[0]),
+    ('float32', [0xC2F6, 0xE979], struct.unpack('>f', bytes.fromhex('C2F6E979'))[0]),
+    ('int64', [0xFFFF, 0xFFFF, 0xFFFF, 0xFFFD], -3),
+    ('int64', [0x0001, 0x0000, 0x0000, 0x0000], 2 ** 48),
+    ('uint64', [0x0123, 0x4567, 0x89AB, 0xCDEF], 0x0123456789ABCDEF),
+    ('uint64', [0xFFFF, 0xFFFF, 0xFFFF, 0xFFFF], 2 ** 64 - 1),
+    ('float64', [0x4009, 0x21FB, 0x5444, 0x2D18], 3.141592653589793),
+    ('float64', [0xC0FE, 0x2400, 0x0000, 0x0000], -123456.0),
+]
+
+@pytest.mark.parametrize('data_type, words, value', KNOWN_VECTORS)
+def test_known_vectors_big_word_order(data_type, words, value):
+    assert decode(words, data_type) == value
+
+@pytest.mark.parametrize('data_type, words, value', KNOWN_VECTORS)
+def test_little_word_order_puts_most_significant_register_last(data_type, words, value):
+    assert decode(words[::-1], data_type, 'little') == value
+
+def test_int16_is_signed():
+    # Decoded as unsigned, a small negative reading would show as 65535
+    assert decode([0xFFFF], 'int16') == -1
+    assert decode([0xFFF6], 'int16', scale=0.1) == pytest.approx(-1.0)
+
+def test_word_order_only_swaps_whole_registers():
+    # Bytes inside a register stay big-endian, only the register order changes
+    assert decode([0x0102, 0x0304], 'uint32', 'big') == 0x01020304
+    assert decode([0x0102, 0x0304], 'uint32', 'little') == 0x03040102
+    assert decode([0x0102, 0x0304, 0x0506, 0x0708], 'uint64', 'little') == 0x0708050603040102
+
+def test_array_of_values_swaps_words_per_value():
+    words = [0x0000, 0x0001, 0x0000, 0x0002]
+    assert decode(words, 'uint32') == [1, 2]
+    assert decode([0x0001, 0x0000, 0x0002, 0x0000], 'uint32', 'little') == [1, 2]
+    assert decode([0x0001, 0xFFFF], 'int16', scale=0.5) == [0.5, -0.5]
+
+def test_decodes_at_block_offset():
+    words = [0xAAAA, 0xBBBB, 0x0000, 0x002A]
+    assert decode(words, 'uint32', offset=2) == 42
+
+def test_scale_is_applied_to_numbers():
+    assert decode([0x0000, 0x03E8], 'uint32', scale=0.01) == pytest.approx(10.0)
+    assert isinstance(decode([0x0064], 'uint16'), int)
+
+@pytest.mark.parametrize('byte_order, words', [('big', [0x4142, 0x4300]), ('little', [0x4241, 0x0043])])
+def test_string_decoding(byte_order, words):
+    assert decode(words, 'string', byte_order) == 'ABC'
+
+def test_string_strips_padding():
+    assert decode([0x4F4B, 0x2020, 0x0000], 'string') == 'OK'
+
+def test_bitfield_without_names_is_the_raw_value():
+    assert decode([0x8001], 'bitfield') == 0x8001
+    assert decode([0x0001, 0x8000], 'bitfield') == 0x00018000
+    assert decode([0x8000, 0x0001], 'bitfield', 'little') == 0x00018000
+
+def test_bitfield_with_names_is_a_flag_mapping():
+    bits = {'running': 0, 'fault': 3, 'derated': 17}
+    assert decode([0x0002, 0x0009], 'bitfield', bits=bits) == {'running': True, 'fault': True, 'derated': True}
+    assert decode([0x0000, 0x0001], 'bitfield', bits=bits) == {'running': True, 'fault': False,
+                                                               'derated': False}
+
+ROUND_TRIP_VALUES = {
+    'int16': [-32768, -1, 0, 1234, 32767],
+    'uint16': [0, 1, 65535],
+    'int32': [-2 ** 31, -70000, 70000, 2 ** 31 - 1],
+    'uint32': [0, 65536, 2 ** 32 - 1],
+    'float32': [-1.5, 0.0, 0.25, 1024.125],
+    'int64': [-2 ** 63, -5, 2 ** 40 + 3, 2 ** 63 - 1],
+    'uint64': [0, 2 ** 33, 2 ** 64 - 1],
+    'float64': [-1e-300, 0.1, 6.02214076e23],
+}
+
+@pytest.mark.parametrize('byte_order', ['big', 'little'])
+@pytest.mark.parametrize('data_type', sorted(ROUND_TRIP_VALUES))
+def test_encode_round_trips(data_type, byte_order):
+    decoder = RegisterDecoder(data_type, byte_order, DATA_TYPES[data_type][1])
+    for value in ROUND_TRIP_VALUES[data_type]:
+        words = decoder.encode(value)
+        assert len(words) == decoder.count
+        assert all(0 <= word <= 0xFFFF for word in words)
+        assert decoder.decode(registers_to_bytes(words)) == value
+
+@pytest.mark.parametrize('byte_order', ['big', 'little'])
+def test_encode_matches_known_vectors(byte_order):
+    for data_type, words, value in KNOWN_VECTORS:
+        decoder = RegisterDecoder(data_type, byte_order, len(words))
+        assert decoder.encode(value) == (words if byte_order == 'big' else words[::-1])
+
+def test_encode_undoes_scale_and_clamps_integers():
+    decoder = RegisterDecoder('int16', 'big', 1, scale=0.1)
+    assert decoder.encode(-12.3) == [(-123) & 0xFFFF]
+    assert decoder.encode(1e9) == [0x7FFF]
+    assert RegisterDecoder('uint16', 'big', 1).encode(-5) == [0]
+
+def test_encode_arrays_strings_and_bitfields():
+    assert RegisterDecoder('uint32', 'little', 4).encode([1, 2]) == [1, 0, 2, 0]
+    strings = RegisterDecoder('string', 'little', 2)
+    assert strings.decode(registers_to_bytes(strings.encode('ABCDEF'))) == 'ABCD'
+    bitfield = RegisterDecoder('bitfield', 'big', 2, bits={'running': 0, 'derated': 17})
+    assert bitfield.encode({'running': True, 'derated': True, 'unknown': True}) == [0x0002, 0x0001]
+    assert RegisterDecoder('bitfield', 'little', 2).encode(0x00018000) == [0x8000, 0x0001]
+
+def test_decoder_survives_pickling():
+    decoder = RegisterDecoder('float32', 'little', 4, 0.5)
+    words = decoder.encode([1.0, -2.0])
+    assert pickle.loads(pickle.dumps(decoder)).decode(registers_to_bytes(words)) == [1.0, -2.0]
+
+@pytest.mark.parametrize('data_type, width', [('int16', 1), ('uint32', 2), ('float32', 2), ('int64', 4),
+                                              ('uint64', 4), ('float64', 4), ('string', 1), ('bitfield', 1)])
+def test_count_one_widens_to_type_width(data_type, width):
+    register = RegisterDefinition('value', 40001, data_type=data_type)
+    assert register.count == width
+    assert register.decoder.count == width
+    assert register.decoder.values == 1
+
+def test_explicit_count_reads_several_values():
+    register = RegisterDefinition('values', 40001, count=6, data_type='uint32')
+    assert register.decoder.values == 3
+
+@pytest.mark.parametrize('address, register_type, expected_type, expected_address', [
+    (30001, '', 'input', 0),
+    (30010, '', 'input', 9),
+    (40001, '', 'holding', 0),
+    (40101, '', 'holding', 100),
+    (5, '', 'holding', 5),
+    (5, 'input', 'input', 5),
+])
+def test_post_init_maps_user_addresses(address, register_type, expected_type, expected_address):
+    register = RegisterDefinition('value', address, register_type=register_type)
+    assert (register.register_type, register.address) == (expected_type, expected_address)
+    assert RegisterDefinition('again', register.display_address).address == expected_address
+
+@pytest.mark.parametrize('kwargs, message', [
+    ({'data_type': 'int24'}, 'unknown data_type'),
+    ({'byte_order': 'middle'}, 'unknown byte_order'),
+    ({'register_type': 'coil'}, 'unknown register_type'),
+    ({'deadband_type': 'relative'}, 'unknown deadband_type'),
+    ({'publish': 'never'}, 'unknown publish mode'),
+    ({'count': 3, 'data_type': 'uint32'}, 'multiple of 2'),
+    ({'count': 126}, 'between 1 and 125'),
+    ({'count': 0}, 'between 1 and 125'),
+    ({'address': 30001, 'writable': True}, 'only holding registers'),
+    ({'publish': 'aggregate', 'data_type': 'string'}, 'only single numeric values'),
+    ({'publish': 'both', 'count': 2}, 'only single numeric values'),
+])
+def test_post_init_rejects_invalid_definitions(kwargs, message):
+    kwargs = {'address': 40001, **kwargs}
+    with pytest.raises(ValueError, match=message):
+        RegisterDefinition('bad', **kwargs)
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from log_writer import BackgroundLogHandler, JsonFormatter, RateLimiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.closed = False
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+def make_record(message, level=logging.WARNING, name='device'):
+    return logging.LogRecord(name, level, __file__, 1, message, None, None)
+
+def make_logger(handler):
+    logger = logging.getLogger(f"test_log_writer.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    return logger
+
+def test_rate_limiter_suppresses_repeats_within_window():
+    clock = FakeClock()
+    limiter = RateLimiter(interval=60.0, clock=clock)
+    assert limiter.check(make_record("read failed")) == (True, None)
+    assert limiter.check(make_record("read failed")) == (False, None)
+    assert limiter.check(make_record("read failed")) == (False, None)
+    # Another message, level or logger has its own window
+    assert limiter.check(make_record("write failed")) == (True, None)
+    assert limiter.check(make_record("read failed", logging.ERROR)) == (True, None)
+    assert limiter.check(make_record("read failed", name='other')) == (True, None)
+
+def test_rate_limiter_summarizes_suppressed_records_when_window_ends():
+    clock = FakeClock()
+    limiter = RateLimiter(interval=60.0, clock=clock)
+    for _ in range(3):
+        limiter.check(make_record("read failed"))
+    clock.now += 60.0
+    allowed, summary = limiter.check(make_record("read failed"))
+    assert allowed
+    assert summary.getMessage() == "read failed (2 suppressed in last 60s)"
+    assert summary.suppressed == 2
+    assert summary.levelno == logging.WARNING
+    assert summary.name == 'device'
+
+def test_rate_limiter_lets_burst_through():
+    limiter = RateLimiter(interval=60.0, burst=3, clock=FakeClock())
+    assert [limiter.check(make_record("read failed"))[0] for _ in range(5)] == [True, True, True, False, False]
+
+def test_rate_limiter_expired_reports_only_windows_with_suppressed_records():
+    clock = FakeClock()
+    limiter = RateLimiter(interval=60.0, clock=clock)
+    limiter.check(make_record("once"))
+    for _ in range(4):
+        limiter.check(make_record("often"))
+    assert limiter.expired() == []
+    clock.now += 61.0
+    summaries = limiter.expired()
+    assert [summary.getMessage() for summary in summaries] == ["often (3 suppressed in last 60s)"]
+    # Both windows are forgotten, so the next record starts a new one
+    assert limiter.expired(all_windows=True) == []
+    assert limiter.check(make_record("often")) == (True, None)
+
+def test_background_handler_writes_everything_on_close():
+    target = CollectingHandler()
+    background = BackgroundLogHandler([target])
+    background.start()
+    logger = make_logger(background)
+    for index in range(100):
+        logger.info("sample %d", index)
+    background.close()
+    assert [record.getMessage() for record in target.records] == [f"sample {index}" for index in range(100)]
+    assert target.closed
+
+def test_background_handler_renders_message_when_logged():
+    target = CollectingHandler()
+    background = BackgroundLogHandler([target])
+    logger = make_logger(background)
+    values = [1]
+    logger.info("values %s", values)
+    values.append(2)
+    background.start()
+    background.close()
+    assert target.records[0].getMessage() == "values [1]"
+
+def test_background_handler_drops_and_reports_when_queue_is_full():
+    target = CollectingHandler()
+    background = BackgroundLogHandler([target], queue_size=2)
+    logger = make_logger(background)
+    # The writer is not running yet, so the queue fills up
+    for index in range(5):
+        logger.info("sample %d", index)
+    assert background.dropped == 3
+
+    background.start()
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline and len(target.records) < 3:
+        time.sleep(0.05)
+    background.close()
+    messages = [record.getMessage() for record in target.records]
+    assert messages == ["sample 0", "sample 1", "Log queue full, dropped 3 records"]
+
+def test_background_handler_flushes_suppression_summaries_on_close():
+    target = CollectingHandler()
+    background = BackgroundLogHandler([target], limiter=RateLimiter(interval=60.0, clock=FakeClock()))
+    background.start()
+    logger = make_logger(background)
+    for _ in range(4):
+        logger.warning("device 3 not responding")
+    logger.info("cycle done")
+    logger.info("cycle done")
+    background.close()
+    messages = [record.getMessage() for record in target.records]
+    # Records below the rate limit level are never suppressed
+    assert messages == ["device 3 not responding", "cycle done", "cycle done",
+                        "device 3 not responding (3 suppressed in last 60s)"]
+
+def test_json_formatter_includes_suppressed_count():
+    limiter = RateLimiter(interval=60.0, clock=FakeClock())
+    for _ in range(3):
+        limiter.check(make_record("read failed"))
+    summary = limiter.expired(all_windows=True)[0]
+    entry = json.loads(JsonFormatter().format(summary))
+    assert entry["message"] == "read failed (2 suppressed in last 60s)"
+    assert entry["suppressed"] == 2
+    assert entry["level"] == "WARNING"
+    assert entry["logger"] == "device"
@@ -0,0 +1,259 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+from modbus_pipeline import (MBAP_HEADER, AsyncPipelinedModbusClient, PipelinedModbusClient,
+                             RegisterResponse)
+from sim_server import FaultProfile, SimulatorServer, VirtualDevice
+
+UNITS = (1, 2)
+
+def make_device(unit_id):
+    device = VirtualDevice(unit_id, 100)
+    device.write('holding', 0, [unit_id * 1000 + address for address in range(100)])
+    return device
+
+def expected(unit_id, address, count):
+    return [unit_id * 1000 + offset for offset in range(address, address + count)]
+
+@pytest.fixture
+def simulator():
+    """A SimulatorServer with units 1 and 2 on one port, served from a background event loop"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = SimulatorServer('127.0.0.1')
+    for unit_id in UNITS:
+        server.add_device(port, make_device(unit_id))
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    assert ready.wait(5)
+    server.port = port
+    yield server
+
+    async def shutdown():
+        await server.stop()
+        connections = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+class ScriptedServer:
+    """Accepts one connection, collects ``count`` requests and answers them with ``respond``.
+
+    ``respond`` gets the requests as (transaction id, unit id, PDU) and
+    returns the raw bytes to send back, answered by the simulator's devices
+    or deliberately broken.
+    """
+
+    def __init__(self, count, respond):
+        self.count = count
+        self.respond = respond
+        self.simulator = SimulatorServer()
+        self.devices = {unit_id: make_device(unit_id) for unit_id in UNITS}
+        self._sock = socket.create_server(('127.0.0.1', 0))
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def answer(self, transaction_id, unit_id, pdu, response_unit=None):
+        response = self.simulator.process(self.devices.get(unit_id), pdu)
+        unit = unit_id if response_unit is None else response_unit
+        return MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit) + response
+
+    def _serve(self):
+        conn, _ = self._sock.accept()
+        with conn:
+            buffer = b''
+            requests = []
+            while len(requests) < self.count:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                buffer += data
+                while len(buffer) >= MBAP_HEADER.size:
+                    transaction_id, _, length, unit_id = MBAP_HEADER.unpack_from(buffer)
+                    end = MBAP_HEADER.size + length - 1
+                    if len(buffer) < end:
+                        break
+                    requests.append((transaction_id, unit_id, buffer[MBAP_HEADER.size:end]))
+                    buffer = buffer[end:]
+            conn.sendall(self.respond(requests))
+            # Hold the connection open until the client closes it
+            while conn.recv(4096):
+                pass
+
+    def close(self):
+        self._sock.close()
+
+def read_requests(count):
+    return [(3, address * 10, 5) for address in range(count)]
+
+def connect(port, timeout=1.0, window=8):
+    client = PipelinedModbusClient('127.0.0.1', port, timeout=timeout, window=window)
+    assert client.connect()
+    return client
+
+def test_read_blocks_returns_responses_in_request_order(simulator):
+    client = connect(simulator.port, window=3)
+    responses = client.read_blocks(read_requests(8), 2)
+    assert [response.registers for response in responses] == [expected(2, address * 10, 5)
+                                                               for address in range(8)]
+    client.close()
+
+def test_read_blocks_matches_out_of_order_responses():
+    server = ScriptedServer(4, lambda requests: b''.join(server.answer(*request)
+                                                         for request in reversed(requests)))
+    client = connect(server.port, window=4)
+    responses = client.read_blocks(read_requests(4), 1)
+    assert [response.registers for response in responses] == [expected(1, address * 10, 5)
+                                                               for address in range(4)]
+    assert client.connected
+    client.close()
+    server.close()
+
+def test_read_blocks_times_out_and_closes_on_late_response(simulator):
+    simulator.set_faults({(simulator.port, 1): FaultProfile(delay_ms=500)})
+    client = connect(simulator.port, timeout=0.1, window=4)
+    responses = client.read_blocks(read_requests(3), 1)
+    assert all(isinstance(response, ModbusIOException) for response in responses)
+    # Closed, so the late answers cannot be taken for the next cycle's
+    assert not client.connected
+
+    simulator.set_faults({})
+    assert client.connect()
+    responses = client.read_blocks([(3, 40, 5)], 1)
+    assert responses[0].registers == expected(1, 40, 5)
+    client.close()
+
+@pytest.mark.parametrize('length', [0, 1])
+def test_read_blocks_rejects_frame_too_short_for_a_pdu(length):
+    def respond(requests):
+        transaction_id, unit_id, pdu = requests[0]
+        return MBAP_HEADER.pack(transaction_id, 0, length, unit_id) + server.answer(*requests[1])
+    server = ScriptedServer(2, respond)
+    client = connect(server.port)
+    responses = client.read_blocks(read_requests(2), 1)
+    assert all(isinstance(response, ConnectionException) for response in responses)
+    assert not client.connected
+    server.close()
+
+def test_read_blocks_rejects_other_protocol_id():
+    def respond(requests):
+        transaction_id, unit_id, pdu = requests[0]
+        return MBAP_HEADER.pack(transaction_id, 1, 3, unit_id) + b'\x03\x00'
+    server = ScriptedServer(1, respond)
+    client = connect(server.port)
+    assert isinstance(client.read_blocks(read_requests(1), 1)[0], ConnectionException)
+    assert not client.connected
+    server.close()
+
+def test_read_blocks_rejects_response_from_other_unit():
+    server = ScriptedServer(2, lambda requests: b''.join(server.answer(*request, response_unit=2)
+                                                         for request in requests))
+    client = connect(server.port)
+    responses = client.read_blocks(read_requests(2), 1)
+    assert all(isinstance(response, ConnectionException) for response in responses)
+    assert not client.connected
+    server.close()
+
+def test_write_then_read_back(simulator):
+    client = connect(simulator.port)
+    assert not client.write(20, [7, 8], 1).isError()
+    assert client.read_blocks([(3, 20, 2)], 1)[0].registers == [7, 8]
+    client.close()
+
+def test_async_client_matches_out_of_order_responses(simulator):
+    # A gateway answers a slow unit after a fast one that was asked later
+    simulator.set_faults({(simulator.port, 1): FaultProfile(latency_ms=200)})
+
+    async def run():
+        client = AsyncPipelinedModbusClient('127.0.0.1', simulator.port, timeout=1.0, window=4)
+        assert await client.connect()
+        finished = []
+
+        async def read(unit_id, address):
+            response = await client.read((3, address, 5), unit_id)
+            finished.append(unit_id)
+            return response
+
+        responses = await asyncio.gather(read(1, 0), read(2, 10), read(1, 20), read(2, 30))
+        client.close()
+        return finished, responses
+
+    finished, responses = asyncio.run(run())
+    assert finished == [2, 2, 1, 1]
+    assert [response.registers for response in responses] == [
+        expected(1, 0, 5), expected(2, 10, 5), expected(1, 20, 5), expected(2, 30, 5)]
+
+def test_async_client_discards_late_response(simulator):
+    simulator.set_faults({(simulator.port, 1): FaultProfile(latency_ms=300)})
+
+    async def run():
+        client = AsyncPipelinedModbusClient('127.0.0.1', simulator.port, timeout=0.1, window=4,
+                                            close_on_timeout=False)
+        assert await client.connect()
+        with pytest.raises(ModbusIOException):
+            await client.read((3, 0, 5), 1)
+        first = await client.read((3, 10, 5), 2)
+        # Let the late answer of unit 1 arrive before the next read
+        await asyncio.sleep(0.4)
+        second = await client.read((3, 20, 5), 2)
+        connected = client.connected
+        client.close()
+        return first, second, connected
+
+    first, second, connected = asyncio.run(run())
+    assert first.registers == expected(2, 10, 5)
+    assert second.registers == expected(2, 20, 5)
+    assert connected
+
+@pytest.mark.parametrize('broken', ['length', 'unit'])
+def test_async_client_rejects_malformed_frame(broken):
+    def respond(requests):
+        transaction_id, unit_id, pdu = requests[0]
+        if broken == 'length':
+            return MBAP_HEADER.pack(transaction_id, 0, 1, unit_id) + server.answer(*requests[0])
+        return server.answer(transaction_id, unit_id, pdu, response_unit=unit_id + 1)
+    server = ScriptedServer(1, respond)
+
+    async def run():
+        client = AsyncPipelinedModbusClient('127.0.0.1', server.port, timeout=1.0)
+        assert await client.connect()
+        try:
+            with pytest.raises(ConnectionException):
+                await client.read((3, 0, 5), 1)
+            return client.connected
+        finally:
+            client.close()
+
+    assert not asyncio.run(run())
+    server.close()
+
+def test_not_connected_fails_every_request():
+    client = PipelinedModbusClient('127.0.0.1', 1, timeout=0.1)
+    responses = client.read_blocks(read_requests(2), 1)
+    assert all(isinstance(response, ConnectionException) for response in responses)
+    assert not isinstance(responses[0], RegisterResponse)
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import modbus_mqtt_bridge as bridge
+from read_plan import ReadBlock, ScanGroup, build_read_plan, replace_read_block, split_read_block
+from registers import MAX_READ_REGISTERS, RegisterDefinition
+from sim_server import FaultProfile, SimulatorServer, VirtualDevice
+
+def spans(plan):
+    return [(block.register_type, block.address, block.count) for block in plan]
+
+def names(block):
+    return [register.name for register in block.registers]
+
+def registers(*addresses, **kwargs):
+    return [RegisterDefinition(f"r{address}", address, **kwargs) for address in addresses]
+
+def test_merges_gap_up_to_max_gap():
+    # 40001 ends at 0, 40012 starts at 11: a hole of exactly 10 registers
+    assert spans(build_read_plan(registers(40001, 40012), max_gap=10)) == [('holding', 0, 12)]
+
+def test_splits_gap_over_max_gap():
+    assert spans(build_read_plan(registers(40001, 40013), max_gap=10)) == [('holding', 0, 1), ('holding', 12, 1)]
+    assert spans(build_read_plan(registers(40001, 40002, 40004), max_gap=0)) == [('holding', 0, 2),
+                                                                                 ('holding', 3, 1)]
+
+def test_gap_counts_from_end_of_wide_register():
+    plan = build_read_plan(registers(40001, data_type='float64') + registers(40015), max_gap=10)
+    assert spans(plan) == [('holding', 0, 15)]
+
+def test_blocks_are_capped_at_125_registers():
+    plan = build_read_plan(registers(*range(40001, 40301, 2)), max_gap=10)
+    assert all(block.count <= MAX_READ_REGISTERS for block in plan)
+    assert spans(plan)[:2] == [('holding', 0, 125), ('holding', 126, 125)]
+    assert sum(len(block.registers) for block in plan) == 150
+
+def test_max_block_size_cannot_exceed_protocol_limit():
+    plan = build_read_plan(registers(*range(40001, 40301)), max_gap=10, max_block_size=500)
+    assert max(block.count for block in plan) == MAX_READ_REGISTERS
+
+def test_register_wider_than_block_is_rejected():
+    with pytest.raises(ValueError, match='more than the maximum block size of 4'):
+        build_read_plan(registers(40001, data_type='uint32', count=6), max_block_size=4)
+
+def test_overlapping_registers_share_a_block():
+    regs = [RegisterDefinition('total', 40001, data_type='uint32'),
+            RegisterDefinition('high_word', 40001, data_type='uint16'),
+            RegisterDefinition('low_word', 40002, data_type='uint16')]
+    plan = build_read_plan(regs)
+    assert spans(plan) == [('holding', 0, 2)]
+    assert sorted(names(plan[0])) == ['high_word', 'low_word', 'total']
+
+def test_input_and_holding_registers_get_separate_blocks():
+    plan = build_read_plan(registers(30001, 30002, 40001, 40002))
+    assert spans(plan) == [('holding', 0, 2), ('input', 0, 2)]
+    assert [block.function_code for block in plan] == [3, 4]
+    assert [block.label for block in plan] == ['40001-40002', '30001-30002']
+
+def test_3xxxx_addresses_map_to_input_registers():
+    register = RegisterDefinition('voltage', 30010)
+    assert (register.register_type, register.address) == ('input', 9)
+    assert build_read_plan([register])[0].function_code == 4
+
+def test_split_cuts_block_at_holes():
+    block = build_read_plan(registers(30001, 30002, 30006, 30007, 30009))[0]
+    assert spans([block]) == [('input', 0, 9)]
+    assert spans(split_read_block(block)) == [('input', 0, 2), ('input', 5, 2), ('input', 8, 1)]
+
+def test_split_of_a_single_run_reads_each_register():
+    block = build_read_plan(registers(40001, 40002, 40003))[0]
+    assert spans(split_read_block(block)) == [('holding', 0, 1), ('holding', 1, 1), ('holding', 2, 1)]
+
+def test_replace_read_block_swaps_block_in_its_group():
+    fast = ScanGroup('1s', 1.0, read_plan=build_read_plan(registers(40001)))
+    slow = ScanGroup('10s', 10.0, read_plan=build_read_plan(registers(40101, 40103, 40201)))
+    block = slow.read_plan[0]
+    parts = split_read_block(block)
+    replace_read_block([fast, slow], block, parts)
+    assert spans(slow.read_plan) == [('holding', 100, 1), ('holding', 102, 1), ('holding', 200, 1)]
+    assert spans(fast.read_plan) == [('holding', 0, 1)]
+
+def test_replace_read_block_ignores_unknown_block():
+    group = ScanGroup('1s', 1.0, read_plan=build_read_plan(registers(40001)))
+    replace_read_block([group], ReadBlock('holding', 0, 1), [])
+    assert spans(group.read_plan) == [('holding', 0, 1)]
+
+@pytest.fixture
+def holey_device():
+    """A simulated device answering Illegal Data Address for 30003-30005 and 30008"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    device = VirtualDevice(1, 20)
+    device.write('input', 0, [100 + address for address in range(20)])
+    server = SimulatorServer('127.0.0.1')
+    server.add_device(port, device)
+    server.set_faults({(port, None): FaultProfile(exceptions=[{'start': 30003, 'end': 30005},
+                                                              {'start': 30008, 'end': 30008}])})
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    assert ready.wait(5)
+    yield port
+
+    async def shutdown():
+        await server.stop()
+        connections = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+@pytest.mark.parametrize('pipeline_window', [1, 4])
+def test_illegal_data_address_splits_block_and_remembers_split(holey_device, tmp_path, monkeypatch, caplog,
+                                                               pipeline_window):
+    monkeypatch.chdir(tmp_path)
+    regs = registers(30001, 30002, 30006, 30007, 30009)
+    config = bridge.AppConfig(
+        modbus=bridge.ModbusConfig(host='127.0.0.1', port=holey_device, timeout=1,
+                                   pipeline_window=pipeline_window),
+        mqtt=bridge.MQTTConfig(broker='127.0.0.1', backpressure='drop_oldest'),
+        registers=regs)
+    modbus_bridge = bridge.ModbusMQTTBridge(config)
+    groups = config.scan_groups
+    assert spans(groups[0].read_plan) == [('input', 0, 9)]
+    expected = {'r30001': 100, 'r30002': 101, 'r30006': 105, 'r30007': 106, 'r30009': 108}
+    try:
+        with caplog.at_level(logging.WARNING):
+            for _ in range(3):
+                data = modbus_bridge._read_registers()['data']
+                assert {name: entry['value'] for name, entry in data.items()} == expected
+                assert spans(groups[0].read_plan) == [('input', 0, 2), ('input', 5, 2), ('input', 8, 1)]
+    finally:
+        if modbus_bridge._modbus_client is not None:
+            modbus_bridge._modbus_client.close()
+    # Only the first cycle hit the hole, later cycles read the remembered parts
+    assert len([record for record in caplog.records if 'smaller blocks' in record.getMessage()]) == 1
@@ -0,0 +1,111 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from store_forward import RECORD_HEADER, SEGMENT_SUFFIX, SegmentedLog
+
+def payloads(count, start=0):
+    return [f"record-{index:03d}".encode() for index in range(start, start + count)]
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+def test_replays_unacknowledged_records_after_reopen(tmp_path):
+    log = SegmentedLog(str(tmp_path))
+    for payload in payloads(5):
+        log.append(payload)
+    log.close()
+
+    log = SegmentedLog(str(tmp_path))
+    assert log.pending == 5
+    assert log.read(10) == list(enumerate(payloads(5)))
+    for seq in range(5):
+        log.ack(seq)
+    log.close()
+
+    log = SegmentedLog(str(tmp_path))
+    assert log.pending == 0
+    assert log.read(10) == []
+
+def test_truncates_record_torn_mid_write(tmp_path):
+    log = SegmentedLog(str(tmp_path))
+    for payload in payloads(3):
+        log.append(payload)
+    log.close()
+
+    # Cut the last record off halfway through its payload, like a power cut
+    path = os.path.join(str(tmp_path), segment_files(str(tmp_path))[-1])
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    log = SegmentedLog(str(tmp_path))
+    assert log.pending == 2
+    assert os.path.getsize(path) == 2 * (RECORD_HEADER.size + len(payloads(1)[0]))
+    # The sequence number of the torn record is reused by the next append
+    assert log.append(b'after restart') == 2
+    assert log.read(10) == list(enumerate(payloads(2))) + [(2, b'after restart')]
+    log.close()
+
+def test_skips_corrupt_record_in_older_segment(tmp_path):
+    log = SegmentedLog(str(tmp_path), segment_bytes=40)
+    for payload in payloads(6):
+        log.append(payload)
+    log.close()
+    assert len(segment_files(str(tmp_path))) > 1
+
+    # Flip a payload byte of the second record of the first segment
+    path = os.path.join(str(tmp_path), segment_files(str(tmp_path))[0])
+    offset = RECORD_HEADER.size + len(payloads(1)[0]) + RECORD_HEADER.size
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    log = SegmentedLog(str(tmp_path), segment_bytes=40)
+    expected = list(enumerate(payloads(6)))
+    assert log.read(10) == expected[:1] + expected[2:]
+    log.close()
+
+def test_ack_cursor_advances_over_contiguous_acks_only(tmp_path):
+    log = SegmentedLog(str(tmp_path))
+    for payload in payloads(5):
+        log.append(payload)
+    assert len(log.read(10)) == 5
+    for seq in (0, 1, 3):
+        log.ack(seq)
+    assert log.pending == 3
+    log.close()
+
+    # Record 3 was acknowledged out of order, it is replayed with 2 and 4
+    log = SegmentedLog(str(tmp_path))
+    assert log.pending == 3
+    assert [seq for seq, _ in log.read(10)] == [2, 3, 4]
+    log.close()
+
+def test_deletes_fully_acknowledged_segments(tmp_path):
+    log = SegmentedLog(str(tmp_path), segment_bytes=40)
+    for payload in payloads(9):
+        log.append(payload)
+    assert len(segment_files(str(tmp_path))) == 3
+    for seq, _ in log.read(10):
+        log.ack(seq)
+    assert len(segment_files(str(tmp_path))) == 1
+    log.close()
+
+def test_drops_oldest_segment_over_size_cap(tmp_path):
+    log = SegmentedLog(str(tmp_path), segment_bytes=40, max_bytes=80)
+    for payload in payloads(12):
+        log.append(payload)
+    assert log.size <= 80 + RECORD_HEADER.size + len(payloads(1)[0])
+    assert log.dropped > 0
+    dropped = log.dropped
+    assert log.read(20) == list(enumerate(payloads(12)))[dropped:]
+    log.close()
+
+    # The dropped records are not replayed after a restart
+    log = SegmentedLog(str(tmp_path), segment_bytes=40, max_bytes=80)
+    assert log.pending == 12 - dropped
+    assert [seq for seq, _ in log.read(20)] == list(range(dropped, 12))
+    log.close()